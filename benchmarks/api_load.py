@@ -0,0 +1,197 @@
+"""
+in-process load test of the web api, drives Server().app directly without a socket
+
+    python -m benchmarks.api_load --users 100000 --sessions 100000 --concurrency 8 --requests 2000
+
+results are compared with benchmarks/baselines/api_load-<users>-<sessions>[-signed].json when it exists. the
+committed ones are the default parameters (with and without --signed-tokens) measured on one machine, numbers only
+compare on the same hardware: record your own first with --save-baseline, then run again after a change
+"""
+import argparse
+import concurrent.futures
+import datetime
+import io
+import json
+import logging
+import pathlib
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from nyutils.database import init_database, use_database
+from nyutils.migrate import migrate
+from nyutils.logging import install
+from nyutils.password import make_password
+from simple_league.m_server import Server
+from simple_league.m_server.models import WebUser, WebSession, WebPermission, SysCfg
+
+from .common import latency_summary, environment, finish
+
+logger = logging.getLogger(__name__)
+PASSWORD = 'bench-password'
+POOL_SIZE = 200  # users logged in up front for the authenticated flows, never used by the login flow
+BATCH = 5000
+
+
+def seed(n_users: int, n_sessions: int):
+    password = make_password(PASSWORD)  # one hash for everyone, hashing a million passwords is not what is measured
+    now = datetime.datetime.now()
+    with use_database.atomic():
+        WebUser.create(username='bench_admin', password=password, permissions=[WebPermission.USER, WebPermission.MANAGER, WebPermission.ADMIN])
+        for start in range(0, n_users, BATCH):
+            WebUser.insert_many([
+                {'username': f'user{i}', 'password': password, 'permissions': [WebPermission.USER],
+                 'permission_mask': WebPermission.mask([WebPermission.USER]), 'data': {'nickname': f'nick{i}'}}
+                for i in range(start, min(start + BATCH, n_users))
+            ]).execute()
+        for start in range(0, n_sessions, BATCH):
+            WebSession.insert_many([
+                {'user': 2 + i % n_users, 'token': f'seed-{i}', 'unique_type': 0, 'created_at': now, 'valid_until': now + datetime.timedelta(days=30), 'data': {}}
+                for i in range(start, min(start + BATCH, n_sessions))
+            ]).execute()
+        SysCfg.set_value('bench/value', 0)
+
+
+class WsgiClient:
+    def __init__(self, app):
+        self.app = app
+
+    def request(self, method, path, body=None, token=None):
+        data = json.dumps(body).encode() if body is not None else b''
+        environ = {
+            'REQUEST_METHOD': method,
+            'PATH_INFO': path,
+            'QUERY_STRING': '',
+            'SERVER_NAME': 'bench',
+            'SERVER_PORT': '80',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'REMOTE_ADDR': '127.0.0.1',
+            'CONTENT_TYPE': 'application/json',
+            'CONTENT_LENGTH': str(len(data)),
+            'wsgi.input': io.BytesIO(data),
+            'wsgi.errors': sys.stderr,
+            'wsgi.url_scheme': 'http',
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+            'wsgi.version': (1, 0),
+        }
+        if token:
+            environ['HTTP_COOKIE'] = f'session={token}'
+        status = []
+        body = b''.join(self.app(environ, lambda s, h, exc_info=None: status.append(s)))
+        return int(status[0].split(' ', 1)[0]), body
+
+
+def make_flows(client: WsgiClient, n_users: int, user_tokens: list[str], admin_token: str):
+    counter = iter(range(1 << 62))
+    lock = threading.Lock()
+
+    def next_i():
+        with lock:
+            return next(counter)
+
+    def login():
+        return client.request('POST', '/api/server/login', {'username': f'user{random.randrange(POOL_SIZE, n_users)}', 'password': PASSWORD})
+
+    def current_user():
+        return client.request('GET', '/api/server/current_user', token=random.choice(user_tokens))
+
+    def public_cfg():
+        return client.request('GET', '/api/server/public_cfg')
+
+    def list_users():
+        page = random.randrange(1, max(2, n_users // 50))
+        return client.request('POST', '/api/server/admin/list_users', {'page': page, 'page_size': 50, 'query': None}, token=admin_token)
+
+    def list_users_query():
+        return client.request('POST', '/api/server/admin/list_users', {'page': 1, 'page_size': 50, 'query': {'value': f'user{random.randrange(n_users)}'}}, token=admin_token)
+
+    def set_cfg():
+        return client.request('POST', '/api/server/admin/set_cfg', {'key': 'bench/value', 'value': next_i()}, token=admin_token)
+
+    return {
+        'login': login,
+        'current_user': current_user,
+        'public_cfg': public_cfg,
+        'admin/list_users': list_users,
+        'admin/list_users?query': list_users_query,
+        'admin/set_cfg': set_cfg,
+    }
+
+
+def run_flow(flow, n_requests: int, concurrency: int) -> dict:
+    def worker(count):
+        latencies, errors = [], 0
+        for _ in range(count):
+            start = time.perf_counter()
+            status, body = flow()
+            latencies.append(time.perf_counter() - start)
+            if status != 200 or not json.loads(body).get('success'):
+                errors += 1
+        return latencies, errors
+
+    per_worker = [n_requests // concurrency + (i < n_requests % concurrency) for i in range(concurrency)]
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(worker, per_worker))
+    elapsed = time.perf_counter() - start
+    return latency_summary([l for r in results for l in r[0]], elapsed, sum(r[1] for r in results))
+
+
+def main():
+    argp = argparse.ArgumentParser()
+    argp.add_argument('--users', type=int, default=1000)
+    argp.add_argument('--sessions', type=int, default=1000)
+    argp.add_argument('--requests', type=int, default=1000, help='requests per flow')
+    argp.add_argument('--concurrency', type=int, default=4)
+    argp.add_argument('--flows', nargs='*', default=None, help='subset of flows to run')
+    argp.add_argument('--signed-tokens', action='store_true')
+    argp.add_argument('--seed', type=int, default=0)
+    argp.add_argument('--output', default=None)
+    argp.add_argument('--save-baseline', action='store_true')
+    argp.add_argument('--tolerance', type=float, default=.2)
+    args = argp.parse_args()
+    install(logging.INFO)
+    random.seed(args.seed)
+    n_users = max(args.users, POOL_SIZE + 1)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        init_database(str(pathlib.Path(tmp) / 'bench.db'))
+        migrate()
+
+        logger.info(f'Seeding {n_users} users and {args.sessions} sessions')
+        start = time.perf_counter()
+        seed(n_users, args.sessions)
+        logger.info(f'Seeded in {time.perf_counter() - start:.2f}s')
+        if args.signed_tokens:
+            SysCfg.set_value('session/signed_token', True)
+
+        client = WsgiClient(Server().app)
+        logging.getLogger('simple_league').setLevel(logging.WARNING)  # per request info logs would dominate
+        admin_token = json.loads(client.request('POST', '/api/server/login', {'username': 'bench_admin', 'password': PASSWORD})[1])['result']
+        user_tokens = [json.loads(client.request('POST', '/api/server/login', {'username': f'user{i}', 'password': PASSWORD})[1])['result'] for i in range(POOL_SIZE)]
+
+        flows = make_flows(client, n_users, user_tokens, admin_token)
+        cases = {}
+        for name, flow in flows.items():
+            if args.flows and name not in args.flows:
+                continue
+            cases[name] = run_flow(flow, args.requests, args.concurrency)
+            logger.info(f"{name}: {cases[name]['throughput']:.1f}/s p50 {cases[name]['p50_ms']:.2f}ms p95 {cases[name]['p95_ms']:.2f}ms p99 {cases[name]['p99_ms']:.2f}ms errors {cases[name]['errors']}")
+        use_database.close()
+
+    result = {
+        'benchmark': 'api_load',
+        'params': {'users': n_users, 'sessions': args.sessions, 'requests': args.requests, 'concurrency': args.concurrency, 'signed_tokens': args.signed_tokens},
+        'environment': environment(),
+        'cases': cases,
+    }
+    baseline_name = f'api_load-{n_users}-{args.sessions}' + ('-signed' if args.signed_tokens else '')
+    return finish(result, baseline_name, args.output, args.save_baseline, args.tolerance)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,81 @@
+import json
+import logging
+import pathlib
+import platform
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+BASELINE_DIR = pathlib.Path(__file__).parent / 'baselines'
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    if not sorted_values:
+        return 0.
+    k = (len(sorted_values) - 1) * q
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def latency_summary(latencies: list[float], elapsed: float, errors: int = 0) -> dict:
+    latencies = sorted(latencies)
+    return {
+        'count': len(latencies),
+        'errors': errors,
+        'throughput': len(latencies) / elapsed if elapsed else 0.,
+        'p50_ms': percentile(latencies, .5) * 1000,
+        'p95_ms': percentile(latencies, .95) * 1000,
+        'p99_ms': percentile(latencies, .99) * 1000,
+    }
+
+
+def environment() -> dict:
+    return {
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'timestamp': int(time.time()),
+    }
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    every case present in both is compared on throughput and p95, returns the regressions found
+    """
+    regressions = []
+    for name, cur in result['cases'].items():
+        if (base := baseline.get('cases', {}).get(name)) is None:
+            continue
+        if base.get('throughput') and cur['throughput'] < base['throughput'] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {cur['throughput']:.1f}/s < baseline {base['throughput']:.1f}/s")
+        if base.get('p95_ms') and cur['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {cur['p95_ms']:.3f}ms > baseline {base['p95_ms']:.3f}ms")
+    return regressions
+
+
+def finish(result: dict, baseline_name: str, output=None, save_baseline=False, tolerance=.2) -> int:
+    """
+    write the result json, then compare it with (or store it as) the named baseline, returns the exit code
+    """
+    text = json.dumps(result, indent=2)
+    if output:
+        pathlib.Path(output).write_text(text)
+    else:
+        print(text)
+    baseline_file = BASELINE_DIR / f'{baseline_name}.json'
+    if save_baseline:
+        BASELINE_DIR.mkdir(parents=True, exist_ok=True)
+        baseline_file.write_text(text)
+        logger.info(f'Baseline saved to {baseline_file}')
+        return 0
+    if not baseline_file.exists():
+        logger.info(f'No baseline at {baseline_file}, run with --save-baseline to create one')
+        return 0
+    if result.get('params') != (baseline := json.loads(baseline_file.read_text())).get('params'):
+        logger.warning(f'Baseline {baseline_file} was recorded with different parameters {baseline.get("params")}')
+    if regressions := compare(result, baseline, tolerance):
+        logger.error('Regressions against baseline:\n' + '\n'.join(regressions))
+        return 1
+    logger.info('No regression against baseline')
+    return 0
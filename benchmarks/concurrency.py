@@ -0,0 +1,189 @@
+"""
+threaded versus gevent serving under many long-lived connections: a server process per mode holds
+--streams idle event streams while --concurrency clients hit /ping
+
+    python -m benchmarks.concurrency [--modes threaded gevent] [--streams 1000] [--requests 2000] [--save-baseline]
+"""
+import argparse
+import concurrent.futures
+import http.client
+import json
+import logging
+import os
+import pathlib
+import socket
+import subprocess
+import sys
+import tempfile
+import textwrap
+import time
+
+from nyutils.logging import install
+
+from .common import latency_summary, environment, finish
+
+logger = logging.getLogger(__name__)
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+SERVER_SCRIPT = textwrap.dedent('''
+    import sys
+    if sys.argv[2] == 'gevent':
+        from nyutils.green import patch
+        patch()
+    from nyutils.database import init_database
+    from simple_league.m_server import Server
+    init_database('bench.db')
+    # every stream of the run is admitted, the threaded server's default cap would refuse most of them
+    Server().serve(host='127.0.0.1', port=int(sys.argv[1]), server=sys.argv[2], max_streams=None)
+''')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def proc_status(pid, key):
+    """
+    VmRSS (kB), Threads, ... of a process, linux only
+    """
+    try:
+        for line in pathlib.Path(f'/proc/{pid}/status').read_text().splitlines():
+            if line.startswith(key + ':'):
+                return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def request(port, method, path, body=None, token=None):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    headers = {'Content-Type': 'application/json'}
+    if token:
+        headers['Cookie'] = f'session={token}'
+    conn.request(method, path, json.dumps(body) if body is not None else None, headers)
+    res = conn.getresponse()
+    data = res.read()
+    conn.close()
+    return res.status, data
+
+
+def login(port, username, password):
+    _, data = request(port, 'POST', '/api/server/login', {'username': username, 'password': password})
+    if not (res := json.loads(data)).get('success'):
+        raise RuntimeError(f'login failed: {res}')
+    return res['result']
+
+
+def open_stream(port, token):
+    s = socket.create_connection(('127.0.0.1', port), timeout=30)
+    s.sendall(f'GET /api/server/events HTTP/1.1\r\nHost: bench\r\nCookie: session={token}\r\n\r\n'.encode())
+    return s
+
+
+def bench_mode(mode, streams, n_requests, concurrency):
+    workdir = tempfile.mkdtemp(prefix=f'bench-{mode}-')
+    port = free_port()
+    env = dict(os.environ, PYTHONPATH=str(ROOT))
+    proc = subprocess.Popen([sys.executable, '-c', SERVER_SCRIPT, str(port), mode], cwd=workdir, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    sockets = []
+    try:
+        for _ in range(200):
+            try:
+                request(port, 'GET', '/api/server/ping')
+                break
+            except OSError:
+                time.sleep(.05)
+        else:
+            raise RuntimeError(f'{mode} server did not start')
+        password = (pathlib.Path(workdir) / 'admin.txt').read_text().split()[1]
+        admin = login(port, 'admin', password)
+        # push.MAX_PER_USER streams per user, so the streams are spread over bench users
+        users = [f'bench{i}' for i in range(-(-streams // 8))]
+        request(port, 'POST', '/api/server/admin/import_users',
+                {'items': [{'username': u, 'password': 'bench'} for u in users]}, admin)
+        tokens = [login(port, u, 'bench') for u in users]
+        rss_before = proc_status(proc.pid, 'VmRSS')
+        start = time.perf_counter()
+        failed = 0
+        for i in range(streams):
+            try:
+                sockets.append(open_stream(port, tokens[i // 8]))
+            except OSError:
+                failed += 1
+        for sock in sockets:
+            try:
+                failed += sock.recv(64).split(b' ', 2)[1:2] != [b'200']
+            except OSError:
+                failed += 1
+        open_elapsed = time.perf_counter() - start
+        time.sleep(2)
+        rss_streams, threads = proc_status(proc.pid, 'VmRSS'), proc_status(proc.pid, 'Threads')
+
+        latencies, errors = [], 0
+
+        def worker(count):
+            nonlocal errors
+            for _ in range(count):
+                t = time.perf_counter()
+                try:
+                    status, _ = request(port, 'GET', '/api/server/ping')
+                    errors += status != 200
+                except OSError:
+                    errors += 1
+                latencies.append(time.perf_counter() - t)
+
+        start = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(concurrency) as pool:
+            list(pool.map(worker, [n_requests // concurrency] * concurrency))
+        summary = latency_summary(latencies, time.perf_counter() - start, errors)
+        return {
+            **summary,
+            'streams': streams,
+            'streams_failed': failed,
+            'streams_open_s': open_elapsed,
+            'rss_kb_idle': rss_before,
+            'rss_kb_streams': rss_streams,
+            'threads': threads,
+        }
+    finally:
+        for s in sockets:
+            s.close()
+        proc.terminate()
+        proc.wait(10)
+
+
+def main():
+    argp = argparse.ArgumentParser()
+    argp.add_argument('--modes', nargs='*', default=['threaded', 'gevent'], choices=['threaded', 'gevent'])
+    argp.add_argument('--streams', type=int, default=1000, help='idle event streams held open during the run')
+    argp.add_argument('--requests', type=int, default=2000)
+    argp.add_argument('--concurrency', type=int, default=16)
+    argp.add_argument('--quick', action='store_true', help='200 streams, 500 requests')
+    argp.add_argument('--output', default=None)
+    argp.add_argument('--save-baseline', action='store_true')
+    argp.add_argument('--tolerance', type=float, default=.2)
+    args = argp.parse_args()
+    if args.quick:
+        args.streams, args.requests = 200, 500
+    install(logging.INFO, std_out=False)
+
+    cases = {}
+    for mode in args.modes:
+        cases[f'{mode}/ping'] = res = bench_mode(mode, args.streams, args.requests, args.concurrency)
+        logger.warning(f"{mode}: {res['throughput']:.0f} req/s, p95 {res['p95_ms']:.2f}ms with {args.streams} streams, "
+                       f"rss {res['rss_kb_idle']} -> {res['rss_kb_streams']} kB")
+
+    result = {
+        'benchmark': 'concurrency',
+        'params': {'modes': args.modes, 'streams': args.streams, 'requests': args.requests, 'concurrency': args.concurrency},
+        'environment': environment(),
+        'cases': cases,
+    }
+    return finish(result, 'concurrency', args.output, args.save_baseline, args.tolerance)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,97 @@
+"""
+fixture generation time versus participant count
+
+    python -m benchmarks.league_pairing [--quick] [--sizes 64 256 1024] [--save-baseline]
+"""
+import argparse
+import logging
+import random
+import sys
+import time
+
+from nyutils.logging import install
+from simple_league.m_league.fixtures import round_robin, swiss_pairings, _pair_key
+
+from .common import environment, finish
+
+logger = logging.getLogger(__name__)
+
+
+def best_of(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def swiss_season(n, rounds, seed=0):
+    """
+    (groups, played, had_bye) before every round of a simulated season with random results
+    """
+    rnd = random.Random(seed)
+    points = dict.fromkeys(range(n), 0)
+    played, byes = set(), set()
+    states = []
+    for _ in range(rounds):
+        groups = []
+        for team in sorted(points, key=lambda t: (-points[t], t)):
+            if groups and points[groups[-1][0]] == points[team]:
+                groups[-1].append(team)
+            else:
+                groups.append([team])
+        states.append((groups, set(played), set(byes)))
+        pairs, bye = swiss_pairings(groups, played, byes)
+        if bye is not None:
+            byes.add(bye)
+            points[bye] += 3
+        for home, away in pairs:
+            played.add(_pair_key(home, away))
+            r = rnd.random()
+            points[home] += 3 if r < .45 else 1 if r < .55 else 0
+            points[away] += 3 if r > .55 else 1 if r > .45 else 0
+    return states
+
+
+def bench_size(n, rounds, repeat):
+    elapsed = best_of(lambda: round_robin(list(range(n))), repeat)
+    yield f'round_robin/n={n}', {'ops': 1, 'throughput': 1 / elapsed, 'ms': elapsed * 1000, 'fixtures': n * (n - 1) // 2}
+    states = swiss_season(n, rounds)
+    for r in (0, rounds // 2, rounds - 1):
+        groups, played, byes = states[r]
+        elapsed = best_of(lambda: swiss_pairings(groups, played, byes), repeat)
+        yield f'swiss/n={n}/round={r + 1}', {'ops': 1, 'throughput': 1 / elapsed, 'ms': elapsed * 1000, 'groups': len(groups)}
+
+
+def main():
+    argp = argparse.ArgumentParser()
+    argp.add_argument('--sizes', type=int, nargs='*', default=[16, 64, 256, 1024, 4096])
+    argp.add_argument('--rounds', type=int, default=9, help='swiss rounds simulated per size')
+    argp.add_argument('--repeat', type=int, default=3)
+    argp.add_argument('--quick', action='store_true', help='sizes up to 1024, repeat=1')
+    argp.add_argument('--output', default=None)
+    argp.add_argument('--save-baseline', action='store_true')
+    argp.add_argument('--tolerance', type=float, default=.2)
+    args = argp.parse_args()
+    if args.quick:
+        args.sizes, args.repeat = [s for s in args.sizes if s <= 1024], 1
+    install(logging.WARNING, std_out=False)
+
+    cases = {}
+    for n in args.sizes:
+        for case, res in bench_size(n, args.rounds, args.repeat):
+            cases[case] = res
+            logger.warning(f"{case}: {res['ms']:.2f}ms")
+
+    result = {
+        'benchmark': 'league_pairing',
+        'params': {'sizes': args.sizes, 'rounds': args.rounds, 'repeat': args.repeat},
+        'environment': environment(),
+        'cases': cases,
+    }
+    return finish(result, 'league_pairing', args.output, args.save_baseline, args.tolerance)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
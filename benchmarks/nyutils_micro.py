@@ -0,0 +1,249 @@
+"""
+microbenchmarks of the nyutils primitives every request goes through
+
+    python -m benchmarks.nyutils_micro [--quick] [--filter eventloop] [--save-baseline]
+"""
+import argparse
+import logging
+import re
+import sys
+import threading
+import time
+import typing
+
+import peewee
+
+from nyutils.database import JsonField, PickleField
+from nyutils.eventloop import EventLoop
+from nyutils.listener import Listener
+from nyutils.logging import install
+from nyutils.password import make_password, validate_password
+from nyutils.regex import regexp, regexp_filter
+from nyutils.simple_validate import create_validator
+
+from .common import environment, finish
+
+logger = logging.getLogger(__name__)
+PASSWORD_ALGS = ('none', 'md5', 'sha1', 'sha256', 'sha512')
+
+
+def measure(func: typing.Callable[[int], typing.Any], n: int, repeat: int) -> dict:
+    """
+    func(n) performs n operations, the best of repeat runs is kept
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(n)
+        best = min(best, time.perf_counter() - start)
+    return {'ops': n, 'throughput': n / best, 'ns_per_op': best / n * 1e9}
+
+
+def bench_eventloop(n, repeat):
+    def schedule(n_):
+        loop = EventLoop()
+        for i in range(n_):
+            loop.create_event(int, delay=3600 + i % 97)
+        loop.terminate()
+
+    def schedule_cancel(n_):
+        loop = EventLoop()
+        handles = [loop.create_event(int, delay=3600 + i % 97) for i in range(n_)]
+        for h in handles:
+            loop.cancel_event(h)
+        loop.terminate()
+
+    def dispatch(n_):
+        loop = EventLoop()
+        done = threading.Event()
+        count = [0]
+
+        def callback():
+            count[0] += 1
+            if count[0] == n_:
+                done.set()
+
+        at = time.time()
+        for _ in range(n_):
+            loop.create_event(callback, timestamp=at)
+        done.wait(60)
+        loop.terminate()
+
+    yield 'eventloop/schedule', measure(schedule, n, repeat)
+    yield 'eventloop/schedule+cancel', measure(schedule_cancel, n, repeat)
+    yield 'eventloop/dispatch', measure(dispatch, n, repeat)
+
+
+def bench_listener(n, repeat):
+    for fan_out in (1, 10, 100):
+        listener = Listener()
+        for _ in range(fan_out):
+            listener.set('evt', lambda *_: None)
+
+        def invoke(n_):
+            for i in range(n_):
+                listener.invoke('evt', i, None)
+
+        yield f'listener/invoke/fan_out={fan_out}', measure(invoke, max(1, n // fan_out), repeat)
+
+
+def bench_validate(n, repeat):
+    schemas = {
+        'page_view': ({'page': int, 'page_size': int, 'query': typing.Optional[dict[str, typing.Any]]},
+                      {'page': 3, 'page_size': 50, 'query': {'value': 'abc'}}),
+        'register': ({'username': str, 'password': str, 'data': dict},
+                     {'username': 'user1', 'password': 'secret', 'data': {'nickname': 'n'}}),
+        'permissions': ({'username': str, 'permissions': list[int]},
+                        {'username': 'user1', 'permissions': [1, 2, 3]}),
+        'batch': ({'items': list[{'username': str, 'permissions': list[int]}]},
+                  {'items': [{'username': f'user{i}', 'permissions': [1, 2]} for i in range(100)]}),
+    }
+    for name, (schema, payload) in schemas.items():
+        validator = create_validator(schema)
+
+        def run(n_):
+            for _ in range(n_):
+                validator(payload, '')
+
+        def compile_and_run(n_):
+            for _ in range(n_):
+                create_validator(schema)(payload, '')
+
+        yield f'validate/{name}', measure(run, n, repeat)
+        yield f'validate/{name}/compile', measure(compile_and_run, max(1, n // 10), repeat)
+
+
+def bench_password(n, repeat):
+    n = max(1, n // 10)
+    for alg in PASSWORD_ALGS:
+        hashed = make_password('correct horse battery staple', alg)
+
+        def make(n_):
+            for _ in range(n_):
+                make_password('correct horse battery staple', alg)
+
+        def verify(n_):
+            for _ in range(n_):
+                validate_password('correct horse battery staple', hashed)
+
+        yield f'password/{alg}/make', measure(make, n, repeat)
+        yield f'password/{alg}/verify', measure(verify, n, repeat)
+
+
+def bench_fields(n, repeat):
+    payloads = {
+        'small': {'nickname': 'nick', 'email': 'a@b.c'},
+        'medium': {f'key{i}': {'value': i, 'tags': ['a', 'b', 'c']} for i in range(50)},
+        'large': {f'key{i}': {'value': i, 'text': 'x' * 100} for i in range(2000)},
+    }
+    for field_cls in (JsonField, PickleField):
+        field = field_cls()
+        for size, payload in payloads.items():
+            encoded = field.db_value(payload)
+            count = max(1, n // (1 if size == 'small' else 10 if size == 'medium' else 500))
+
+            def encode(n_):
+                for _ in range(n_):
+                    field.db_value(payload)
+
+            def decode(n_):
+                for _ in range(n_):
+                    field.python_value(encoded)
+
+            yield f'field/{field_cls.__name__}/{size}/encode', {**measure(encode, count, repeat), 'bytes': len(encoded)}
+            yield f'field/{field_cls.__name__}/{size}/decode', measure(decode, count, repeat)
+
+
+def bench_logging(n, repeat):
+    formatter = logging.Formatter('[%(asctime)s]\t[%(levelname)s]\t[%(name)s]\t%(message)s')
+    records = {
+        'single_line': logging.LogRecord('bench', logging.INFO, __file__, 1, 'User %s logged in from %s', ('user1', '127.0.0.1'), None),
+        'multi_line': logging.LogRecord('bench', logging.INFO, __file__, 1, 'line one\nline two\nline three', (), None),
+    }
+    try:
+        raise ValueError('boom')
+    except ValueError:
+        records['exception'] = logging.LogRecord('bench', logging.ERROR, __file__, 1, 'failed', (), sys.exc_info())
+    for name, record in records.items():
+        count = n if name != 'exception' else max(1, n // 10)
+
+        def fmt(n_):
+            for _ in range(n_):
+                formatter.format(record)
+
+        yield f'logging/format/{name}', measure(fmt, count, repeat)
+
+
+def bench_regex(n, repeat):
+    """
+    a regex filter over n rows: the previous per-row re.search udf, the cached udf alone and with its prefilter
+    """
+    db = peewee.SqliteDatabase(':memory:')
+    db.register_function(lambda pattern, string, flags=0: 1 if isinstance(string, str) and re.search(pattern, string, flags) else 0, 'REGEXP_OLD', -1)
+    db.register_function(regexp, 'REGEXP_', -1)
+
+    class Row(peewee.Model):
+        name = peewee.CharField(index=True)
+
+        class Meta:
+            database = db
+
+    db.create_tables([Row])
+    with db.atomic():
+        Row.insert_many([(f'user{i}_{i % 97}',) for i in range(n)], fields=[Row.name]).execute()
+    for name, pattern in (('prefix', r'^user12.*_5$'), ('literal', r'r1\d+_42'), ('ignorecase', r'(?i)USER\d*7_1$')):
+        count = max(1, n // 100)
+        old = Row.select().where(peewee.fn.REGEXP_OLD(pattern, Row.name) == 1)
+        udf = Row.select().where(peewee.fn.REGEXP_(pattern, Row.name) == 1)
+        filtered = Row.select().where(regexp_filter(Row.name, pattern))
+        assert old.count() == udf.count() == filtered.count()
+        for case, query in (('udf_re_search', old), ('udf_cached', udf), ('prefiltered', filtered)):
+            yield f'regex/{name}/{case}', {**measure(lambda n_: [query.count() for _ in range(n_)], count, repeat), 'rows': n}
+    db.close()
+
+
+BENCHES = {
+    'eventloop': bench_eventloop,
+    'listener': bench_listener,
+    'validate': bench_validate,
+    'password': bench_password,
+    'fields': bench_fields,
+    'logging': bench_logging,
+    'regex': bench_regex,
+}
+
+
+def main():
+    argp = argparse.ArgumentParser()
+    argp.add_argument('-n', type=int, default=20000, help='base operation count per case')
+    argp.add_argument('--repeat', type=int, default=5)
+    argp.add_argument('--quick', action='store_true', help='n=2000, repeat=2')
+    argp.add_argument('--filter', nargs='*', default=None, choices=list(BENCHES))
+    argp.add_argument('--output', default=None)
+    argp.add_argument('--save-baseline', action='store_true')
+    argp.add_argument('--tolerance', type=float, default=.2)
+    args = argp.parse_args()
+    if args.quick:
+        args.n, args.repeat = 2000, 2
+    # the same patched formatter the server runs with, handlers are not used
+    install(logging.WARNING, std_out=False)
+
+    cases = {}
+    for name, bench in BENCHES.items():
+        if args.filter and name not in args.filter:
+            continue
+        for case, res in bench(args.n, args.repeat):
+            cases[case] = res
+            logger.warning(f"{case}: {res['throughput']:.0f}/s ({res['ns_per_op']:.0f}ns/op)")
+
+    result = {
+        'benchmark': 'nyutils_micro',
+        'params': {'n': args.n, 'repeat': args.repeat},
+        'environment': environment(),
+        'cases': cases,
+    }
+    return finish(result, 'nyutils_micro', args.output, args.save_baseline, args.tolerance)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
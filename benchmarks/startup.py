@@ -0,0 +1,128 @@
+"""
+time from launching the server process to its first answered request, on a new database (every migration
+runs) and on restarts against a current one; plus the in-process cost of the schema check itself
+
+    python -m benchmarks.startup [--runs 10] [--save-baseline]
+"""
+import argparse
+import http.client
+import logging
+import os
+import pathlib
+import socket
+import subprocess
+import sys
+import tempfile
+import textwrap
+import time
+
+from nyutils.database import init_database, use_database, BaseModel
+from nyutils.logging import install
+from nyutils.migrate import migrate
+
+from .common import latency_summary, environment, finish
+
+logger = logging.getLogger(__name__)
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+SERVER_SCRIPT = textwrap.dedent('''
+    import time
+    STARTED = time.perf_counter()
+    import sys
+    from nyutils.database import init_database
+    from simple_league.m_server import Server
+    init_database('bench.db')
+    Server().serve(host='127.0.0.1', port=int(sys.argv[1]), started=STARTED)
+''')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def time_to_first_request(workdir, timeout=30.) -> float:
+    port = free_port()
+    env = dict(os.environ, PYTHONPATH=str(ROOT))
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, '-c', SERVER_SCRIPT, str(port)], cwd=workdir, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+                conn.request('GET', '/api/server/ping')
+                status = conn.getresponse().status
+                conn.close()
+                if status == 200:
+                    return time.perf_counter() - start
+            except OSError:
+                time.sleep(.002)
+        raise RuntimeError('server did not answer')
+    finally:
+        proc.terminate()
+        proc.wait(10)
+
+
+def bench_restarts(runs, fresh: bool) -> dict:
+    times = []
+    with tempfile.TemporaryDirectory() as workdir:
+        if not fresh:
+            time_to_first_request(workdir)  # creates and migrates the database
+        for _ in range(runs):
+            if fresh:
+                for f in pathlib.Path(workdir).glob('bench.db*'):
+                    f.unlink()
+            times.append(time_to_first_request(workdir))
+    return latency_summary(times, sum(times))
+
+
+def bench_schema_check(runs) -> dict:
+    """
+    the previous every-boot create_tables against the versioned check, both on a current database
+    """
+    import simple_league.m_server  # noqa: registers the models and their migrations
+    cases = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        init_database(str(pathlib.Path(tmp) / 'bench.db'))
+        migrate()
+        for name, func in (('create_tables', lambda: use_database.create_tables(BaseModel._models_)), ('migrate_current', migrate)):
+            times = []
+            for _ in range(runs):
+                start = time.perf_counter()
+                func()
+                times.append(time.perf_counter() - start)
+            cases[f'schema/{name}'] = latency_summary(times, sum(times))
+        use_database.close()
+    return cases
+
+
+def main():
+    argp = argparse.ArgumentParser()
+    argp.add_argument('--runs', type=int, default=10)
+    argp.add_argument('--output', default=None)
+    argp.add_argument('--save-baseline', action='store_true')
+    argp.add_argument('--tolerance', type=float, default=.2)
+    args = argp.parse_args()
+    install(logging.INFO, std_out=False)
+
+    cases = {
+        'process/new_database': bench_restarts(args.runs, fresh=True),
+        'process/restart': bench_restarts(args.runs, fresh=False),
+        **bench_schema_check(args.runs * 10),
+    }
+    for name, res in cases.items():
+        logger.warning(f"{name}: p50 {res['p50_ms']:.2f}ms, p95 {res['p95_ms']:.2f}ms")
+
+    result = {
+        'benchmark': 'startup',
+        'params': {'runs': args.runs},
+        'environment': environment(),
+        'cases': cases,
+    }
+    return finish(result, 'startup', args.output, args.save_baseline, args.tolerance)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
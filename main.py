@@ -1,10 +1,20 @@
+import time
+
+STARTED = time.perf_counter()
+
 import argparse
+import sys
+
+# gevent has to patch before anything creates threads, locks or thread locals
+if '--server=gevent' in sys.argv or ('--server' in sys.argv[:-1] and sys.argv[sys.argv.index('--server') + 1] == 'gevent'):
+    from nyutils.green import patch
+    patch()
+
 import logging
 import pathlib
-import sys
 
 from nyutils.logging import install
-from nyutils.database import init_database
+from nyutils.database import init_database, use_database
 
 from simple_league import App
 
@@ -15,11 +25,23 @@ data_dir = pathlib.Path(getattr(sys, '_MEIPASS', pathlib.Path(__file__).parent))
 def main():
     argp = argparse.ArgumentParser()
     argp.add_argument('--debug', action='store_true')
+    argp.add_argument('--slow-query-ms', type=float, default=None, help='log statements slower than this with their query plan')
+    argp.add_argument('--trace-file', default=None, help='write sampled and slow request traces to this json lines file')
+    argp.add_argument('--trace-sample', type=float, default=.01, help='share of the traces written')
+    argp.add_argument('--trace-slow-ms', type=float, default=500, help='traces slower than this are always written')
+    argp.add_argument('--server', choices=['wsgiref', 'threaded', 'gevent'], default='wsgiref')
+    argp.add_argument('--port', type=int, default=80)
     args = argp.parse_args()
 
     install(logging.INFO if hasattr(sys, 'frozen') and not args.debug else logging.DEBUG)
     init_database('main.db', '111111')
-    App().serve()
+    if args.slow_query_ms is not None:
+        from simple_league.m_server.utils import g_query_log
+        g_query_log.enable(args.slow_query_ms / 1000)
+    if args.trace_file:
+        from nyutils.tracing import tracer
+        tracer.enable(args.trace_file, args.trace_sample, args.trace_slow_ms / 1000, database=use_database)
+    App().serve(port=args.port, server=args.server, started=STARTED)
     
 
 
@@ -0,0 +1,109 @@
+import gzip
+import logging
+import os
+import pathlib
+import shutil
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class OnlineBackup:
+    """
+    snapshots a live sqlite database with the online backup api: a few pages per step and a pause between
+    steps, on a connection of its own so writers are only blocked for the duration of a single step.
+    snapshots are integrity checked, gzipped and rotated.
+    """
+
+    def __init__(self, database, backup_dir='backup', pages_per_step=256, step_sleep=.02, keep=7):
+        self.database = database  # peewee database, the file name is read at run time
+        self.backup_dir = pathlib.Path(backup_dir)
+        self.pages_per_step = pages_per_step
+        self.step_sleep = step_sleep
+        self.keep = keep
+        self.lock = threading.Lock()
+        self.progress = None  # {'started_at', 'remaining', 'total'} while running
+        self.last_success = None
+        self.last_error = None
+
+    @property
+    def running(self):
+        return self.lock.locked()
+
+    def status(self):
+        return {
+            'running': self.running,
+            'progress': dict(self.progress) if self.progress else None,
+            'last_success': self.last_success,
+            'last_error': self.last_error,
+            'snapshots': [p.name for p in self.snapshots()],
+        }
+
+    def snapshots(self) -> list[pathlib.Path]:
+        if not self.backup_dir.is_dir():
+            return []
+        return sorted(self.backup_dir.glob(f'{self._stem()}-*.db.gz'))
+
+    def _stem(self):
+        return pathlib.Path(self.database.database).stem
+
+    def _on_progress(self, status, remaining, total):
+        # called after every step, backup()'s own sleep only applies when a step finds the database busy or locked
+        self.progress['remaining'] = remaining
+        self.progress['total'] = total
+        if remaining and self.step_sleep:
+            time.sleep(self.step_sleep)
+
+    def run(self) -> pathlib.Path | None:
+        """
+        take a snapshot now, returns None if one is already running
+        """
+        if not self.lock.acquire(blocking=False):
+            return None
+        try:
+            return self._run()
+        except Exception as e:
+            self.last_error = {'time': time.time(), 'error': str(e)}
+            logger.error(f'Database backup failed: {e}', exc_info=True)
+            return None
+        finally:
+            self.progress = None
+            self.lock.release()
+
+    def _run(self):
+        src_path = self.database.database
+        self.backup_dir.mkdir(parents=True, exist_ok=True)
+        name = f'{self._stem()}-{time.strftime("%Y%m%d-%H%M%S")}.db'
+        tmp_path = self.backup_dir / (name + '.tmp')
+        gz_path = self.backup_dir / (name + '.gz')
+        gz_tmp_path = self.backup_dir / (name + '.gz.tmp')
+        start = time.time()
+        self.progress = {'started_at': start, 'remaining': None, 'total': None}
+        try:
+            src = sqlite3.connect(src_path, check_same_thread=False)
+            dst = sqlite3.connect(tmp_path)
+            try:
+                src.backup(dst, pages=self.pages_per_step, progress=self._on_progress, sleep=self.step_sleep)
+                if (res := dst.execute('PRAGMA integrity_check').fetchone()[0]) != 'ok':
+                    raise RuntimeError(f'integrity check failed: {res}')
+            finally:
+                dst.close()
+                src.close()
+            with open(tmp_path, 'rb') as f_in, gzip.open(gz_tmp_path, 'wb', compresslevel=6) as f_out:
+                shutil.copyfileobj(f_in, f_out, 1024 * 1024)
+            os.replace(gz_tmp_path, gz_path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+            gz_tmp_path.unlink(missing_ok=True)
+        self.last_success = {'time': time.time(), 'file': gz_path.name, 'size': gz_path.stat().st_size, 'duration': time.time() - start}
+        logger.info(f'Database backup written to {gz_path} in {self.last_success["duration"]:.2f}s')
+        self.rotate()
+        return gz_path
+
+    def rotate(self):
+        snapshots = self.snapshots()
+        for p in snapshots[:max(0, len(snapshots) - self.keep)]:
+            p.unlink(missing_ok=True)
+            logger.debug(f'Removed old database backup {p}')
@@ -1,21 +1,271 @@
+import contextlib
+import itertools
 import os
 import pickle
 import json
+import logging
 import re
 import sys
 import threading
+import time
 import typing
 import peewee
 
+from .regex import regexp
+
 # HAS_SQL_CHIPPER = (os.environ.get('NO_SQLCIPHER') is None) if getattr(sys, 'frozen', False) else False
 HAS_SQL_CHIPPER = False
 
+
+class StatementHookMixin:
+    """
+    calls every hook in statement_hooks with (sql, params, elapsed_seconds) after each statement,
+    costs a single truthiness check when no hook is installed
+    """
+    statement_hooks: list
+
+    def execute_sql(self, sql, params=None, *args, **kwargs):
+        if not self.statement_hooks:
+            return super().execute_sql(sql, params, *args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return super().execute_sql(sql, params, *args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            for hook in self.statement_hooks:
+                hook(sql, params, elapsed)
+
+    def executemany_sql(self, sql, seq_of_params):
+        """
+        sqlite executemany, reported to the hooks as one statement
+        """
+        seq_of_params = list(seq_of_params)
+        start = time.perf_counter()
+        cursor = self.cursor()
+        cursor.executemany(sql, seq_of_params)
+        if self.statement_hooks:
+            elapsed = time.perf_counter() - start
+            for hook in self.statement_hooks:
+                hook(sql, seq_of_params[0] if seq_of_params else (), elapsed)
+        return cursor
+
+    def add_statement_hook(self, hook: typing.Callable[[str, typing.Any, float], None]):
+        if hook not in self.statement_hooks:
+            self.statement_hooks = self.statement_hooks + [hook]  # copy on write, execute_sql iterates without lock
+        return hook
+
+    def remove_statement_hook(self, hook):
+        self.statement_hooks = [h for h in self.statement_hooks if h is not hook]
+
+
+class ConnectionPoolMixin:
+    """
+    optional bounded pool of connections shared by all threads (or greenlets), off by default so every thread
+    keeps its own connection. with the pool on, sqlite's busy handler is disabled, it sleeps inside C and would
+    block a gevent hub; a locked database is retried from python with time.sleep (patched to yield) instead.
+    users of the pool return their connection with close(), or run in released()
+    """
+    pool_size: int | None = None
+    pool_timeout: float = 10.
+    busy_retry: float = 0.
+
+    def enable_pool(self, size=8, timeout=10., busy_retry=5.):
+        if not self.deferred and not self.is_closed():
+            self.close()  # the calling thread's own connection, opened before the pool
+        self.pool_size = size
+        self.pool_timeout = timeout
+        self.busy_retry = busy_retry
+        self._pool_idle = []
+        self._pool_in_use = 0
+        self._pool_cond = threading.Condition()  # created now so it is green once patched
+        self._timeout = 0
+        self.connect_params['check_same_thread'] = False  # a pooled connection moves between threads, one at a time
+
+    @contextlib.contextmanager
+    def released(self):
+        """
+        gives back a pooled connection the block opened, for database work outside requests (event loop
+        callbacks, background threads) which servers.ReleaseConnection never sees; without the pool the thread
+        keeps its own connection
+        """
+        opened = self.pool_size is not None and self.is_closed()
+        try:
+            yield
+        finally:
+            if opened and not self.is_closed():
+                self.close()
+
+    def connect(self, reuse_if_open=False):
+        if self.pool_size is None or not self.is_closed():
+            return super().connect(reuse_if_open)
+        # wait for a slot before peewee takes its lock, close() needs that lock to hand a connection back
+        with self._pool_cond:
+            if not self._pool_cond.wait_for(lambda: self._pool_in_use < self.pool_size, self.pool_timeout):
+                raise peewee.OperationalError(f'no database connection free within {self.pool_timeout}s')
+            self._pool_in_use += 1
+        try:
+            return super().connect(reuse_if_open)
+        except Exception:
+            self._pool_release()
+            raise
+
+    def _connect(self):
+        if self.pool_size is not None:
+            with self._pool_cond:
+                if self._pool_idle:
+                    return self._pool_idle.pop()
+        return super()._connect()
+
+    def _close(self, conn):
+        if self.pool_size is None:
+            return super()._close(conn)
+        if conn.in_transaction:
+            conn.rollback()
+        self._pool_release(conn)
+
+    def _pool_release(self, conn=None):
+        with self._pool_cond:
+            self._pool_in_use -= 1
+            if conn is not None:
+                self._pool_idle.append(conn)
+            self._pool_cond.notify()
+
+    def execute_sql(self, sql, params=None, *args, **kwargs):
+        if not self.busy_retry:
+            return super().execute_sql(sql, params, *args, **kwargs)
+        deadline = time.monotonic() + self.busy_retry
+        delay = .001
+        while True:
+            try:
+                return super().execute_sql(sql, params, *args, **kwargs)
+            except peewee.OperationalError as e:
+                if 'locked' not in str(e) and 'busy' not in str(e) or time.monotonic() + delay > deadline:
+                    raise
+            time.sleep(delay)
+            delay = min(delay * 2, .05)
+
+
+_re_write = re.compile(r'\s*(?:(?:INSERT|REPLACE)(?:\s+OR\s+\w+)?\s+INTO|UPDATE(?:\s+OR\s+\w+)?|DELETE\s+FROM'
+                       r'|ALTER\s+TABLE|DROP\s+TABLE(?:\s+IF\s+EXISTS)?)\s+"?([^"\s(]+)', re.IGNORECASE)
+
+
+class ChangeTrackingMixin:
+    """
+    a version per table, bumped by every statement writing it (model save/delete_instance, bulk queries and raw sql
+    alike) and by the tables whose foreign keys cascade from it. readers on other connections only see a write
+    once its transaction ends, so that bumps the tables again; until then changed_in_transaction() reports them.
+    writes of other processes are not seen. on_commit() defers work that must only follow a committed write
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.table_versions: dict[str, int] = {}
+        self._version_counter = itertools.count(1)
+        self._cascades = (0, {})  # (number of models it was built from, {table: tables referencing it})
+
+    def execute_sql(self, sql, params=None, *args, **kwargs):
+        cursor = super().execute_sql(sql, params, *args, **kwargs)
+        if (m := _re_write.match(sql)) is not None:
+            self._changed(m.group(1))
+        return cursor
+
+    def executemany_sql(self, sql, seq_of_params):
+        cursor = super().executemany_sql(sql, seq_of_params)
+        if (m := _re_write.match(sql)) is not None:
+            self._changed(m.group(1))
+        return cursor
+
+    def commit(self):
+        res = super().commit()
+        self._end_transaction(True)
+        return res
+
+    def rollback(self):
+        try:
+            return super().rollback()
+        finally:
+            self._end_transaction(False)
+
+    def _close(self, conn):
+        try:
+            return super()._close(conn)  # rolls back what is still open
+        finally:
+            self._end_transaction(False)
+
+    def on_commit(self, func: typing.Callable[[], None]):
+        """
+        run func once the open transaction of this thread's connection commits, at once when none is open;
+        it is dropped if the transaction rolls back
+        """
+        if (conn := self._state.conn) is None or not conn.in_transaction:
+            return func()
+        if (pending := getattr(self._state, 'on_commit', None)) is None:
+            self._state.on_commit = pending = []
+        pending.append(func)
+
+    def _referencing(self, table) -> set[str]:
+        count, referencing = self._cascades
+        if count != len(BaseModel._models_):
+            referencing = {}
+            for model in list(BaseModel._models_):
+                for fk in model._meta.refs:
+                    if fk.on_delete or fk.on_update:
+                        referencing.setdefault(fk.rel_model._meta.table_name, set()).add(model._meta.table_name)
+            self._cascades = (len(BaseModel._models_), referencing)
+        tables, pending = {table}, [table]
+        while pending:
+            for t in referencing.get(pending.pop(), ()):
+                if t not in tables:
+                    tables.add(t)
+                    pending.append(t)
+        return tables
+
+    def _changed(self, table):
+        tables = self._referencing(table)
+        self._bump(tables)
+        if (conn := self._state.conn) is not None and conn.in_transaction:
+            if (changed := getattr(self._state, 'changed', None)) is None:
+                self._state.changed = changed = set()
+            changed.update(tables)
+
+    def _end_transaction(self, committed: bool):
+        if changed := getattr(self._state, 'changed', None):
+            self._state.changed = None
+            self._bump(changed)
+        if pending := getattr(self._state, 'on_commit', None):
+            self._state.on_commit = None
+            for func in pending if committed else ():
+                try:
+                    func()
+                except Exception as e:
+                    logging.getLogger(__name__).error(f'Error in on_commit callback {func}: {e}', exc_info=True)
+
+    def _bump(self, tables):
+        version = next(self._version_counter)
+        for table in tables:
+            self.table_versions[table] = version
+
+    def versions_of(self, tables: typing.Iterable[str]) -> tuple[int, ...]:
+        return tuple(self.table_versions.get(t, 0) for t in tables)
+
+    def changed_in_transaction(self, tables: typing.Iterable[str]) -> bool:
+        """
+        whether the open transaction of this thread's connection wrote any of tables, not committed yet
+        """
+        changed = getattr(self._state, 'changed', None)
+        return bool(changed) and not changed.isdisjoint(tables)
+
+
 if HAS_SQL_CHIPPER:
     import playhouse.sqlcipher_ext
 
-    use_database = playhouse.sqlcipher_ext.SqlCipherDatabase(None)
+    class HookedDatabase(ChangeTrackingMixin, StatementHookMixin, ConnectionPoolMixin, playhouse.sqlcipher_ext.SqlCipherDatabase):
+        statement_hooks = []
 else:
-    use_database = peewee.SqliteDatabase(None)
+    class HookedDatabase(ChangeTrackingMixin, StatementHookMixin, ConnectionPoolMixin, peewee.SqliteDatabase):
+        statement_hooks = []
+
+use_database = HookedDatabase(None)
 
 
 def init_database(db_name, passphrase=""):
@@ -23,55 +273,129 @@ def init_database(db_name, passphrase=""):
         use_database.init(db_name, passphrase=passphrase)
     else:
         use_database.init(db_name)
-    use_database.create_tables(BaseModel._models_)
+    # tables are created and upgraded by nyutils.migrate.migrate()
 
     # use_database.execute_sql('PRAGMA journal_mode=WAL;')
 
-    def simple_regexp(pattern, string, flags=0):
-        if not isinstance(string, str):
-            return 0
-        return 1 if re.search(pattern, string, flags) else 0
-
-    connection = use_database.connection()
+    # registered on the database, so every connection gets them (per thread, or from the pool);
+    # patterns are compiled once into nyutils.regex.patterns, regexp_filter() adds an instr/index prefilter
     # selector = TestDb.select().where(TestDb.value.regexp(pattern))
-    connection.create_function("REGEXP", 2, simple_regexp)
-    connection.create_function("REGEXP", 3, simple_regexp)
+    use_database.register_function(regexp, "REGEXP", -1)
     # selector = TestDb.select().where(peewee.fn.regexp_(pattern, TestDb.value) == 1) # to handle json fields
-    connection.create_function("REGEXP_", 2, simple_regexp)
-    connection.create_function("REGEXP_", 3, simple_regexp)
-    connection.create_function("IF", 3, lambda condition, true_value,
-                               false_value: true_value if condition else false_value)
-    connection.create_function("JSON_EXTRACT", 2, lambda json_str, path: json.loads(
-        json_str).get(path, None) if json_str else None)
+    use_database.register_function(regexp, "REGEXP_", -1)
+    use_database.register_function(lambda condition, true_value, false_value: true_value if condition else false_value, "IF", 3)
+    use_database.register_function(lambda json_str, path: json.loads(json_str).get(path, None) if json_str else None, "JSON_EXTRACT", 2)
 
 
-write_lock = threading.Lock()
+write_lock = threading.RLock()  # reentrant, request transactions hold it around code that takes it again
 USE_PICKLE_FIELD = False
 
 PICKLE_NONE = pickle.dumps(None)
 
 
+class LazyValue:
+    """
+    proxy returned by lazy JsonField/PickleField, the column is only decoded on first access.
+    an untouched value is written back as the original column data;
+    use unwrap() before handing it to json.dumps or pickle
+    """
+    __slots__ = ('raw', '_decode', '_value', '_loaded')
+
+    def __init__(self, raw, decode):
+        self.raw = raw
+        self._decode = decode
+        self._value = None
+        self._loaded = False
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    @property
+    def value(self):
+        if not self._loaded:
+            self._value = self._decode(self.raw)
+            self._loaded = True
+        return self._value
+
+    def __getattr__(self, item):
+        return getattr(self.value, item)
+
+    def __getitem__(self, item):
+        return self.value[item]
+
+    def __setitem__(self, key, value):
+        self.value[key] = value
+
+    def __delitem__(self, key):
+        del self.value[key]
+
+    def __iter__(self):
+        return iter(self.value)
+
+    def __len__(self):
+        return len(self.value)
+
+    def __contains__(self, item):
+        return item in self.value
+
+    def __bool__(self):
+        return bool(self.value)
+
+    def __eq__(self, other):
+        return self.value == unwrap(other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(self.value) if self._loaded else f'LazyValue({self.raw!r})'
+
+
+def unwrap(value):
+    return value.value if isinstance(value, LazyValue) else value
+
+
 class JsonField(peewee.TextField):
+    def __init__(self, *args, lazy=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lazy = lazy
+
     def db_value(self, value):
         if value is None:
             return 'null'
+        if isinstance(value, LazyValue):
+            if not value.loaded:
+                return value.raw
+            value = value.value
         return json.dumps(value)
 
     def python_value(self, value):
-        if value == 'null':
+        if value == 'null' or value is None:
             return None
+        if self.lazy:
+            return LazyValue(value, json.loads)
         return json.loads(value)
 
 
 class PickleField(peewee.BlobField):
+    def __init__(self, *args, lazy=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lazy = lazy
+
     def db_value(self, value):
         if value is None:
             return PICKLE_NONE
+        if isinstance(value, LazyValue):
+            if not value.loaded:
+                return value.raw
+            value = value.value
         return pickle.dumps(value)
 
     def python_value(self, value):
-        if value == PICKLE_NONE:
+        if value == PICKLE_NONE or value is None:
             return None
+        if self.lazy:
+            return LazyValue(value, pickle.loads)
         return pickle.loads(value)
 
 
@@ -93,9 +417,29 @@ class BaseModel(peewee.Model):
     def delete_instance(self, recursive=True, delete_nullable=False):
         return super().delete_instance(recursive, delete_nullable)
 
+    @classmethod
+    def data_version(cls) -> int:
+        """
+        changes whenever a write to the model's table (save, delete_instance, bulk or raw sql) commits
+        """
+        return cls._meta.database.table_versions.get(cls._meta.table_name, 0)
+
+    # names of the fields to_client reads, lets listings select only those columns (None selects everything)
+    client_fields: typing.ClassVar[tuple[str, ...] | None] = None
+
     def to_client(self) -> dict:
         """
         Convert the model instance to a dictionary suitable for sending to the client.
         Override this method in subclasses to customize the serialization.
         """
         return {}
+
+    @classmethod
+    def select_client_fields(cls, selector: peewee.ModelSelect) -> peewee.ModelSelect:
+        """
+        restrict selector to the primary key and client_fields
+        """
+        if cls.client_fields is None:
+            return selector
+        fields = cls._meta.fields
+        return selector.select(cls._meta.primary_key, *(fields[name] for name in cls.client_fields))
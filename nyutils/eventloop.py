@@ -5,6 +5,9 @@ import time
 import typing
 import bisect
 
+from .green import spawn_blocking
+from .tracing import tracer
+
 logger = logging.getLogger(__name__)
 
 @dataclasses.dataclass
@@ -21,7 +24,11 @@ class Event:
 
 class EventLoop:
 
-    def __init__(self):
+    def __init__(self, context: typing.Callable[[], typing.ContextManager] | None = None):
+        """
+        context: entered around every callback, e.g. to give back a database connection it took
+        """
+        self.context = context
         self._events_by_time = []
         self._events_by_id = {}
         self.lock = threading.Lock()
@@ -50,6 +57,28 @@ class EventLoop:
             self.trigger_update()
         return handle
 
+    def create_events(self, items: typing.Iterable[tuple[float, typing.Callable, tuple]], thread=False) -> list[int]:
+        """
+        schedule many one-shot events, items are (timestamp, func, args);
+        the new events are sorted once and merged into the queue under a single lock
+        """
+        events = sorted((Event(self, func, args, {}, 0, False, at, thread) for at, func, args in items), key=lambda e: e.next_time)
+        if not events:
+            return []
+        with self.lock:
+            first = not self._events_by_time or events[0].next_time < self._events_by_time[0].next_time
+            # two sorted runs, timsort merges them in linear time
+            self._events_by_time.extend(events)
+            self._events_by_time.sort(key=lambda e: e.next_time)
+            handles = []
+            for evt in events:
+                self._events_by_id[id(evt)] = evt
+                handles.append(id(evt))
+        logger.debug(f'{len(events)} events scheduled in bulk')
+        if first:
+            self.trigger_update()
+        return handles
+
     def cancel_event(self, handle):
         with self.lock:
             if (evt := self._events_by_id.pop(handle, None)) is None:
@@ -84,29 +113,42 @@ class EventLoop:
             return 0
         now = time.time()
         et = self._events_by_time
-        while et and et[0].next_time <= now:
-            evt = et.pop(0)
+        while True:
+            # the list is shared with create_event/cancel_event, only callbacks run outside the lock
+            with self.lock:
+                if not (et and et[0].next_time <= now):
+                    break
+                evt = et.pop(0)
             if logger.isEnabledFor(logging.DEBUG):
                 logger.debug(f'Event {evt.func} executed')
+            name = f'loop {getattr(evt.func, "__qualname__", evt.func)}'
             if evt.thread:
-                threading.Thread(target=evt.func, args=evt.args, kwargs=evt.kwargs, daemon=True).start()
+                spawn_blocking(self._run, name, evt)
             else:
                 try:
-                    evt.func(*evt.args, **evt.kwargs)
+                    self._run(name, evt)
                 except Exception as e:
                     logger.error(f'Error in event {evt.func}', exc_info=e)
-            if evt.repeat:
-                evt.next_time += evt.delay
-                bisect.insort(et, evt, key=lambda e: e.next_time)
-                if logger.isEnabledFor(logging.DEBUG):
-                    fmt_next_at = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(evt.next_time))
-                    logger.debug(f'Repeated event {evt.func} scheduled at {fmt_next_at} ({evt.next_time - time.time():.2f}s from now)')
-            else:
-                self._events_by_id.pop(id(evt), None)
+            with self.lock:
+                if evt.repeat and id(evt) in self._events_by_id:
+                    evt.next_time += evt.delay
+                    bisect.insort(et, evt, key=lambda e: e.next_time)
+                    if logger.isEnabledFor(logging.DEBUG):
+                        fmt_next_at = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(evt.next_time))
+                        logger.debug(f'Repeated event {evt.func} scheduled at {fmt_next_at} ({evt.next_time - time.time():.2f}s from now)')
+                else:
+                    self._events_by_id.pop(id(evt), None)
 
-        if not self._events_by_time:
-            return None
-        return self._events_by_time[0].next_time - time.time()
+        with self.lock:
+            if not et:
+                return None
+            return et[0].next_time - time.time()
+
+    def _run(self, name, evt):
+        if self.context is None:
+            return tracer.run(name, evt.func, *evt.args, **evt.kwargs)
+        with self.context():
+            return tracer.run(name, evt.func, *evt.args, **evt.kwargs)
 
     def serve(self):
         while not self._terminate:
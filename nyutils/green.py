@@ -0,0 +1,37 @@
+"""
+optional gevent support. the process opts in with patch() before anything else is imported, every other
+helper falls back to plain threads when gevent is missing or not patched
+"""
+import importlib.util
+import logging
+import sys
+import threading
+
+# gevent is only imported by patch(), processes that never patch do not pay for it
+HAS_GEVENT = importlib.util.find_spec('gevent') is not None
+
+logger = logging.getLogger(__name__)
+
+
+def patch():
+    if not HAS_GEVENT:
+        raise RuntimeError('gevent is not installed')
+    import gevent.monkey
+    gevent.monkey.patch_all()
+
+
+def is_patched() -> bool:
+    return (monkey := sys.modules.get('gevent.monkey')) is not None and monkey.is_module_patched('threading')
+
+
+def spawn_blocking(func, *args, **kwargs):
+    """
+    run func in the background where it cannot stall other work: a plain daemon thread normally,
+    a native thread of gevent's pool when patched (a patched Thread is a greenlet and would block the hub)
+    """
+    if is_patched():
+        import gevent
+        return gevent.get_hub().threadpool.spawn(func, *args, **kwargs)
+    thread = threading.Thread(target=func, args=args, kwargs=kwargs, daemon=True)
+    thread.start()
+    return thread
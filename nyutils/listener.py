@@ -1,7 +1,10 @@
 import contextlib
 import inspect
 import logging
-import threading
+import typing
+
+from .green import spawn_blocking
+from .tracing import tracer
 
 logger = logging.getLogger(__name__)
 
@@ -53,7 +56,11 @@ def call_with_args(func, args, default_fill=None):
 
 
 class Listener:
-    def __init__(self):
+    def __init__(self, context: typing.Callable[[], typing.ContextManager] | None = None):
+        """
+        context: entered around every async_ listener, which runs in a thread of its own
+        """
+        self.context = context
         self.listeners = {}
         self.handle2key = {}
         self.handle_manager = HandleManager()
@@ -78,13 +85,20 @@ class Listener:
 
     def _call(self, evnet, func, args):
         try:
-            func(*args)
+            with tracer.span('event', event=evnet, listener=getattr(func, '__qualname__', repr(func))):
+                func(*args)
         except Exception as e:
             logger.error(f"Error in listener for event '{evnet}' with func {func}: {e}", exc_info=True)
 
+    def _call_async(self, event, func, args):
+        if self.context is None:
+            return self._call(event, func, args)
+        with self.context():
+            self._call(event, func, args)
+
     def invoke(self, event, *args):
         for handle, (func, async_) in self.listeners.get(event, ()):
             if async_:
-                threading.Thread(target=self._call, args=(event, func, args), daemon=True).start()
+                spawn_blocking(self._call_async, event, func, args)
             else:
                 self._call(event, func, args)
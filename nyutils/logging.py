@@ -8,6 +8,8 @@ import time
 import typing
 import zipfile
 
+from .tracing import install_record_factory
+
 Verbose1 = 9
 Verbose2 = 8
 Verbose3 = 7
@@ -52,7 +54,7 @@ _end_line = f'\x1b[{AsciiFormat.end}m'
 
 def install(
         level=logging.DEBUG,
-        format='[%(asctime)s]\t[%(levelname)s]\t[%(name)s]\t%(message)s',
+        format='[%(asctime)s]\t[%(levelname)s]\t[%(name)s]\t%(trace)s%(message)s',
         use_color=True,
         multiline_process=True,
         std_out=True,
@@ -60,6 +62,7 @@ def install(
         file_size=1024 * 1024 * 10,
         archive_zip=None,
 ):
+    install_record_factory()  # %(trace)s, the id of the request or job being logged
     logging.addLevelName(Verbose1, 'Verbose1')
     logging.addLevelName(Verbose2, 'Verbose2')
     logging.addLevelName(Verbose3, 'Verbose3')
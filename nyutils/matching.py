@@ -0,0 +1,379 @@
+"""
+maximum weight matching of a general graph, edmonds' blossom algorithm in its primal-dual form (after the
+O(n^3) formulation of Galil, "Efficient algorithms for finding maximum matching in graphs", 1986).
+weights are integers; with max_cardinality the matching is the heaviest among those with the most edges
+"""
+import typing
+
+
+def _run(steps, *args):
+    """
+    runs a generator function yielding the arguments of its recursive calls, each finishes before it resumes;
+    blossoms nest deeper than the recursion limit
+    """
+    stack = [steps(*args)]
+    while stack:
+        try:
+            call = next(stack[-1])
+        except StopIteration:
+            stack.pop()
+        else:
+            stack.append(steps(*call))
+
+
+def max_weight_matching(edges: typing.Sequence[tuple[int, int, int]], max_cardinality=False) -> list[int]:
+    """
+    edges are (i, j, weight) over vertices 0..n-1, at most one per pair; returns the mate of each vertex, -1 when
+    unmatched. the pairs joined by the heaviest edges are matched greedily first, in the order given, so a graph
+    that is mostly paired by its best edges only runs the augmenting stages for the rest
+    """
+    if not edges:
+        return []
+    n_edge = len(edges)
+    n = max(max(i, j) for i, j, _ in edges) + 1
+    max_weight = max(0, max(w for _, _, w in edges))
+    # endpoint p of edge p // 2 is vertex endpoint[p], its other end is endpoint[p ^ 1]
+    endpoint = [edges[p // 2][p % 2] for p in range(2 * n_edge)]
+    neighbend = [[] for _ in range(n)]  # per vertex, the endpoints at the other end of its edges
+    for k, (i, j, _) in enumerate(edges):
+        if i == j:
+            raise ValueError(f'Edge {k} is a loop on vertex {i}')
+        neighbend[i].append(2 * k + 1)
+        neighbend[j].append(2 * k)
+
+    mate = [-1] * n  # remote endpoint of the matched edge
+    # label of a top level blossom (or single vertex): 0 free, 1 S (outer), 2 T (inner); labelend is the
+    # endpoint through which it got the label, -1 for the roots
+    label = [0] * (2 * n)
+    labelend = [-1] * (2 * n)
+    inblossom = list(range(n))  # top level blossom of each vertex
+    blossomparent = [-1] * (2 * n)
+    blossomchilds: list[list[int] | None] = [None] * (2 * n)  # sub-blossoms, in cycle order from the base
+    blossombase = list(range(n)) + [-1] * n
+    blossomendps: list[list[int] | None] = [None] * (2 * n)  # endpoints joining the sub-blossoms in that order
+    bestedge = [-1] * (2 * n)  # least slack edge to a different S blossom
+    blossombestedges: list[list[int] | None] = [None] * (2 * n)
+    unusedblossoms = list(range(n, 2 * n))
+    dualvar = [max_weight] * n + [0] * n  # twice the dual of a vertex, the dual of a blossom
+    allowedge = [False] * n_edge  # slack known to be zero
+    queue = []  # S vertices whose edges are yet to be scanned
+    # what the current stage labelled or reached, the dual updates only look at those
+    forest_vertices, forest_blossoms, reached = set(), set(), set()
+
+    for k, (i, j, w) in enumerate(edges):
+        if w == max_weight and mate[i] < 0 and mate[j] < 0:  # tight under the initial duals
+            mate[i], mate[j] = 2 * k + 1, 2 * k
+
+    def slack(k):
+        i, j, w = edges[k]
+        return dualvar[i] + dualvar[j] - 2 * w
+
+    def blossom_leaves(b):
+        if b < n:
+            yield b
+            return
+        stack = [b]
+        while stack:
+            for t in blossomchilds[stack.pop()]:
+                if t < n:
+                    yield t
+                else:
+                    stack.append(t)
+
+    def assign_label(w, t, p):
+        while True:
+            b = inblossom[w]
+            label[w] = label[b] = t
+            labelend[w] = labelend[b] = p
+            bestedge[w] = bestedge[b] = -1
+            forest_blossoms.add(b)
+            leaves = list(blossom_leaves(b))
+            forest_vertices.update(leaves)
+            if t == 1:
+                queue.extend(leaves)
+                return
+            # a T blossom, its base's mate becomes S
+            base = blossombase[b]
+            w, t, p = endpoint[mate[base]], 1, mate[base] ^ 1
+
+    def scan_blossom(v, w):
+        """
+        trace back from v and w to find the base of a new blossom, -1 when the paths reach two roots (augmenting)
+        """
+        path = []
+        base = -1
+        while v != -1 or w != -1:
+            b = inblossom[v]
+            if label[b] & 4:
+                base = blossombase[b]
+                break
+            path.append(b)
+            label[b] = 5  # breadcrumb
+            if labelend[b] == -1:
+                v = -1  # the root
+            else:
+                v = endpoint[labelend[b]]
+                b = inblossom[v]
+                v = endpoint[labelend[b]]  # b is T, one more step back
+            if w != -1:
+                v, w = w, v
+        for b in path:
+            label[b] = 1
+        return base
+
+    def add_blossom(base, k):
+        v, w, _ = edges[k]
+        bb, bv, bw = inblossom[base], inblossom[v], inblossom[w]
+        b = unusedblossoms.pop()
+        blossombase[b] = base
+        blossomparent[b] = -1
+        blossomparent[bb] = b
+        blossomchilds[b] = path = []
+        blossomendps[b] = endps = []
+        while bv != bb:  # from v back to the base
+            blossomparent[bv] = b
+            path.append(bv)
+            endps.append(labelend[bv])
+            v = endpoint[labelend[bv]]
+            bv = inblossom[v]
+        path.append(bb)
+        path.reverse()
+        endps.reverse()
+        endps.append(2 * k)
+        while bw != bb:  # from w back to the base
+            blossomparent[bw] = b
+            path.append(bw)
+            endps.append(labelend[bw] ^ 1)
+            w = endpoint[labelend[bw]]
+            bw = inblossom[w]
+        label[b] = 1
+        labelend[b] = labelend[bb]
+        dualvar[b] = 0
+        forest_blossoms.add(b)
+        for v in blossom_leaves(b):
+            if label[inblossom[v]] == 2:
+                queue.append(v)  # former T vertices are S now
+            inblossom[v] = b
+        # least slack edges to the other S blossoms, from those of the sub-blossoms
+        bestedgeto = {}
+        for bv in path:
+            if blossombestedges[bv] is None:
+                nblists = [[p // 2 for p in neighbend[v]] for v in blossom_leaves(bv)]
+            else:
+                nblists = [blossombestedges[bv]]
+            for nblist in nblists:
+                for k in nblist:
+                    i, j, _ = edges[k]
+                    if inblossom[j] == b:
+                        i, j = j, i
+                    bj = inblossom[j]
+                    if bj != b and label[bj] == 1 and (bj not in bestedgeto or slack(k) < slack(bestedgeto[bj])):
+                        bestedgeto[bj] = k
+            blossombestedges[bv] = None
+            bestedge[bv] = -1
+        blossombestedges[b] = list(bestedgeto.values())
+        bestedge[b] = min(blossombestedges[b], key=slack, default=-1)
+
+    def expand_blossom(b, endstage):
+        for s in blossomchilds[b]:
+            blossomparent[s] = -1
+            if s < n:
+                inblossom[s] = s
+            elif endstage and dualvar[s] == 0:
+                yield s, endstage
+            else:
+                for v in blossom_leaves(s):
+                    inblossom[v] = s
+        if not endstage and label[b] == 2:
+            # relabel the sub-blossoms on the even path from the entry child to the base
+            entrychild = inblossom[endpoint[labelend[b] ^ 1]]
+            childs, endps = blossomchilds[b], blossomendps[b]
+            j = childs.index(entrychild)
+            if j & 1:
+                j -= len(childs)  # odd, forward with wrap around
+                jstep, endptrick = 1, 0
+            else:
+                jstep, endptrick = -1, 1
+            p = labelend[b]
+            while j != 0:
+                label[endpoint[p ^ 1]] = 0
+                label[endpoint[endps[j - endptrick] ^ endptrick ^ 1]] = 0
+                assign_label(endpoint[p ^ 1], 2, p)
+                allowedge[endps[j - endptrick] // 2] = True
+                j += jstep
+                p = endps[j - endptrick] ^ endptrick
+                allowedge[p // 2] = True
+                j += jstep
+            # the base sub-blossom gets T without its mate being relabeled
+            bv = childs[j]
+            label[endpoint[p ^ 1]] = label[bv] = 2
+            labelend[endpoint[p ^ 1]] = labelend[bv] = p
+            bestedge[bv] = -1
+            forest_blossoms.add(bv)
+            j += jstep
+            # the other sub-blossoms keep a T label only if reachable from an S vertex outside
+            while childs[j] != entrychild:
+                bv = childs[j]
+                if label[bv] == 1:
+                    j += jstep
+                    continue
+                reached = next((v for v in blossom_leaves(bv) if label[v] != 0), None)
+                if reached is not None:
+                    label[reached] = 0
+                    label[endpoint[mate[blossombase[bv]]]] = 0
+                    assign_label(reached, 2, labelend[reached])
+                j += jstep
+        label[b] = labelend[b] = -1
+        blossomchilds[b] = blossomendps[b] = None
+        blossombase[b] = -1
+        blossombestedges[b] = None
+        bestedge[b] = -1
+        unusedblossoms.append(b)
+
+    def augment_blossom(b, v):
+        """
+        swap the matched and unmatched edges on the even path from v to the base of b, v becomes its base
+        """
+        t = v
+        while blossomparent[t] != b:
+            t = blossomparent[t]
+        if t >= n:
+            yield t, v
+        childs, endps = blossomchilds[b], blossomendps[b]
+        i = j = childs.index(t)
+        if i & 1:
+            j -= len(childs)
+            jstep, endptrick = 1, 0
+        else:
+            jstep, endptrick = -1, 1
+        while j != 0:
+            j += jstep
+            t = childs[j]
+            p = endps[j - endptrick] ^ endptrick
+            if t >= n:
+                yield t, endpoint[p]
+            j += jstep
+            t = childs[j]
+            if t >= n:
+                yield t, endpoint[p ^ 1]
+            mate[endpoint[p]] = p ^ 1
+            mate[endpoint[p ^ 1]] = p
+        blossomchilds[b] = childs[i:] + childs[:i]
+        blossomendps[b] = endps[i:] + endps[:i]
+        blossombase[b] = blossombase[blossomchilds[b][0]]
+
+    def augment_matching(k):
+        v, w, _ = edges[k]
+        for s, p in ((v, 2 * k + 1), (w, 2 * k)):
+            # from s back to its root, flipping the edges of the alternating path
+            while True:
+                bs = inblossom[s]
+                if bs >= n:
+                    _run(augment_blossom, bs, s)
+                mate[s] = p
+                if labelend[bs] == -1:
+                    break
+                t = endpoint[labelend[bs]]
+                bt = inblossom[t]
+                s = endpoint[labelend[bt]]
+                j = endpoint[labelend[bt] ^ 1]
+                if bt >= n:
+                    _run(augment_blossom, bt, j)
+                mate[j] = labelend[bt]
+                p = labelend[bt] ^ 1
+
+    for _ in range(n):  # stages, each augments the matching by one edge or ends
+        label[:] = [0] * (2 * n)
+        bestedge[:] = [-1] * (2 * n)
+        blossombestedges[n:] = [None] * n
+        allowedge[:] = [False] * n_edge
+        queue[:] = []
+        forest_vertices.clear()
+        forest_blossoms.clear()
+        reached.clear()
+        for v in range(n):
+            if mate[v] == -1 and label[inblossom[v]] == 0:
+                assign_label(v, 1, -1)
+        augmented = False
+        while True:
+            while queue and not augmented:
+                v = queue.pop()
+                for p in neighbend[v]:
+                    k = p // 2
+                    w = endpoint[p]
+                    if inblossom[v] == inblossom[w]:
+                        continue
+                    if not allowedge[k]:
+                        kslack = slack(k)
+                        if kslack <= 0:
+                            allowedge[k] = True
+                    if allowedge[k]:
+                        if label[inblossom[w]] == 0:
+                            assign_label(w, 2, p ^ 1)
+                        elif label[inblossom[w]] == 1:
+                            if (base := scan_blossom(v, w)) >= 0:
+                                add_blossom(base, k)
+                            else:
+                                augment_matching(k)
+                                augmented = True
+                                break
+                        elif label[w] == 0:
+                            label[w] = 2  # inside a T blossom, reached now
+                            labelend[w] = p ^ 1
+                    elif label[inblossom[w]] == 1:
+                        b = inblossom[v]
+                        if bestedge[b] == -1 or kslack < slack(bestedge[b]):
+                            bestedge[b] = k
+                    elif label[w] == 0:
+                        if bestedge[w] == -1 or kslack < slack(bestedge[w]):
+                            bestedge[w] = k
+                            reached.add(w)
+            if augmented:
+                break
+            # no tight edge left to grow the forest: change the duals by the largest delta keeping them feasible
+            deltatype, delta, deltaedge, deltablossom = -1, None, -1, -1
+            if not max_cardinality:
+                deltatype, delta = 1, min(dualvar[:n])  # a vertex dual reaches zero
+            for v in reached:
+                if label[inblossom[v]] == 0 and bestedge[v] != -1:
+                    d = slack(bestedge[v])
+                    if deltatype == -1 or d < delta:
+                        delta, deltatype, deltaedge = d, 2, bestedge[v]  # S to free
+            for b in forest_blossoms:
+                if blossomparent[b] == -1 and label[b] == 1 and bestedge[b] != -1:
+                    d = slack(bestedge[b]) // 2
+                    if deltatype == -1 or d < delta:
+                        delta, deltatype, deltaedge = d, 3, bestedge[b]  # S to S
+            for b in forest_blossoms:
+                if b >= n and blossombase[b] >= 0 and blossomparent[b] == -1 and label[b] == 2 and (deltatype == -1 or dualvar[b] < delta):
+                    delta, deltatype, deltablossom = dualvar[b], 4, b  # a T blossom to expand
+            if deltatype == -1:
+                deltatype, delta = 1, max(0, min(dualvar[:n]))  # max_cardinality and nothing left to grow
+            for v in forest_vertices:
+                if (lb := label[inblossom[v]]) == 1:
+                    dualvar[v] -= delta
+                elif lb == 2:
+                    dualvar[v] += delta
+            for b in forest_blossoms:
+                if b >= n and blossombase[b] >= 0 and blossomparent[b] == -1:
+                    if label[b] == 1:
+                        dualvar[b] += delta
+                    elif label[b] == 2:
+                        dualvar[b] -= delta
+            if deltatype == 1:
+                break  # optimum
+            if deltatype == 2:
+                allowedge[deltaedge] = True
+                i, j, _ = edges[deltaedge]
+                queue.append(i if label[inblossom[i]] == 1 else j)
+            elif deltatype == 3:
+                allowedge[deltaedge] = True
+                queue.append(edges[deltaedge][0])
+            else:
+                _run(expand_blossom, deltablossom, False)
+        if not augmented:
+            break
+        for b in list(forest_blossoms):
+            if b >= n and blossomparent[b] == -1 and blossombase[b] >= 0 and label[b] == 1 and dualvar[b] == 0:
+                _run(expand_blossom, b, True)
+    return [endpoint[p] if p >= 0 else -1 for p in mate]
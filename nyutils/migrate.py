@@ -0,0 +1,92 @@
+"""
+versioned schema migrations. every component (server, league, ...) owns an ordered set of steps and the
+version it reached is kept in the schema_version table; a database that is current costs a single select
+"""
+import logging
+import time
+import typing
+
+from .database import use_database, write_lock
+
+logger = logging.getLogger(__name__)
+SCHEMA_TABLE = 'schema_version'
+
+
+class Migrations:
+    """
+    steps of one component, registered with @migrations.step(version). a step runs in its own transaction
+    and must cope with databases created before versioning existed (IF NOT EXISTS, column checks).
+    a step's DDL is frozen as sql: create_tables() with the model classes would emit their current schema,
+    leaking columns and indexes of later steps into an earlier version
+    """
+    registry: dict[str, 'Migrations'] = {}
+
+    def __init__(self, component: str):
+        if component in Migrations.registry:
+            raise ValueError(f"Migrations of '{component}' already registered")
+        self.component = component
+        self.steps: dict[int, typing.Callable[[], None]] = {}
+        Migrations.registry[component] = self
+
+    def step(self, version: int):
+        def decorator(func):
+            if version < 1 or version in self.steps:
+                raise ValueError(f"Invalid or duplicate migration version {version} of '{self.component}'")
+            self.steps[version] = func
+            return func
+
+        return decorator
+
+    @property
+    def version(self) -> int:
+        return max(self.steps, default=0)
+
+
+def execute(statements: typing.Iterable[str], database=use_database):
+    for sql in statements:
+        database.execute_sql(sql)
+
+
+def has_column(table: str, column: str, database=use_database) -> bool:
+    return any(c.name == column for c in database.get_columns(table))
+
+
+def add_column(table: str, column: str, definition: str, database=use_database) -> bool:
+    """
+    ALTER TABLE table ADD COLUMN "column" definition, False when the column exists already.
+    a NOT NULL definition needs a DEFAULT
+    """
+    if has_column(table, column, database):
+        return False
+    database.execute_sql(f'ALTER TABLE "{table}" ADD COLUMN "{column}" {definition}')
+    return True
+
+
+def versions(database=use_database) -> dict[str, int]:
+    database.execute_sql(f'CREATE TABLE IF NOT EXISTS "{SCHEMA_TABLE}" ("component" TEXT PRIMARY KEY, "version" INTEGER NOT NULL)')
+    return dict(database.execute_sql(f'SELECT "component", "version" FROM "{SCHEMA_TABLE}"').fetchall())
+
+
+def migrate(database=use_database) -> dict[str, tuple[int, int]]:
+    """
+    bring every registered component to its latest version, returns {component: (from, to)} of those migrated
+    """
+    current = versions(database)
+    pending = [m for m in Migrations.registry.values() if current.get(m.component, 0) < m.version]
+    if not pending:
+        return {}
+    done = {}
+    with write_lock:
+        current = versions(database)  # another thread may have migrated meanwhile
+        for m in pending:
+            start_version = version = current.get(m.component, 0)
+            for v in sorted(v for v in m.steps if v > version):
+                start = time.perf_counter()
+                with database.atomic():
+                    m.steps[v]()
+                    database.execute_sql(f'INSERT OR REPLACE INTO "{SCHEMA_TABLE}" ("component", "version") VALUES (?, ?)', (m.component, v))
+                logger.info(f'Migrated {m.component} to version {v} ({m.steps[v].__name__}) in {time.perf_counter() - start:.3f}s')
+                version = v
+            if version != start_version:
+                done[m.component] = (start_version, version)
+    return done
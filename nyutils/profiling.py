@@ -0,0 +1,298 @@
+"""
+on demand profiling of a live process. Profiler runs either cProfile around selected calls (deterministic) or a
+sampler over the stacks of every thread, bounded in time and number of calls, and dumps the aggregate to a file;
+MemoryTracker diffs tracemalloc snapshots, and sizes of named structures, against the previous snapshot.
+nothing is hooked while they are off
+"""
+import collections
+import cProfile
+import fnmatch
+import gc
+import logging
+import pathlib
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+import typing
+
+from .green import spawn_blocking
+
+logger = logging.getLogger(__name__)
+MAX_SECONDS = 600.
+MAX_DEPTH = 64
+KINDS = ('deterministic', 'sampling')
+# a stack ending in these is a thread waiting (a lock, a queue, select), counted apart from the busy ones
+IDLE_FILES = ('threading.py', 'queue.py', 'selectors.py', 'socketserver.py', 'hub.py')
+
+
+class ProfileSession:
+    def __init__(self, kind: str, patterns: list[str] | None, seconds: float, calls: int | None, interval: float):
+        self.kind = kind
+        self.patterns = patterns
+        self.started = time.time()
+        self.deadline = time.monotonic() + seconds
+        self.seconds = seconds
+        self.max_calls = calls
+        self.calls = 0
+        self.skipped = 0  # calls another profiler of the thread was active for
+        self.interval = interval
+        self.stats: pstats.Stats | None = None
+        self.samples: collections.Counter[tuple[str, ...]] = collections.Counter()
+        self.sample_count = 0
+        self.idle = 0
+        self.active = True
+
+    def to_dict(self):
+        return {
+            'kind': self.kind,
+            'patterns': self.patterns,
+            'started': self.started,
+            'remaining_seconds': max(0., self.deadline - time.monotonic()),
+            'calls': self.calls,
+            'max_calls': self.max_calls,
+            'skipped': self.skipped,
+            'samples': self.sample_count,
+            'idle_stacks': self.idle,
+        }
+
+
+def _where(code) -> str:
+    return f'{pathlib.PurePath(code.co_filename).name}:{code.co_firstlineno}({code.co_name})'
+
+
+class Profiler:
+    def __init__(self, output_dir='profiles', on_change: typing.Callable[[], None] | None = None, top=30):
+        self.output_dir = pathlib.Path(output_dir)
+        self.on_change = on_change  # called when a session starts or ends, e.g. to re-apply route wrappers
+        self.top = top
+        self.session: ProfileSession | None = None
+        self.last: dict | None = None
+        self.lock = threading.Lock()
+
+    def start(self, kind='deterministic', patterns: list[str] | None = None, seconds=30., calls: int | None = None,
+              interval=.005) -> dict:
+        """
+        deterministic profiles the calls whose name matches one of patterns (fnmatch, None for all), sampling
+        samples every thread each interval seconds; both end after seconds or, deterministic only, calls calls
+        """
+        if kind not in KINDS:
+            raise ValueError(f"Unknown profiler kind '{kind}'")
+        if not 0 < seconds <= MAX_SECONDS:
+            raise ValueError(f'seconds must be within (0, {MAX_SECONDS}]')
+        with self.lock:
+            if self.session is not None:
+                raise RuntimeError('A profiling session is already running')
+            self.session = session = ProfileSession(kind, patterns, seconds, calls, max(interval, .001))
+        timer = threading.Timer(seconds, self._expire, (session,))
+        timer.daemon = True
+        timer.start()
+        if kind == 'sampling':
+            spawn_blocking(self._sample_loop, session)  # a native thread under gevent, a greenlet would not see the others
+        logger.info(f'Profiling started: {kind} for {seconds}s' + (f' or {calls} calls' if calls else '')
+                    + (f' of {patterns}' if patterns else ''))
+        if self.on_change:
+            self.on_change()
+        return session.to_dict()
+
+    def matches(self, name: str) -> bool:
+        if (session := self.session) is None or session.kind != 'deterministic':
+            return False
+        return session.patterns is None or any(fnmatch.fnmatchcase(name, p) for p in session.patterns)
+
+    def call(self, func: typing.Callable, *args, **kwargs):
+        """
+        func(*args, **kwargs) under cProfile when a deterministic session runs, the stats are merged into it
+        """
+        if (session := self.session) is None or not session.active:
+            return func(*args, **kwargs)
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:  # another profiler, or one global profiler per process on python 3.12+
+            session.skipped += 1
+            return func(*args, **kwargs)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.disable()
+            self._merge(session, profile)
+
+    def _merge(self, session, profile):
+        done = False
+        with self.lock:
+            if not session.active:
+                return
+            if session.stats is None:
+                session.stats = pstats.Stats(profile)
+            else:
+                session.stats.add(profile)
+            session.calls += 1
+            done = session.max_calls is not None and session.calls >= session.max_calls
+        if done:
+            self._finish(session, 'calls')
+
+    def _expire(self, session):
+        self._finish(session, 'time')
+
+    def stop(self) -> dict:
+        if (session := self.session) is None:
+            raise RuntimeError('No profiling session is running')
+        return self._finish(session, 'stopped')
+
+    def _finish(self, session, reason) -> dict | None:
+        with self.lock:
+            if not session.active:
+                return None
+            session.active = False
+            if self.session is session:
+                self.session = None
+        try:
+            self.last = result = self._dump(session, reason)
+        except Exception as e:
+            logger.error(f'Failed to dump the profile: {e}', exc_info=True)
+            self.last = result = {**session.to_dict(), 'reason': reason, 'error': str(e)}
+        else:
+            logger.info(f"Profiling ended ({reason}), written to {result['file']}")
+        if self.on_change:
+            self.on_change()
+        return result
+
+    def _dump(self, session, reason) -> dict:
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(session.started))
+        result = {**session.to_dict(), 'reason': reason, 'file': None, 'top': []}
+        if session.kind == 'deterministic':
+            if session.stats is None:
+                return result
+            path = self.output_dir / f'profile-{stamp}.pstats'
+            session.stats.dump_stats(path)  # pstats.Stats(path) or snakeviz reads it
+            rows = sorted(session.stats.stats.items(), key=lambda i: i[1][3], reverse=True)[:self.top]
+            result['top'] = [{'function': f'{pathlib.PurePath(f).name}:{line}({name})', 'calls': nc,
+                              'tottime': round(tt, 6), 'cumtime': round(ct, 6)}
+                             for (f, line, name), (cc, nc, tt, ct, callers) in rows]
+        else:
+            path = self.output_dir / f'profile-{stamp}.folded'
+            with open(path, 'w', encoding='utf-8') as f:  # collapsed stacks, for flamegraph.pl or speedscope
+                for stack, count in session.samples.most_common():
+                    f.write(f"{';'.join(stack)} {count}\n")
+            own = collections.Counter()
+            total = collections.Counter()
+            for stack, count in session.samples.items():
+                own[stack[-1]] += count
+                for where in set(stack):
+                    total[where] += count
+            result['top'] = [{'function': where, 'own': own[where], 'total': count}
+                             for where, count in total.most_common(self.top)]
+        result['file'] = path.name
+        return result
+
+    def _sample_loop(self, session):
+        while session.active and time.monotonic() < session.deadline:
+            self._take_sample(session)
+            time.sleep(session.interval)
+
+    def _take_sample(self, session):
+        own_code = Profiler._take_sample.__code__
+        for frame in sys._current_frames().values():
+            if frame.f_code is own_code:
+                continue
+            if frame.f_code.co_filename.endswith(IDLE_FILES):
+                session.idle += 1
+                continue
+            stack = []
+            while frame is not None and len(stack) < MAX_DEPTH:
+                stack.append(_where(frame.f_code))
+                frame = frame.f_back
+            stack.reverse()
+            session.samples[tuple(stack)] += 1
+        session.sample_count += 1
+
+    def status(self) -> dict:
+        return {
+            'session': session.to_dict() if (session := self.session) is not None else None,
+            'last': self.last,
+            'files': sorted(p.name for p in self.output_dir.glob('profile-*')) if self.output_dir.is_dir() else [],
+        }
+
+
+class MemoryTracker:
+    """
+    tracemalloc snapshots, each compared with the previous one. probes are named callables returning the size of
+    a structure suspected to grow (a cache, a listener table), reported with their change as well
+    """
+
+    def __init__(self, probes: dict[str, typing.Callable[[], int]] | None = None):
+        self.probes = dict(probes or {})
+        self.previous: tracemalloc.Snapshot | None = None
+        self.previous_probes: dict[str, int] = {}
+        self.previous_time = None
+        self.lock = threading.Lock()
+
+    @property
+    def tracing(self):
+        return tracemalloc.is_tracing()
+
+    def start(self, frames=10):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+            logger.info(f'tracemalloc started with {frames} frames')
+
+    def stop(self):
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+            logger.info('tracemalloc stopped')
+        with self.lock:
+            self.previous = None
+
+    def measure(self) -> dict[str, int]:
+        sizes = {}
+        for name, probe in self.probes.items():
+            try:
+                sizes[name] = probe()
+            except Exception as e:
+                logger.warning(f'Memory probe {name} failed: {e}')
+        sizes['gc.objects'] = len(gc.get_objects())
+        return sizes
+
+    def snapshot(self, limit=30, group_by: typing.Literal['lineno', 'filename', 'traceback'] = 'lineno') -> dict:
+        """
+        take a snapshot, returns the top allocation sites by growth since the previous one (by size when first)
+        """
+        if not tracemalloc.is_tracing():
+            raise RuntimeError('tracemalloc is not running')
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+        ))
+        sizes = self.measure()
+        current, peak = tracemalloc.get_traced_memory()
+        with self.lock:
+            previous, previous_sizes, previous_time = self.previous, self.previous_probes, self.previous_time
+            self.previous, self.previous_probes, self.previous_time = snapshot, sizes, time.time()
+        if previous is not None:
+            stats = snapshot.compare_to(previous, group_by)
+            top = [{'where': self._where(s.traceback, group_by), 'size': s.size, 'size_diff': s.size_diff,
+                    'count': s.count, 'count_diff': s.count_diff} for s in stats[:limit]]
+        else:
+            top = [{'where': self._where(s.traceback, group_by), 'size': s.size, 'count': s.count}
+                   for s in snapshot.statistics(group_by)[:limit]]
+        return {
+            'traced_bytes': current,
+            'peak_bytes': peak,
+            'since': previous_time,
+            'top': top,
+            'probes': {name: {'size': size, 'diff': size - previous_sizes[name] if name in previous_sizes else None}
+                       for name, size in sizes.items()},
+        }
+
+    @staticmethod
+    def _where(traceback: tracemalloc.Traceback, group_by) -> str | list[str]:
+        frames = [f'{f.filename}:{f.lineno}' for f in traceback]
+        return frames if group_by == 'traceback' else frames[0]
+
+    def status(self) -> dict:
+        current, peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+        return {'tracing': self.tracing, 'traced_bytes': current, 'peak_bytes': peak,
+                'has_previous': self.previous is not None, 'probes': list(self.probes)}
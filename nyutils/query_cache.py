@@ -0,0 +1,112 @@
+"""
+cache of query results keyed by the query's sql and params, an LRU bounded by the approximate memory of the results.
+an entry keeps the versions (nyutils.database.ChangeTrackingMixin) of the tables its sql reads and is stale as soon
+as one of them changes, writers need no explicit invalidation
+"""
+import collections
+import functools
+import re
+import sys
+import threading
+import typing
+
+import peewee
+
+T = typing.TypeVar('T')
+_re_source = re.compile(r'\b(?:FROM|JOIN)\s+"([^"]+)"', re.IGNORECASE)
+
+
+@functools.lru_cache(maxsize=1024)
+def tables_of(sql: str) -> tuple[str, ...]:
+    return tuple(sorted(set(_re_source.findall(sql))))
+
+
+def sizeof(value) -> int:
+    """
+    approximate memory of a json like value
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for k, v in value.items():
+            size += sizeof(k) + sizeof(v)
+    elif isinstance(value, (list, tuple)):
+        for v in value:
+            size += sizeof(v)
+    return size
+
+
+class CacheEntry:
+    __slots__ = ('versions', 'value', 'size')
+
+    def __init__(self, versions: tuple[int, ...], value, size: int):
+        self.versions = versions
+        self.value = value
+        self.size = size
+
+
+class QueryCache:
+    def __init__(self, database, max_bytes=16 << 20, max_entry_bytes=None):
+        self.database = database
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes or max_bytes // 16
+        self._items: collections.OrderedDict[tuple, CacheEntry] = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+    def get(self, query: peewee.Query, compute: typing.Callable[[], T], *extra) -> T:
+        """
+        compute()'s result for query, extra (the page, ...) is part of the key. the result is shared with later
+        callers and must not be modified
+        """
+        sql, params = query.sql()
+        tables = tables_of(sql)
+        key = (sql, tuple(params), extra)
+        versions = self.database.versions_of(tables)  # before computing, a write meanwhile leaves the entry stale
+        with self._lock:
+            if (entry := self._items.get(key)) is not None:
+                if entry.versions == versions:
+                    self._items.move_to_end(key)
+                    self.hits += 1
+                    return entry.value
+                del self._items[key]
+                self.bytes -= entry.size
+                self.stale += 1
+            self.misses += 1
+        value = compute()
+        if self.database.changed_in_transaction(tables):
+            return value  # sees writes of this connection not committed yet
+        if (size := sizeof(value) + sizeof(key)) > self.max_entry_bytes:
+            return value
+        with self._lock:
+            if (old := self._items.pop(key, None)) is not None:
+                self.bytes -= old.size
+            self._items[key] = CacheEntry(versions, value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.bytes -= evicted.size
+                self.evictions += 1
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._items),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'stale': self.stale,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.,
+            }
@@ -0,0 +1,134 @@
+import logging
+import re
+import threading
+import typing
+
+logger = logging.getLogger(__name__)
+
+_re_string = re.compile(r"'(?:[^']|'')*'")
+_re_number = re.compile(r'\b\d+(?:\.\d+)?\b')
+_re_in_list = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_re_space = re.compile(r'\s+')
+_explainable = ('SELECT', 'UPDATE', 'DELETE', 'INSERT', 'REPLACE', 'WITH')
+
+
+def fingerprint(sql: str) -> str:
+    """
+    normalize a statement so queries differing only by literals or IN list length aggregate together
+    """
+    sql = _re_string.sub('?', sql)
+    sql = _re_number.sub('?', sql)
+    sql = _re_in_list.sub('(...)', sql)
+    return _re_space.sub(' ', sql).strip()
+
+
+def param_shapes(params) -> list[str]:
+    # only types and sizes, values may be password hashes or tokens
+    res = []
+    for p in params or ():
+        if isinstance(p, (str, bytes)):
+            res.append(f'{type(p).__name__}[{len(p)}]')
+        else:
+            res.append(type(p).__name__)
+    return res
+
+
+class StatementStats:
+    __slots__ = ('count', 'total_time', 'max_time', 'slow_count', 'plan', 'full_scan')
+
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.
+        self.max_time = 0.
+        self.slow_count = 0
+        self.plan = None
+        self.full_scan = False
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'total_time': self.total_time,
+            'avg_time': self.total_time / self.count if self.count else 0,
+            'max_time': self.max_time,
+            'slow_count': self.slow_count,
+            'plan': self.plan,
+            'full_scan': self.full_scan,
+        }
+
+
+class QueryLog:
+    """
+    times every statement of a database created with nyutils.database.StatementHookMixin,
+    aggregates by fingerprint and logs statements slower than threshold with their query plan
+    """
+
+    def __init__(self, database, max_fingerprints=1000):
+        self.database = database
+        self.max_fingerprints = max_fingerprints
+        self.threshold = None
+        self.stats: dict[str, StatementStats] = {}
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.threshold is not None
+
+    def enable(self, threshold: float = .1):
+        self.threshold = threshold
+        self.database.add_statement_hook(self.on_statement)
+
+    def disable(self):
+        self.threshold = None
+        self.database.remove_statement_hook(self.on_statement)
+
+    def reset(self):
+        with self.lock:
+            self.stats = {}
+
+    def explain(self, sql, params) -> list[str] | None:
+        if not sql.lstrip().upper().startswith(_explainable):
+            return None
+        try:
+            # straight on the sqlite connection, going through execute_sql would call the hook again
+            cursor = self.database.connection().execute('EXPLAIN QUERY PLAN ' + sql, params or ())
+            return [row[3] for row in cursor.fetchall()]
+        except Exception as e:
+            logger.debug(f'Failed to explain statement {sql}: {e}')
+            return None
+
+    def on_statement(self, sql, params, elapsed):
+        if (threshold := self.threshold) is None:
+            return
+        fp = fingerprint(sql)
+        with self.lock:
+            if (st := self.stats.get(fp)) is None:
+                if len(self.stats) >= self.max_fingerprints:
+                    return
+                self.stats[fp] = st = StatementStats()
+            st.count += 1
+            st.total_time += elapsed
+            if elapsed > st.max_time:
+                st.max_time = elapsed
+            if elapsed < threshold:
+                return
+            st.slow_count += 1
+            need_plan = st.plan is None
+        if need_plan and (plan := self.explain(sql, params)) is not None:
+            st.plan = plan
+            st.full_scan = any(line.startswith('SCAN') and 'USING' not in line for line in plan)
+        plan_text = '\n'.join(f'  {line}' for line in st.plan or ())
+        logger.warning(
+            f'Slow statement {elapsed * 1000:.1f}ms{" (full table scan)" if st.full_scan else ""}: {sql}\n'
+            f'params: {param_shapes(params)}\n'
+            f'plan:\n{plan_text}'
+        )
+
+    def summary(self, order_by: typing.Literal['total_time', 'max_time', 'count', 'slow_count'] = 'total_time', limit=50):
+        with self.lock:
+            items = [(fp, st.to_dict()) for fp, st in self.stats.items()]
+        items.sort(key=lambda i: i[1][order_by], reverse=True)
+        return {
+            'enabled': self.enabled,
+            'threshold': self.threshold,
+            'statements': [{'fingerprint': fp, **st} for fp, st in items[:limit]],
+        }
@@ -0,0 +1,202 @@
+"""
+regular expressions for the REGEXP udfs: a bounded LRU of compiled patterns with complexity limits, and the
+literals every match must contain so queries can filter with instr (or an index range) before the python udf
+"""
+import collections
+import re
+import sys
+import threading
+from re import _parser as sre_parse
+
+import peewee
+
+MAX_PATTERN_LENGTH = 512
+MAX_REPEAT_COUNT = 1000
+REPEATS = (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT, sre_parse.POSSESSIVE_REPEAT)
+# what sqlite's lower() cannot fold like IGNORECASE: anything outside ascii, and the letters that also match
+# outside it (kelvin sign, long s, dotless i)
+_UNSAFE_FOLD = re.compile(r'[iksIKS]|[^\x00-\x7f]')
+
+
+class PatternError(ValueError):
+    pass
+
+
+class PatternInfo:
+    __slots__ = ('compiled', 'prefix', 'literals', 'ignore_case')
+
+    def __init__(self, compiled: re.Pattern, prefix: str, literals: list[str], ignore_case: bool):
+        self.compiled = compiled
+        self.prefix = prefix  # the match starts the string with it, usable as an index range
+        self.literals = literals  # every match contains each of them
+        self.ignore_case = ignore_case
+
+
+def _children(op, av):
+    if op is sre_parse.SUBPATTERN:
+        return [av[3]]
+    if op in REPEATS:
+        return [av[2]]
+    if op is sre_parse.BRANCH:
+        return av[1]
+    if op is sre_parse.ATOMIC_GROUP:
+        return [av]
+    if op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+        return [av[1]]
+    if op is sre_parse.GROUPREF_EXISTS:
+        return [p for p in av[1:] if p is not None]
+    return []
+
+
+def _check(items, in_repeat=False):
+    """
+    rejects the shapes behind catastrophic backtracking, a variable repeat nested in another repeat ((a+)+, (\\w*x)*)
+    """
+    for op, av in items:
+        if op in REPEATS:
+            lo, hi = av[0], av[1]
+            if lo > MAX_REPEAT_COUNT or (hi != sre_parse.MAXREPEAT and hi > MAX_REPEAT_COUNT):
+                raise PatternError(f'Repeat count above {MAX_REPEAT_COUNT}')
+            if in_repeat and lo != hi:
+                raise PatternError('Nested repetition is not allowed')
+            _check(av[2], in_repeat or hi > 1)
+        else:
+            for child in _children(op, av):
+                _check(child, in_repeat)
+
+
+def _literals(items, out: list[str]):
+    """
+    literal runs that every match contains: those of the sequence itself, of plain groups and of repeats of at least one
+    """
+    run = []
+    for op, av in items:
+        if op is sre_parse.LITERAL:
+            run.append(chr(av))
+            continue
+        if run:
+            out.append(''.join(run))
+            run = []
+        if op is sre_parse.SUBPATTERN and not av[1] and not av[2]:  # groups with their own flags are skipped
+            _literals(av[3], out)
+        elif op in REPEATS and av[0] >= 1:
+            _literals(av[2], out)
+        elif op is sre_parse.ATOMIC_GROUP:
+            _literals(av, out)
+    if run:
+        out.append(''.join(run))
+
+
+def _prefix(items, flags) -> str:
+    if not items or items[0][0] is not sre_parse.AT:
+        return ''
+    if not (items[0][1] is sre_parse.AT_BEGINNING_STRING or (items[0][1] is sre_parse.AT_BEGINNING and not flags & re.MULTILINE)):
+        return ''
+    prefix = []
+    for op, av in items[1:]:
+        if op is not sre_parse.LITERAL:
+            break
+        prefix.append(chr(av))
+    return ''.join(prefix)
+
+
+def analyze(pattern: str, flags=0) -> PatternInfo:
+    if not isinstance(pattern, str):
+        raise PatternError('Pattern must be a string')
+    if len(pattern) > MAX_PATTERN_LENGTH:
+        raise PatternError(f'Pattern longer than {MAX_PATTERN_LENGTH} characters')
+    try:
+        parsed = sre_parse.parse(pattern, flags)
+        compiled = re.compile(pattern, flags)
+    except re.error as e:
+        raise PatternError(f'Invalid pattern: {e}')
+    items = list(parsed)
+    _check(items)
+    flags = parsed.state.flags  # with the inline ones, (?i)...
+    ignore_case = bool(flags & re.IGNORECASE)
+    literals = []
+    _literals(items, literals)
+    prefix = _prefix(items, flags)
+    if ignore_case:
+        prefix = ''
+        literals = [part.lower() for lit in literals for part in _UNSAFE_FOLD.split(lit) if part]
+    selected = []
+    for lit in sorted(set(literals), key=len, reverse=True):
+        if lit not in prefix and not any(lit in other for other in selected):
+            selected.append(lit)
+    return PatternInfo(compiled, prefix, selected[:3], ignore_case)
+
+
+class PatternCache:
+    """
+    LRU of analyzed patterns, keyed by (pattern, flags); invalid patterns are cached as their error
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._items: collections.OrderedDict[tuple[str, int], PatternInfo | PatternError] = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._last = (None, None, None)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, pattern: str, flags=0) -> PatternInfo:
+        # a scan calls the udf with the same pattern for every row, that one skips the lock and the reordering
+        last_pattern, last_flags, info = self._last
+        if last_pattern != pattern or last_flags != flags:
+            info = self._lookup(pattern, flags)
+            self._last = (pattern, flags, info)
+        if isinstance(info, PatternError):
+            raise info
+        return info
+
+    def _lookup(self, pattern, flags):
+        key = (pattern, flags)
+        with self._lock:
+            if (info := self._items.get(key)) is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return info
+        try:
+            info = analyze(pattern, flags)
+        except PatternError as e:
+            info = e
+        with self._lock:
+            self.misses += 1
+            self._items[key] = info
+            if len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+        return info
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._last = (None, None, None)
+
+
+patterns = PatternCache()
+
+
+def regexp(pattern, string, flags=0) -> int:
+    """
+    the REGEXP/REGEXP_ udf
+    """
+    if not isinstance(string, str):
+        return 0
+    return 1 if patterns.get(pattern, flags).compiled.search(string) is not None else 0
+
+
+def regexp_filter(field, pattern: str, flags=0) -> peewee.Expression:
+    """
+    where clause matching field against pattern, prefiltered by its required literals; raises PatternError
+    """
+    info = patterns.get(pattern, flags)
+    raw = lambda value: peewee.Value(value, converter=False)  # noqa: E731, a json field would encode them
+    expr = peewee.fn.REGEXP_(raw(pattern), field, flags) == 1
+    target = peewee.fn.lower(field) if info.ignore_case else field
+    for literal in reversed(info.literals):
+        expr = (peewee.fn.instr(target, raw(literal)) > 0) & expr
+    if info.prefix and ord(info.prefix[-1]) < sys.maxunicode:
+        # an index range on the column, upper bound is the prefix with its last character incremented
+        expr = (field >= raw(info.prefix)) & (field < raw(info.prefix[:-1] + chr(ord(info.prefix[-1]) + 1))) & expr
+    return expr
@@ -0,0 +1,264 @@
+"""
+lightweight tracing. every unit of work (a request, an event loop callback) runs in a trace whose id is added to log
+records; while enabled, traces also time their spans and the sampled or slow ones are written as json lines by a
+background thread, records that do not fit its buffer are dropped instead of slowing the caller
+"""
+import functools
+import json
+import logging
+import os
+import random
+import threading
+import time
+import typing
+
+from .query_log import fingerprint
+
+logger = logging.getLogger(__name__)
+MAX_SPANS = 256
+
+
+class Trace:
+    __slots__ = ('trace_id', 'name', 'wall', 'start', 'spans', 'open', 'sampled', 'dropped_spans', 'attrs')
+
+    def __init__(self, name: str, record: bool, sampled: bool):
+        self.trace_id = f'{random.getrandbits(64):016x}'
+        self.name = name
+        self.wall = time.time()
+        self.start = time.perf_counter()
+        self.spans: list[list] | None = [] if record else None  # [name, parent, start, duration, attrs]
+        self.open = -1  # index of the innermost open span
+        self.sampled = sampled
+        self.dropped_spans = 0
+        self.attrs = {}
+
+    def add(self, name, start, duration, attrs) -> int:
+        if len(self.spans) >= MAX_SPANS:
+            self.dropped_spans += 1
+            return -1
+        self.spans.append([name, self.open, start - self.start, duration, attrs])
+        return len(self.spans) - 1
+
+    def to_dict(self, duration) -> dict:
+        return {
+            'trace_id': self.trace_id,
+            'name': self.name,
+            'time': self.wall,
+            'duration': duration,
+            **self.attrs,
+            'spans': [{'name': n, 'parent': p, 'start': round(s, 6), 'duration': round(d, 6), **(a or {})}
+                      for n, p, s, d, a in self.spans],
+            **({'dropped_spans': self.dropped_spans} if self.dropped_spans else {}),
+        }
+
+
+class _Span:
+    __slots__ = ('trace', 'name', 'attrs', 'index', 'parent', 'start')
+
+    def __init__(self, trace: Trace, name, attrs):
+        self.trace = trace
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.parent = self.trace.open
+        self.index = self.trace.add(self.name, self.start, 0., self.attrs)
+        if self.index >= 0:
+            self.trace.open = self.index
+        return self
+
+    def __exit__(self, *exc):
+        if self.index >= 0:
+            self.trace.spans[self.index][3] = time.perf_counter() - self.start
+            self.trace.open = self.parent
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+class _Local(threading.local):
+    trace: Trace | None = None  # a class default, a missing attribute of a thread local is slow to look up
+
+
+class Tracer:
+    def __init__(self):
+        self._local = _Local()
+        self.path: str | None = None
+        self.sample_rate = 0.
+        self.slow_threshold: float | None = None
+        self.max_bytes = 0
+        self.max_buffer = 0
+        self.flush_interval = 1.
+        self.database = None
+        self._buffer: list[str] = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._writer: threading.Thread | None = None
+        self.written = 0
+        self.dropped = 0
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    def enable(self, path, sample_rate=.01, slow_threshold: float | None = .5, database=None, max_buffer=10000,
+               flush_interval=1., max_bytes=64 << 20):
+        """
+        record spans and write traces to path: a sample_rate share of them and every one slower than slow_threshold.
+        with database (a nyutils.database.StatementHookMixin) its statements are spans too
+        """
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.max_buffer = max_buffer
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.path = str(path)
+        if database is not None:
+            self.database = database
+            database.add_statement_hook(self.on_statement)
+        if self._writer is None or not self._writer.is_alive():
+            self._writer = threading.Thread(target=self._write_loop, name='trace-writer', daemon=True)
+            self._writer.start()
+
+    def disable(self):
+        self.flush()
+        self.path = None
+        if self.database is not None:
+            self.database.remove_statement_hook(self.on_statement)
+            self.database = None
+        self._wake.set()
+
+    @property
+    def current(self) -> Trace | None:
+        return self._local.trace
+
+    def current_id(self) -> str | None:
+        return trace.trace_id if (trace := self._local.trace) is not None else None
+
+    def start(self, name: str) -> Trace:
+        record = self.path is not None
+        trace = Trace(name, record, record and random.random() < self.sample_rate)
+        self._local.trace = trace
+        return trace
+
+    def finish(self, trace: Trace, **attrs):
+        if self._local.trace is trace:
+            self._local.trace = None
+        if trace.spans is None or self.path is None:
+            return
+        duration = time.perf_counter() - trace.start
+        if not (trace.sampled or (self.slow_threshold is not None and duration >= self.slow_threshold)):
+            return
+        trace.attrs.update(attrs)
+        line = json.dumps(trace.to_dict(round(duration, 6)), default=str)
+        with self._lock:
+            if len(self._buffer) >= self.max_buffer:
+                self.dropped += 1
+                return
+            self._buffer.append(line)
+
+    def run(self, name: str, func: typing.Callable, *args, **kwargs):
+        """
+        func(*args, **kwargs) in a trace of its own, or in a span of the current one
+        """
+        if self._local.trace is not None:
+            with self.span(name):
+                return func(*args, **kwargs)
+        trace = self.start(name)
+        error = None
+        try:
+            return func(*args, **kwargs)
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            self.finish(trace, **({'error': error} if error else {}))
+
+    def span(self, name: str, **attrs):
+        """
+        context manager timing a stage of the current trace, free when nothing is recorded
+        """
+        if (trace := self._local.trace) is None or trace.spans is None:
+            return _NO_SPAN
+        return _Span(trace, name, attrs)
+
+    def on_statement(self, sql, params, elapsed):
+        if (trace := self._local.trace) is None or trace.spans is None:
+            return
+        now = time.perf_counter()
+        trace.add('db', now - elapsed, elapsed, {'sql': fingerprint(sql)[:200]})
+
+    def _write_loop(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+            if self.path is None:
+                return
+
+    def flush(self):
+        with self._lock:
+            lines, self._buffer = self._buffer, []
+        if not lines or (path := self.path) is None:
+            return
+        try:
+            if self.max_bytes and os.path.exists(path) and os.path.getsize(path) > self.max_bytes:
+                os.replace(path, path + '.1')
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write('\n'.join(lines) + '\n')
+            self.written += len(lines)
+        except OSError as e:
+            self.dropped += len(lines)
+            logger.warning(f'Failed to write {len(lines)} traces to {path}: {e}')
+
+    def stats(self) -> dict:
+        return {'enabled': self.enabled, 'sample_rate': self.sample_rate, 'slow_threshold': self.slow_threshold,
+                'buffered': len(self._buffer), 'written': self.written, 'dropped': self.dropped}
+
+
+tracer = Tracer()
+
+
+def traced(name: str):
+    """
+    decorator running the function in a span of the current trace
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with tracer.span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def install_record_factory():
+    """
+    log records get trace_id and trace ('[<id>]\\t' or ''), of the trace running in the emitting thread
+    """
+    factory = logging.getLogRecordFactory()
+    if getattr(factory, 'traced_', False):
+        return
+
+    def record_factory(*args, **kwargs):
+        record = factory(*args, **kwargs)
+        record.trace_id = tracer.current_id()
+        record.trace = f'[{record.trace_id}]\t' if record.trace_id else ''
+        return record
+
+    record_factory.traced_ = True
+    logging.setLogRecordFactory(record_factory)
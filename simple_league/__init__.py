@@ -1,3 +1,4 @@
 class App:
-    def serve(self):
-        pass
\ No newline at end of file
+    def serve(self, **kwargs):
+        from .m_server import Server
+        Server().serve(**kwargs)
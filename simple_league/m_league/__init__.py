@@ -0,0 +1,5 @@
+from .models import League, Team, Match, Standing, Fixture, FixtureStatus
+from .standings import record_result, delete_result, recompute
+from .leaderboard import Leaderboard, leaderboards
+from .fixtures import round_robin, swiss_pairings, create_round_robin, create_swiss_round, record_fixture_result, fixture_scheduler
+from . import api, migrations  # registers the league routes on the server api and the league schema steps
@@ -0,0 +1,45 @@
+import logging
+
+from bottle import request
+
+from ..m_server.api import api
+from ..m_server.middleware import load_user
+from ..m_server.utils import UserError
+from .leaderboard import leaderboards, ORDERS
+
+logger = logging.getLogger(__name__)
+MAX_PAGE = 500
+
+
+def _int_query(name, default):
+    try:
+        return int(value) if (value := request.query.get(name)) else default
+    except ValueError:
+        raise UserError(f"{name} must be an integer", name)
+
+
+def _leaderboard(league_id):
+    if (order := request.query.get('order') or 'rating') not in ORDERS:
+        raise UserError(f"Unknown leaderboard order '{order}'", 'order')
+    try:
+        return leaderboards.get(league_id, order)
+    except KeyError:
+        raise UserError("League not found")
+
+
+@api.get('/league/<league_id:int>/leaderboard')
+@load_user()
+def get_leaderboard(league_id):
+    board = _leaderboard(league_id)
+    limit = min(max(_int_query('limit', 50), 0), MAX_PAGE)
+    return {'total': len(board), 'data': board.page(_int_query('offset', 0), limit)}
+
+
+@api.get('/league/<league_id:int>/rank')
+@load_user()
+def get_rank(league_id):
+    board = _leaderboard(league_id)
+    if (team_id := _int_query('team', None)) is None:
+        raise UserError("team is required", 'team')
+    radius = min(max(_int_query('radius', 5), 0), MAX_PAGE // 2)
+    return {'total': len(board), 'rank': board.rank(team_id), 'around': board.around(team_id, radius)}
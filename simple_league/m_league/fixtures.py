@@ -0,0 +1,240 @@
+# fixture generation (round robin, swiss) and the start/close timers of scheduled fixtures
+import collections
+import datetime
+import itertools
+import logging
+import time
+
+import peewee
+from nyutils.database import use_database
+from nyutils.matching import max_weight_matching
+
+from ..m_server.utils import g_events, g_loop
+from .models import League, Match, Standing, Fixture, FixtureStatus
+from .standings import record_result
+
+logger = logging.getLogger(__name__)
+INSERT_CHUNK = 100
+DENSE_LIMIT = 128  # teams a swiss round is paired over all its unplayed pairs for
+SWISS_WINDOW = 4
+
+
+def round_robin(team_ids: list[int], double=False) -> list[list[tuple[int, int | None]]]:
+    """
+    circle method, n - 1 rounds (n rounded up to even), a None opponent is a bye.
+    home and away alternate between rounds, double appends the return legs
+    """
+    teams = list(team_ids)
+    if len(teams) % 2:
+        teams.append(None)
+    n = len(teams)
+    half = n // 2
+    rounds = []
+    for r in range(n - 1):
+        # teams[i] meets teams[n - 1 - i], the odd pairs swap sides
+        top, bottom = teams[:half], teams[:half - 1:-1]
+        pairs = list(zip(top[::2], bottom[::2]))
+        pairs += zip(bottom[1::2], top[1::2])
+        if r % 2:
+            pairs[0] = pairs[0][::-1]
+        if None in teams:
+            i = min(pos := teams.index(None), n - 1 - pos)
+            j = i // 2 if i % 2 == 0 else (half + 1) // 2 + i // 2
+            if pairs[j][0] is None:
+                pairs[j] = (pairs[j][1], None)
+        rounds.append(pairs)
+        teams = [teams[0], teams[-1]] + teams[1:-1]
+    if double:
+        rounds += [[(a, h) if a is not None else (h, a) for h, a in pairs] for pairs in rounds]
+    return rounds
+
+
+def _pair_key(a, b):
+    return (a, b) if a < b else (b, a)
+
+
+def _swiss_edges(ranked: list[tuple[int, int, int]], played: set, window: int | None) -> list[tuple[int, int, int]]:
+    """
+    (i, j, weight) over the unplayed pairs of ranked, (team, score group, position in it) in rank order, weighted by
+    minus the squared score group distance. the opponents of each team come in the order max_weight_matching pairs
+    them greedily: within a group the top half against the bottom half in order (first against first), then who
+    floats from the bottom of a group against the top of the next.
+    window limits them to the window teams around that ideal opponent and the window teams next in rank, None for all
+    """
+    n = len(ranked)
+    sizes = collections.Counter(g for _, g, _ in ranked)
+    edges = []
+    for i, (a, ga, pa) in enumerate(ranked):
+        half = sizes[ga] // 2
+        ideal = i + half
+        if window is None:
+            candidates = range(i + 1, n)
+        else:
+            candidates = set(range(i + 1, min(i + 1 + window, n))) | set(range(max(i + 1, ideal - window), min(ideal + window + 1, n)))
+        row = []
+        for j in candidates:
+            b, gb, _ = ranked[j]
+            if _pair_key(a, b) not in played:
+                row.append((gb - ga, abs(j - ideal), j))
+        row.sort()
+        edges += ((i, j, -d * d) for d, _, j in row)
+    return edges
+
+
+def swiss_pairings(groups: list[list[int]], played: set[tuple[int, int]], had_bye=()) -> tuple[list[tuple[int, int]], int | None]:
+    """
+    groups are the teams by score group, best first, each in rank order.
+    the pairs are a maximum weight matching (nyutils.matching) among the matchings with the most unplayed pairs,
+    so a rematch is only scheduled when no pairing of the round avoids it. weights favour the nearest score
+    groups, among equal ones the warm start keeps the usual split of a group: top of the upper half against top of the lower half, whoever floats
+    comes from the bottom of its group. rounds of more than DENSE_LIMIT teams start from the pairs around those
+    ideal opponents, and widen them only if that leaves a team unpaired.
+    the bye goes to the lowest ranked team without one; returns (pairs, bye)
+    """
+    groups = [list(g) for g in groups if g]
+    bye = None
+    if sum(len(g) for g in groups) % 2:
+        candidates = [t for g in reversed(groups) for t in reversed(g)]
+        bye = next((t for t in candidates if t not in had_bye), candidates[0])
+        for g in groups:
+            if bye in g:
+                g.remove(bye)
+    ranked = [(t, gi, pos) for gi, g in enumerate(groups) for pos, t in enumerate(g)]
+    n = len(ranked)
+    window = SWISS_WINDOW if n > DENSE_LIMIT else None
+    while True:
+        mate = max_weight_matching(_swiss_edges(ranked, played, window), max_cardinality=True)
+        mate += [-1] * (n - len(mate))
+        if window is None or -1 not in mate:
+            break
+        window = window * 4 if window * 4 < n else None
+    pairs = [(ranked[i][0], ranked[j][0]) for i, j in enumerate(mate) if i < j]
+    # unpaired teams have played all the others unpaired, the matching has the most pairs
+    rest = [ranked[i][0] for i, j in enumerate(mate) if j < 0]
+    if rest:
+        logger.warning(f'Swiss pairing could not avoid {len(rest) // 2} rematches')
+        rank = {t: i for i, (t, _, _) in enumerate(ranked)}
+        pairs += zip(rest[::2], rest[1::2])
+        pairs.sort(key=lambda pair: rank[pair[0]])
+    # alternate sides
+    return [(a, b) if i % 2 == 0 else (b, a) for i, (a, b) in enumerate(pairs)], bye
+
+
+def played_pairs(league: League | int) -> set[tuple[int, int]]:
+    played = set()
+    for home, away in itertools.chain(
+            Match.select(Match.home, Match.away).where(Match.league == league).tuples(),
+            Fixture.select(Fixture.home, Fixture.away).where(Fixture.league == league, Fixture.away.is_null(False)).tuples()):
+        played.add(_pair_key(home, away))
+    return played
+
+
+def score_groups(league: League | int) -> list[list[int]]:
+    return [[team_id for _, team_id in group] for _, group in itertools.groupby(
+        Standing.table(league).select(Standing.points, Standing.team).tuples(), key=lambda row: row[0])]
+
+
+def create_fixtures(league: League | int, rounds: list[list[tuple[int, int | None]]], first_round=1,
+                    starts_at: datetime.datetime | None = None, round_interval: datetime.timedelta | None = None,
+                    duration: datetime.timedelta | None = None) -> int:
+    """
+    bulk insert the rounds in one transaction and register their timers, returns the number of fixtures
+    """
+    rows = []
+    for r, pairs in enumerate(rounds):
+        start = None if starts_at is None else starts_at + (round_interval or datetime.timedelta()) * r
+        close = None if start is None or duration is None else start + duration
+        for home, away in pairs:
+            rows.append({'league': league, 'round': first_round + r, 'home': home, 'away': away, 'starts_at': start, 'closes_at': close})
+    with use_database.atomic():
+        for i in range(0, len(rows), INSERT_CHUNK):
+            Fixture.insert_many(rows[i:i + INSERT_CHUNK]).execute()
+    league_id = league if isinstance(league, int) else league.id
+    fixture_scheduler.schedule(league_id, {r['starts_at'] for r in rows} - {None}, {r['closes_at'] for r in rows} - {None})
+    logger.info(f'Created {len(rows)} fixtures in {len(rounds)} rounds for league {league_id}')
+    return len(rows)
+
+
+def create_round_robin(league: League | int, double=False, **kwargs) -> int:
+    team_ids = [team_id for team_id, in Standing.select(Standing.team).where(Standing.league == league).order_by(Standing.team).tuples()]
+    return create_fixtures(league, round_robin(team_ids, double), **kwargs)
+
+
+def create_swiss_round(league: League | int, **kwargs) -> int:
+    """
+    pair the next round from the current standings
+    """
+    last_round = Fixture.select(peewee.fn.MAX(Fixture.round)).where(Fixture.league == league).scalar() or 0
+    had_bye = {team_id for team_id, in Fixture.select(Fixture.home).where(Fixture.league == league, Fixture.away.is_null()).tuples()}
+    start = time.perf_counter()
+    pairs, bye = swiss_pairings(score_groups(league), played_pairs(league), had_bye)
+    logger.debug(f'Swiss round {last_round + 1}: paired {len(pairs) * 2} teams in {time.perf_counter() - start:.3f}s')
+    return create_fixtures(league, [pairs + ([(bye, None)] if bye is not None else [])], first_round=last_round + 1, **kwargs)
+
+
+def record_fixture_result(fixture: Fixture | int, home_score: int, away_score: int) -> Match:
+    fixture = fixture if isinstance(fixture, Fixture) else Fixture.get_by_id(fixture)
+    if fixture.away_id is None:
+        raise ValueError("A bye has no result")
+    if fixture.status == FixtureStatus.PLAYED:
+        raise ValueError("The fixture already has a result")
+    with use_database.atomic():
+        match = record_result(fixture.league_id, fixture.home_id, fixture.away_id, home_score, away_score, round=fixture.round)
+        Fixture.update(status=FixtureStatus.PLAYED, match=match).where(Fixture.id == fixture.id).execute()
+    return match
+
+
+class FixtureScheduler:
+    """
+    one g_loop event per distinct start or close time of a league (a whole round usually shares both),
+    registered in bulk; load() puts back the timers of pending fixtures after a restart
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.handles = {}  # (kind, league_id, timestamp) -> event handle
+
+    def schedule(self, league_id: int, starts: set[datetime.datetime], closes: set[datetime.datetime]):
+        items = []
+        for kind, times, func in (('start', starts, self._start), ('close', closes, self._close)):
+            for at in times:
+                if (kind, league_id, at) not in self.handles:
+                    items.append(((kind, league_id, at), at.timestamp(), func, (league_id, at)))
+        handles = self.loop.create_events([(ts, func, args) for _, ts, func, args in items])
+        for (key, *_), handle in zip(items, handles):
+            self.handles[key] = handle
+
+    def load(self):
+        pending = {}
+        for league_id, at in Fixture.select(Fixture.league, Fixture.starts_at).where(
+                Fixture.status == FixtureStatus.SCHEDULED, Fixture.starts_at.is_null(False)).distinct().tuples():
+            pending.setdefault(league_id, (set(), set()))[0].add(at)
+        for league_id, at in Fixture.select(Fixture.league, Fixture.closes_at).where(
+                Fixture.status.in_([FixtureStatus.SCHEDULED, FixtureStatus.OPEN]), Fixture.closes_at.is_null(False)).distinct().tuples():
+            pending.setdefault(league_id, (set(), set()))[1].add(at)
+        for league_id, (starts, closes) in pending.items():
+            self.schedule(league_id, starts, closes)
+
+    def _transition(self, kind, league_id, at, field, from_status, to_status):
+        self.handles.pop((kind, league_id, at), None)
+        with use_database.atomic():
+            query = Fixture.select(Fixture.id).where(Fixture.league == league_id, field == at, Fixture.status.in_(from_status))
+            fixture_ids = [fixture_id for fixture_id, in query.tuples()]
+            if fixture_ids:
+                Fixture.update(status=to_status).where(Fixture.id.in_(query)).execute()
+        if fixture_ids:
+            logger.debug(f'League {league_id}: {len(fixture_ids)} fixtures {kind}')
+            g_events.invoke(f'league/fixture_{kind}', league_id, fixture_ids)
+
+    def _start(self, league_id, at):
+        self._transition('start', league_id, at, Fixture.starts_at, [FixtureStatus.SCHEDULED], FixtureStatus.OPEN)
+
+    def _close(self, league_id, at):
+        self._transition('close', league_id, at, Fixture.closes_at, [FixtureStatus.SCHEDULED, FixtureStatus.OPEN], FixtureStatus.CLOSED)
+
+    def cancel(self, league_id: int):
+        for key in [k for k in self.handles if k[1] == league_id]:
+            self.loop.cancel_event(self.handles.pop(key))
+
+
+fixture_scheduler = FixtureScheduler(g_loop)
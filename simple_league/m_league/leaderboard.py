@@ -0,0 +1,277 @@
+# in-memory rank index over the standings table, kept in sync through g_events
+import logging
+import random
+import threading
+import time
+
+from ..m_server.utils import g_events
+from .models import League, Standing
+
+logger = logging.getLogger(__name__)
+
+
+class _Top:
+    """
+    key of the tail sentinel, greater than every key
+    """
+
+    def __lt__(self, other):
+        return False
+
+    def __repr__(self):
+        return 'TOP'
+
+
+_TOP = _Top()
+
+
+class _Node:
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key, levels):
+        self.key = key
+        self.next = [None] * levels
+        self.width = [1] * levels
+
+
+class IndexableSkipList:
+    """
+    sorted set of unique, comparable keys; every link stores how many bottom level nodes it skips,
+    so insert, remove, rank and index lookups are all O(log n) expected
+    """
+
+    def __init__(self, max_levels=24):
+        self.max_levels = max_levels
+        self.size = 0
+        self.tail = _Node(_TOP, 0)
+        self.head = _Node(None, max_levels)
+        self.head.next = [self.tail] * max_levels
+
+    def __len__(self):
+        return self.size
+
+    def _find(self, key):
+        """
+        last node before key on every level, and its position (head is 0)
+        """
+        chain = [None] * self.max_levels
+        positions = [0] * self.max_levels
+        node, pos = self.head, 0
+        for level in reversed(range(self.max_levels)):
+            while node.next[level].key < key:
+                pos += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+            positions[level] = pos
+        return chain, positions
+
+    def insert(self, key):
+        chain, positions = self._find(key)
+        if chain[0].next[0].key == key:
+            raise KeyError(f'duplicate key {key!r}')
+        levels = 1
+        while levels < self.max_levels and random.random() < .5:
+            levels += 1
+        node = _Node(key, levels)
+        pos = positions[0] + 1  # position of the new node
+        for level in range(levels):
+            prev = chain[level]
+            node.next[level] = prev.next[level]
+            prev.next[level] = node
+            node.width[level] = prev.width[level] - (pos - positions[level]) + 1
+            prev.width[level] = pos - positions[level]
+        for level in range(levels, self.max_levels):
+            chain[level].width[level] += 1
+        self.size += 1
+
+    def remove(self, key):
+        chain, _ = self._find(key)
+        node = chain[0].next[0]
+        if node.key != key:
+            raise KeyError(key)
+        for level in range(len(node.next)):
+            prev = chain[level]
+            prev.width[level] += node.width[level] - 1
+            prev.next[level] = node.next[level]
+        for level in range(len(node.next), self.max_levels):
+            chain[level].width[level] -= 1
+        self.size -= 1
+
+    def index(self, key) -> int:
+        """
+        0-based position of key
+        """
+        chain, positions = self._find(key)
+        if chain[0].next[0].key != key:
+            raise KeyError(key)
+        return positions[0]
+
+    def _node_at(self, i):
+        node, remaining = self.head, i + 1
+        for level in reversed(range(self.max_levels)):
+            while node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        return node
+
+    def __getitem__(self, i):
+        if not 0 <= i < self.size:
+            raise IndexError(i)
+        return self._node_at(i).key
+
+    def slice(self, start, stop):
+        start, stop = max(start, 0), min(stop, self.size)
+        if start >= stop:
+            return []
+        node = self._node_at(start)
+        res = []
+        for _ in range(stop - start):
+            res.append(node.key)
+            node = node.next[0]
+        return res
+
+    def __iter__(self):
+        node = self.head.next[0]
+        while node is not self.tail:
+            yield node.key
+            node = node.next[0]
+
+
+# order name -> (standing fields read, sort key of a row, client values of a key)
+ORDERS = {
+    'rating': (
+        (Standing.team, Standing.rating),
+        lambda team_id, rating: (-rating, team_id),
+        lambda key: {'rating': -key[0]},
+    ),
+    'table': (
+        (Standing.team, Standing.points, Standing.goals_for, Standing.goals_against),
+        lambda team_id, points, gf, ga: (-points, ga - gf, -gf, team_id),
+        lambda key: {'points': -key[0], 'goal_difference': -key[1], 'goals_for': -key[2]},
+    ),
+}
+
+
+class Leaderboard:
+    """
+    rank index of one league in one order, ranks are 1-based and ties are broken by team id
+    """
+
+    def __init__(self, league_id: int, order: str = 'rating'):
+        if order not in ORDERS:
+            raise ValueError(f"Unknown leaderboard order '{order}'")
+        self.league_id = league_id
+        self.order = order
+        self.fields, self.key, self.values = ORDERS[order]
+        self.lock = threading.Lock()
+        self.index = IndexableSkipList()
+        self.keys = {}  # team_id -> key in index
+
+    def _rows(self, team_ids=None):
+        query = Standing.select(*self.fields).where(Standing.league == self.league_id)
+        if team_ids is not None:
+            query = query.where(Standing.team.in_(team_ids))
+        return query.tuples()
+
+    def rebuild(self):
+        start = time.perf_counter()
+        index = IndexableSkipList()
+        keys = {}
+        with self.lock:  # held while reading, an update in between would be lost
+            for row in self._rows():
+                keys[row[0]] = key = self.key(*row)
+                index.insert(key)
+            self.index, self.keys = index, keys
+        logger.debug(f'Built {self.order} leaderboard of league {self.league_id}: {len(keys)} teams in {time.perf_counter() - start:.3f}s')
+        return self
+
+    def update(self, team_ids):
+        rows = list(self._rows(team_ids))
+        with self.lock:
+            for team_id in set(team_ids) - {row[0] for row in rows}:
+                # team removed
+                if (old := self.keys.pop(team_id, None)) is not None:
+                    self.index.remove(old)
+            for row in rows:
+                if (old := self.keys.get(row[0])) is not None:
+                    self.index.remove(old)
+                self.keys[row[0]] = key = self.key(*row)
+                self.index.insert(key)
+
+    def _entry(self, rank, key):
+        return {'rank': rank, 'team': key[-1], **self.values(key)}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def rank(self, team_id) -> int | None:
+        with self.lock:
+            if (key := self.keys.get(team_id)) is None:
+                return None
+            return self.index.index(key) + 1
+
+    def page(self, offset=0, limit=50) -> list[dict]:
+        """
+        entries ranked offset + 1 to offset + limit
+        """
+        offset = max(offset, 0)
+        with self.lock:
+            keys = self.index.slice(offset, offset + limit)
+        return [self._entry(offset + i + 1, key) for i, key in enumerate(keys)]
+
+    def top(self, k=10):
+        return self.page(0, k)
+
+    def around(self, team_id, radius=5) -> list[dict]:
+        """
+        the team and up to radius entries on either side of it
+        """
+        with self.lock:
+            if (key := self.keys.get(team_id)) is None:
+                return []
+            i = self.index.index(key)
+            start = max(i - radius, 0)
+            keys = self.index.slice(start, i + radius + 1)
+        return [self._entry(start + i + 1, key) for i, key in enumerate(keys)]
+
+
+class Leaderboards:
+    """
+    leaderboards built on first use, or for every league by load()
+    """
+
+    def __init__(self):
+        self.boards: dict[tuple[int, str], Leaderboard] = {}
+        self.lock = threading.Lock()
+
+    def get(self, league_id: int, order: str = 'rating') -> Leaderboard:
+        if (board := self.boards.get((league_id, order))) is not None:
+            return board
+        with self.lock:
+            if (board := self.boards.get((league_id, order))) is None:
+                if not League.select().where(League.id == league_id).exists():
+                    raise KeyError(league_id)
+                self.boards[league_id, order] = board = Leaderboard(league_id, order).rebuild()
+        return board
+
+    def load(self):
+        for league_id, in League.select(League.id).tuples():
+            for order in ORDERS:
+                self.get(league_id, order)
+
+    def on_standings_change(self, league_id, team_ids):
+        for (board_league, _), board in list(self.boards.items()):
+            if board_league != league_id:
+                continue
+            if team_ids is None:
+                board.rebuild()
+            else:
+                board.update(team_ids)
+
+
+leaderboards = Leaderboards()
+
+
+@g_events.set('league/standings_change')
+def on_standings_change(league_id, team_ids):
+    leaderboards.on_standings_change(league_id, team_ids)
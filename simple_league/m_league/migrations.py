@@ -0,0 +1,54 @@
+# schema steps of the league tables, run by nyutils.migrate.migrate() at startup
+from nyutils.migrate import Migrations, execute
+
+migrations = Migrations('league')
+
+# the tables as of version 1
+SCHEMA_V1 = (
+    'CREATE TABLE IF NOT EXISTS "league_league" ("id" INTEGER NOT NULL PRIMARY KEY, "name" VARCHAR(255) NOT NULL, '
+    '"win_points" INTEGER NOT NULL, "draw_points" INTEGER NOT NULL, "loss_points" INTEGER NOT NULL, '
+    '"rating_init" REAL NOT NULL, "rating_k" REAL NOT NULL, "home_advantage" REAL NOT NULL, '
+    '"created_at" DATETIME NOT NULL, "data" TEXT NOT NULL)',
+    'CREATE UNIQUE INDEX IF NOT EXISTS "league_name" ON "league_league" ("name")',
+    'CREATE TABLE IF NOT EXISTS "league_team" ("id" INTEGER NOT NULL PRIMARY KEY, "league_id" INTEGER NOT NULL, '
+    '"name" VARCHAR(255) NOT NULL, "data" TEXT NOT NULL, '
+    'FOREIGN KEY ("league_id") REFERENCES "league_league" ("id") ON DELETE CASCADE)',
+    'CREATE INDEX IF NOT EXISTS "team_league_id" ON "league_team" ("league_id")',
+    'CREATE UNIQUE INDEX IF NOT EXISTS "team_league_id_name" ON "league_team" ("league_id", "name")',
+    'CREATE TABLE IF NOT EXISTS "league_match" ("id" INTEGER NOT NULL PRIMARY KEY, "league_id" INTEGER NOT NULL, '
+    '"home_id" INTEGER NOT NULL, "away_id" INTEGER NOT NULL, "home_score" INTEGER NOT NULL, '
+    '"away_score" INTEGER NOT NULL, "played_at" DATETIME NOT NULL, "round" INTEGER, "rating_delta" REAL NOT NULL, '
+    'FOREIGN KEY ("league_id") REFERENCES "league_league" ("id") ON DELETE CASCADE, '
+    'FOREIGN KEY ("home_id") REFERENCES "league_team" ("id") ON DELETE CASCADE, '
+    'FOREIGN KEY ("away_id") REFERENCES "league_team" ("id") ON DELETE CASCADE)',
+    'CREATE INDEX IF NOT EXISTS "match_league_id" ON "league_match" ("league_id")',
+    'CREATE INDEX IF NOT EXISTS "match_home_id" ON "league_match" ("home_id")',
+    'CREATE INDEX IF NOT EXISTS "match_away_id" ON "league_match" ("away_id")',
+    'CREATE INDEX IF NOT EXISTS "match_league_id_played_at_id" ON "league_match" ("league_id", "played_at", "id")',
+    'CREATE TABLE IF NOT EXISTS "league_fixture" ("id" INTEGER NOT NULL PRIMARY KEY, "league_id" INTEGER NOT NULL, '
+    '"round" INTEGER NOT NULL, "home_id" INTEGER NOT NULL, "away_id" INTEGER, "starts_at" DATETIME, '
+    '"closes_at" DATETIME, "status" INTEGER NOT NULL, "match_id" INTEGER, '
+    'FOREIGN KEY ("league_id") REFERENCES "league_league" ("id") ON DELETE CASCADE, '
+    'FOREIGN KEY ("home_id") REFERENCES "league_team" ("id") ON DELETE CASCADE, '
+    'FOREIGN KEY ("away_id") REFERENCES "league_team" ("id") ON DELETE CASCADE, '
+    'FOREIGN KEY ("match_id") REFERENCES "league_match" ("id") ON DELETE SET NULL)',
+    'CREATE INDEX IF NOT EXISTS "fixture_league_id" ON "league_fixture" ("league_id")',
+    'CREATE INDEX IF NOT EXISTS "fixture_home_id" ON "league_fixture" ("home_id")',
+    'CREATE INDEX IF NOT EXISTS "fixture_away_id" ON "league_fixture" ("away_id")',
+    'CREATE INDEX IF NOT EXISTS "fixture_match_id" ON "league_fixture" ("match_id")',
+    'CREATE INDEX IF NOT EXISTS "fixture_league_id_round" ON "league_fixture" ("league_id", "round")',
+    'CREATE INDEX IF NOT EXISTS "fixture_status_starts_at" ON "league_fixture" ("status", "starts_at")',
+    'CREATE TABLE IF NOT EXISTS "league_standing" ("id" INTEGER NOT NULL PRIMARY KEY, "league_id" INTEGER NOT NULL, '
+    '"team_id" INTEGER NOT NULL, "played" INTEGER NOT NULL, "won" INTEGER NOT NULL, "drawn" INTEGER NOT NULL, '
+    '"lost" INTEGER NOT NULL, "goals_for" INTEGER NOT NULL, "goals_against" INTEGER NOT NULL, '
+    '"points" INTEGER NOT NULL, "rating" REAL NOT NULL, '
+    'FOREIGN KEY ("league_id") REFERENCES "league_league" ("id") ON DELETE CASCADE, '
+    'FOREIGN KEY ("team_id") REFERENCES "league_team" ("id") ON DELETE CASCADE)',
+    'CREATE INDEX IF NOT EXISTS "standing_league_id" ON "league_standing" ("league_id")',
+    'CREATE UNIQUE INDEX IF NOT EXISTS "standing_team_id" ON "league_standing" ("team_id")',
+)
+
+
+@migrations.step(1)
+def create_tables():
+    execute(SCHEMA_V1)
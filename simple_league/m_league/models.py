@@ -0,0 +1,187 @@
+import datetime
+import enum
+
+from nyutils.database import *
+
+from ..m_server.utils import g_events
+
+tbl_prefix = 'league_'
+
+
+class League(BaseModel):
+    class Meta:
+        table_name = tbl_prefix + 'league'
+
+    name = peewee.CharField(unique=True)
+    win_points = peewee.IntegerField(default=3)
+    draw_points = peewee.IntegerField(default=1)
+    loss_points = peewee.IntegerField(default=0)
+    # elo parameters
+    rating_init = peewee.FloatField(default=1500.)
+    rating_k = peewee.FloatField(default=20.)
+    home_advantage = peewee.FloatField(default=0.)
+    created_at = peewee.DateTimeField(default=datetime.datetime.now)
+    data = DataField(default={}, lazy=True)
+
+    client_fields = ('name', 'win_points', 'draw_points', 'loss_points', 'rating_init', 'rating_k', 'home_advantage')
+
+    def add_team(self, name: str, data=None) -> 'Team':
+        with use_database.atomic():
+            team = Team.create(league=self, name=name, data=data or {})
+            Standing.create(league=self, team=team, rating=self.rating_init)
+            use_database.on_commit(lambda: g_events.invoke('league/standings_change', self.id, [team.id]))
+        return team
+
+    def to_client(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'win_points': self.win_points,
+            'draw_points': self.draw_points,
+            'loss_points': self.loss_points,
+            'rating_init': self.rating_init,
+            'rating_k': self.rating_k,
+            'home_advantage': self.home_advantage,
+        }
+
+
+class Team(BaseModel):
+    """
+    a participant of a league, a single player is a team of one
+    """
+
+    class Meta:
+        table_name = tbl_prefix + 'team'
+        indexes = ((('league', 'name'), True),)
+
+    league = peewee.ForeignKeyField(League, backref='teams', on_delete='CASCADE')
+    name = peewee.CharField()
+    data = DataField(default={}, lazy=True)
+
+    client_fields = ('league', 'name')
+
+    def to_client(self):
+        return {'id': self.id, 'league': self.league_id, 'name': self.name}
+
+
+class Match(BaseModel):
+    class Meta:
+        table_name = tbl_prefix + 'match'
+        indexes = ((('league', 'played_at', 'id'), False),)
+
+    league = peewee.ForeignKeyField(League, backref='matches', on_delete='CASCADE')
+    home = peewee.ForeignKeyField(Team, backref='home_matches', on_delete='CASCADE')
+    away = peewee.ForeignKeyField(Team, backref='away_matches', on_delete='CASCADE')
+    home_score = peewee.IntegerField()
+    away_score = peewee.IntegerField()
+    played_at = peewee.DateTimeField(default=datetime.datetime.now)
+    round = peewee.IntegerField(null=True)
+    # rating change of the home team, the away team changed by the negation
+    rating_delta = peewee.FloatField(default=0.)
+
+    client_fields = ('league', 'home', 'away', 'home_score', 'away_score', 'played_at', 'round', 'rating_delta')
+
+    def to_client(self):
+        return {
+            'id': self.id,
+            'league': self.league_id,
+            'home': self.home_id,
+            'away': self.away_id,
+            'home_score': self.home_score,
+            'away_score': self.away_score,
+            'played_at': self.played_at.timestamp(),
+            'round': self.round,
+            'rating_delta': self.rating_delta,
+        }
+
+
+class Standing(BaseModel):
+    """
+    materialized standings, one row per team, kept up to date by m_league.standings
+    """
+
+    class Meta:
+        table_name = tbl_prefix + 'standing'
+
+    league = peewee.ForeignKeyField(League, backref='standings', on_delete='CASCADE')
+    team = peewee.ForeignKeyField(Team, unique=True, backref='standing', on_delete='CASCADE')
+    played = peewee.IntegerField(default=0)
+    won = peewee.IntegerField(default=0)
+    drawn = peewee.IntegerField(default=0)
+    lost = peewee.IntegerField(default=0)
+    goals_for = peewee.IntegerField(default=0)
+    goals_against = peewee.IntegerField(default=0)
+    points = peewee.IntegerField(default=0)
+    rating = peewee.FloatField(default=1500.)
+
+    client_fields = ('team', 'played', 'won', 'drawn', 'lost', 'goals_for', 'goals_against', 'points', 'rating')
+
+    @property
+    def goal_difference(self):
+        return self.goals_for - self.goals_against
+
+    @classmethod
+    def table(cls, league: League | int) -> peewee.ModelSelect:
+        """
+        standings of a league in table order: points, goal difference, goals scored
+        """
+        return cls.select().where(cls.league == league).order_by(
+            cls.points.desc(), (cls.goals_for - cls.goals_against).desc(), cls.goals_for.desc(), cls.team)
+
+    def to_client(self):
+        return {
+            'team': self.team_id,
+            'played': self.played,
+            'won': self.won,
+            'drawn': self.drawn,
+            'lost': self.lost,
+            'goals_for': self.goals_for,
+            'goals_against': self.goals_against,
+            'goal_difference': self.goal_difference,
+            'points': self.points,
+            'rating': self.rating,
+        }
+
+
+class FixtureStatus(enum.IntEnum):
+    SCHEDULED = 0
+    OPEN = 1  # started, waiting for the result
+    CLOSED = 2  # closed without a result
+    PLAYED = 3
+
+
+class Fixture(BaseModel):
+    """
+    a scheduled pairing, away is null for a bye
+    """
+
+    class Meta:
+        table_name = tbl_prefix + 'fixture'
+        indexes = (
+            (('league', 'round'), False),
+            (('status', 'starts_at'), False),
+        )
+
+    league = peewee.ForeignKeyField(League, backref='fixtures', on_delete='CASCADE')
+    round = peewee.IntegerField()
+    home = peewee.ForeignKeyField(Team, backref='home_fixtures', on_delete='CASCADE')
+    away = peewee.ForeignKeyField(Team, backref='away_fixtures', null=True, on_delete='CASCADE')
+    starts_at = peewee.DateTimeField(null=True)
+    closes_at = peewee.DateTimeField(null=True)
+    status = peewee.IntegerField(default=FixtureStatus.SCHEDULED)
+    match = peewee.ForeignKeyField(Match, null=True, backref='fixture', on_delete='SET NULL')
+
+    client_fields = ('league', 'round', 'home', 'away', 'starts_at', 'closes_at', 'status', 'match')
+
+    def to_client(self):
+        return {
+            'id': self.id,
+            'league': self.league_id,
+            'round': self.round,
+            'home': self.home_id,
+            'away': self.away_id,
+            'starts_at': self.starts_at.timestamp() if self.starts_at else 0,
+            'closes_at': self.closes_at.timestamp() if self.closes_at else 0,
+            'status': self.status,
+            'match': self.match_id,
+        }
@@ -0,0 +1,184 @@
+# standings and elo ratings: incremental per result, vectorized for a full recompute
+import datetime
+import importlib.util
+import logging
+import time
+
+from nyutils.database import use_database, write_lock
+
+from ..m_server.utils import g_events
+from .models import League, Team, Match, Standing
+
+# numpy costs ~100ms of startup, it is imported by the first full recompute
+HAS_NUMPY = importlib.util.find_spec('numpy') is not None
+
+logger = logging.getLogger(__name__)
+STANDING_COLUMNS = ('played', 'won', 'drawn', 'lost', 'goals_for', 'goals_against', 'points', 'rating')
+_STANDING_SET = ', '.join(f'"{c}" = ?' for c in STANDING_COLUMNS)
+
+
+def _id(obj):
+    return obj if isinstance(obj, int) else obj.id
+
+
+def _league(league) -> League:
+    return league if isinstance(league, League) else League.get_by_id(league)
+
+
+def expected_score(rating, opponent, home_advantage=0.):
+    return 1 / (1 + 10 ** ((opponent - rating - home_advantage) / 400))
+
+
+def elo_delta(league: League, home_rating, away_rating, home_score, away_score):
+    """
+    rating change of the home team, the away team changes by the negation
+    """
+    score = 1. if home_score > away_score else .5 if home_score == away_score else 0.
+    return league.rating_k * (score - expected_score(home_rating, away_rating, league.home_advantage))
+
+
+def record_result(league: League | int, home: Team | int, away: Team | int, home_score: int, away_score: int,
+                  played_at: datetime.datetime | None = None, round: int | None = None) -> Match:
+    """
+    store a result and update the two standings rows it affects, the events follow once it commits.
+    a result dated before the latest one of the league changes the rating history, the league is recomputed
+    """
+    league = _league(league)
+    home_id, away_id = _id(home), _id(away)
+    if home_id == away_id:
+        raise ValueError("A team cannot play against itself")
+    played_at = played_at or datetime.datetime.now()
+    with write_lock, use_database.atomic():
+        ratings = dict(Standing.select(Standing.team, Standing.rating).where(
+            Standing.league == league, Standing.team.in_([home_id, away_id])).tuples())
+        if len(ratings) != 2:
+            raise ValueError(f"Both teams must belong to league {league.name}")
+        out_of_order = Match.select().where(Match.league == league, Match.played_at > played_at).exists()
+        delta = elo_delta(league, ratings[home_id], ratings[away_id], home_score, away_score)
+        match = Match.create(league=league, home=home_id, away=away_id, home_score=home_score, away_score=away_score,
+                             played_at=played_at, round=round, rating_delta=delta)
+        if out_of_order:
+            _recompute(league)
+        else:
+            _apply(league, home_id, home_score, away_score, delta)
+            _apply(league, away_id, away_score, home_score, -delta)
+        use_database.on_commit(lambda: _publish_result(league.id, match.id, None if out_of_order else [home_id, away_id]))
+    return match
+
+
+def _publish_result(league_id, match_id, team_ids):
+    g_events.invoke('league/result', league_id, match_id)
+    g_events.invoke('league/standings_change', league_id, team_ids)
+
+
+
+def _apply(league: League, team_id, goals_for, goals_against, delta):
+    won, drawn, lost = goals_for > goals_against, goals_for == goals_against, goals_for < goals_against
+    points = league.win_points if won else league.draw_points if drawn else league.loss_points
+    Standing.update({
+        Standing.played: Standing.played + 1,
+        Standing.won: Standing.won + int(won),
+        Standing.drawn: Standing.drawn + int(drawn),
+        Standing.lost: Standing.lost + int(lost),
+        Standing.goals_for: Standing.goals_for + goals_for,
+        Standing.goals_against: Standing.goals_against + goals_against,
+        Standing.points: Standing.points + points,
+        Standing.rating: Standing.rating + delta,
+    }).where(Standing.team == team_id).execute()
+
+
+def delete_result(match: Match | int):
+    match = match if isinstance(match, Match) else Match.get_by_id(match)
+    league = match.league
+    with write_lock, use_database.atomic():
+        match.delete_instance()
+        _recompute(league)
+        use_database.on_commit(lambda: g_events.invoke('league/standings_change', league.id, None))
+
+
+def recompute(league: League | int):
+    """
+    rebuild the standings and every rating_delta of a league from its results
+    """
+    league = _league(league)
+    with write_lock, use_database.atomic():
+        _recompute(league)
+        use_database.on_commit(lambda: g_events.invoke('league/standings_change', league.id, None))
+
+
+def _recompute(league: League):
+    start = time.perf_counter()
+    team_ids = [team_id for team_id, in Standing.select(Standing.team).where(Standing.league == league).order_by(Standing.team).tuples()]
+    index = {team_id: i for i, team_id in enumerate(team_ids)}
+    rows = Match.select(Match.id, Match.home, Match.away, Match.home_score, Match.away_score).where(
+        Match.league == league).order_by(Match.played_at, Match.id).tuples()
+    match_ids, home, away, home_score, away_score = [], [], [], [], []
+    for match_id, home_id, away_id, hs, as_ in rows:
+        match_ids.append(match_id)
+        home.append(index[home_id])
+        away.append(index[away_id])
+        home_score.append(hs)
+        away_score.append(as_)
+    compute = _compute_numpy if HAS_NUMPY else _compute_python
+    table, deltas = compute(league, len(team_ids), home, away, home_score, away_score)
+    use_database.executemany_sql(
+        f'UPDATE "{Standing._meta.table_name}" SET {_STANDING_SET} WHERE "team_id" = ?',
+        (row + (team_id,) for row, team_id in zip(table, team_ids)),
+    )
+    use_database.executemany_sql(f'UPDATE "{Match._meta.table_name}" SET "rating_delta" = ? WHERE "id" = ?', zip(deltas, match_ids))
+    logger.debug(f'Recomputed league {league.name}: {len(match_ids)} results, {len(team_ids)} teams in {time.perf_counter() - start:.3f}s')
+
+
+def _elo(league: League, n_teams, home, away, home_score, away_score):
+    """
+    ratings are path dependent, so this part stays a sequential pass over plain lists
+    """
+    ratings = [float(league.rating_init)] * n_teams
+    deltas = [0.] * len(home)
+    k, adv = league.rating_k, league.home_advantage
+    for i, (h, a, hs, as_) in enumerate(zip(home, away, home_score, away_score)):
+        score = 1. if hs > as_ else .5 if hs == as_ else 0.
+        deltas[i] = d = k * (score - 1 / (1 + 10 ** ((ratings[a] - ratings[h] - adv) / 400)))
+        ratings[h] += d
+        ratings[a] -= d
+    return ratings, deltas
+
+
+def _compute_numpy(league: League, n_teams, home, away, home_score, away_score):
+    import numpy as np
+    ratings, deltas = _elo(league, n_teams, home, away, home_score, away_score)
+    h, a = np.asarray(home, dtype=np.intp), np.asarray(away, dtype=np.intp)
+    hs, as_ = np.asarray(home_score, dtype=np.int64), np.asarray(away_score, dtype=np.int64)
+    home_won, draw, away_won = hs > as_, hs == as_, hs < as_
+
+    def count(home_values, away_values):
+        return (np.bincount(h, weights=home_values, minlength=n_teams)
+                + np.bincount(a, weights=away_values, minlength=n_teams)).astype(np.int64)
+
+    won = count(home_won, away_won)
+    drawn = count(draw, draw)
+    lost = count(away_won, home_won)
+    points = won * league.win_points + drawn * league.draw_points + lost * league.loss_points
+    table = zip((won + drawn + lost).tolist(), won.tolist(), drawn.tolist(), lost.tolist(), count(hs, as_).tolist(),
+                count(as_, hs).tolist(), points.tolist(), ratings)
+    return list(table), deltas
+
+
+def _compute_python(league: League, n_teams, home, away, home_score, away_score):
+    ratings, deltas = _elo(league, n_teams, home, away, home_score, away_score)
+    table = [[0, 0, 0, 0, 0, 0, 0, r] for r in ratings]
+    for h, a, hs, as_ in zip(home, away, home_score, away_score):
+        for row, gf, ga in ((table[h], hs, as_), (table[a], as_, hs)):
+            row[0] += 1
+            if gf > ga:
+                row[1] += 1
+                row[6] += league.win_points
+            elif gf == ga:
+                row[2] += 1
+                row[6] += league.draw_points
+            else:
+                row[3] += 1
+                row[6] += league.loss_points
+            row[4] += gf
+            row[5] += ga
+    return [tuple(row) for row in table], deltas
@@ -1,18 +1,27 @@
 import logging
 import pathlib
 
-from bottle import abort, Bottle, static_file, redirect
+from bottle import abort, Bottle, static_file, redirect, run
+from nyutils.database import use_database
+from nyutils.migrate import migrate
 from nyutils.password import make_password, rand_password
 from .api import api
-from .models import WebUser, WebPermission
+from . import admin_batch, admin_export, admin_profile, push  # registers their routes on api
+from . import migrations  # registers the server schema steps
+from .admin_backup import schedule_backup
+from .. import m_league
+from .models import WebUser, WebPermission, SysCfg
+from .compression import CompressionPlugin
 from .middleware import apply_middlewares
-from .utils import STATIC_DIR
+from .static import StaticIndex
+from .servers import SERVERS, ReleaseConnection, StartupTimer
+from .utils import STATIC_DIR, g_loop
 
 logger = logging.getLogger(__name__)
 
 
 def ensure_web_admin():
-    if WebUser.select().count() == 0:
+    if not WebUser.select().exists():
         password = rand_password(8)
         WebUser.create(username='admin', password=make_password(password), permissions=[p for p in WebPermission if p != WebPermission.NULL])
         logger.info("Created default admin user with username 'admin'.")
@@ -21,19 +30,48 @@ def ensure_web_admin():
 
 
 class Server:
-    def __init__(self):
+    def __init__(self, compression: CompressionPlugin | bool = False):
+        """
+        compression: gzip api responses, True for the default CompressionPlugin settings
+        """
         self.api = Bottle()
         self.app = Bottle()
+        if compression is True:
+            compression = CompressionPlugin()
 
-        apply_middlewares(self.api)
-        apply_middlewares(api)
+        apply_middlewares(self.api, compression)
+        apply_middlewares(api, compression)
 
         self.api.mount('/server', api)
         self.app.mount('/api', self.api)
 
-    def serve(self, host='0.0.0.0', port=80, static_dir=None):
+    def serve(self, host='0.0.0.0', port=80, static_dir=None, index_static=True, static_refresh_interval: float | None = 5,
+              server='wsgiref', pool_size=8, started: float | None = None, max_streams: int | str | None = 'auto'):
+        """
+        index_static keeps an in-memory index of static_dir (rescanned every static_refresh_interval seconds),
+        otherwise every request goes to the filesystem.
+        server: 'wsgiref' (one request at a time), 'threaded' or 'gevent' (needs nyutils.green.patch() first);
+        the concurrent servers share a pool of pool_size database connections.
+        started: time.perf_counter() at process start, the startup report then includes imports
+        max_streams: open event streams allowed, None for no limit, 'auto' for push.MAX_STREAMS of the server
+        """
+        if server not in SERVERS:
+            raise ValueError(f"Unknown server '{server}'")
+        push.push_hub.max_streams = push.MAX_STREAMS[server] if max_streams == 'auto' else max_streams
+        timer = StartupTimer(started)
+        if started is not None:
+            timer.mark('init')
+        migrate()
+        timer.mark('migrate')
         ensure_web_admin()
-        if static_dir:
+        SysCfg.reload()
+        SysCfg.create_defaults()
+        schedule_backup()
+        m_league.leaderboards.load()
+        m_league.fixture_scheduler.load()
+        if static_dir and index_static:
+            self.serve_static_index(static_dir, static_refresh_interval)
+        elif static_dir:
             logger.debug('Serving static files at %s', static_dir)
             static_dir = pathlib.Path(static_dir)
 
@@ -72,5 +110,43 @@ class Server:
                 def serve_root():
                     return static_file(default_file, root=static_dir)
 
-        # WSGIServer((host, port), self.app, handler_class=WebSocketHandler, log=logger).serve_forever()
-        self.app.run(host=host, port=port)
+        app = self.app
+        if server != 'wsgiref':
+            use_database.enable_pool(pool_size)
+            app = ReleaseConnection(app)
+        timer.mark('load')
+        run(timer.wrap(app), host=host, port=port, server=SERVERS[server])
+
+    def serve_static_index(self, static_dir, refresh_interval: float | None = 5):
+        logger.debug('Serving indexed static files at %s', static_dir)
+        index = StaticIndex(static_dir).refresh()
+        static_index = StaticIndex(STATIC_DIR).refresh() if STATIC_DIR.is_dir() else None
+        if refresh_interval:
+            for i in (index, static_index):
+                if i is not None:
+                    g_loop.create_event(i.refresh, delay=refresh_interval, repeat=True)
+
+        def default_entry():
+            for default in ('index.html', 'index.htm'):
+                if entry := index.get(default):
+                    return entry
+            return None
+
+        if default_entry() is None:
+            logger.error('Could not find static files at %s', static_dir)
+
+        @self.app.get('/static/<fpath:path>')
+        def serve_static(fpath):
+            if static_index and (entry := static_index.get(fpath)):
+                return static_index.serve(entry)
+            return abort(404, "File not found")
+
+        @self.app.get('/')
+        @self.app.get('/<fpath:path>')
+        def serve_static(fpath=''):
+            if fpath and (entry := index.get(fpath)):
+                return index.serve(entry)
+            # unknown paths fall back to the default file for client side routing
+            if entry := default_entry():
+                return index.serve(entry, cache_control='no-cache')
+            return abort(404, "File not found")
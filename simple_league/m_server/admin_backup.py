@@ -0,0 +1,57 @@
+# scheduled online backups of the database
+import logging
+import pathlib
+
+from bottle import request
+from nyutils.backup import OnlineBackup
+from nyutils.database import use_database
+
+from .api import api
+from .middleware import load_user
+from .models import SysCfg, WebPermission
+from .utils import g_loop, g_events, UserError
+
+logger = logging.getLogger(__name__)
+CFG_INTERVAL = 'backup/interval'  # whole seconds between snapshots, 0 disables the schedule
+CFG_KEEP = 'backup/keep'
+CFG_DIR = 'backup/dir'
+CFG_DEFAULTS = {CFG_INTERVAL: 24 * 3600, CFG_KEEP: 7, CFG_DIR: 'backup'}
+
+g_backup = OnlineBackup(use_database)
+SysCfg.register_defaults(CFG_DEFAULTS)
+_schedule_handle = None
+
+
+def schedule_backup():
+    global _schedule_handle
+    if _schedule_handle is not None:
+        g_loop.cancel_event(_schedule_handle)
+        _schedule_handle = None
+    g_backup.keep = SysCfg.get_int(CFG_KEEP, CFG_DEFAULTS[CFG_KEEP])
+    g_backup.backup_dir = pathlib.Path(SysCfg.get_str(CFG_DIR, CFG_DEFAULTS[CFG_DIR]))
+    if (interval := SysCfg.get_float(CFG_INTERVAL, CFG_DEFAULTS[CFG_INTERVAL])) > 0:
+        # thread=True, a snapshot of a large database must not hold up the other events
+        _schedule_handle = g_loop.create_event(g_backup.run, delay=interval, repeat=True, thread=True)
+        logger.debug(f'Database backup scheduled every {interval}s to {g_backup.backup_dir}')
+
+
+@g_events.set('server/cfg_change')
+def on_cfg_change(key, *_):
+    if key in (CFG_INTERVAL, CFG_KEEP, CFG_DIR):
+        schedule_backup()
+
+
+@api.get('/admin/backup/status')
+@load_user(required_permission=WebPermission.ADMIN)
+def admin_backup_status():
+    return g_backup.status()
+
+
+@api.post('/admin/backup/run', transaction=False)
+@load_user(required_permission=WebPermission.ADMIN)
+def admin_backup_run():
+    if g_backup.running:
+        raise UserError("A backup is already running")
+    g_loop.create_event(g_backup.run, thread=True)
+    logger.info(f'Admin {request.session.user.username} started a database backup')
+    return g_backup.status()
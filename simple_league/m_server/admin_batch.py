@@ -0,0 +1,186 @@
+# batched variants of the single user admin endpoints, one transaction per request
+import logging
+import typing
+
+from bottle import request
+from nyutils.database import use_database
+from nyutils.password import make_passwords
+
+from .api import api, new_password_check
+from .middleware import param_schema, load_user
+from .models import WebUser, WebSession, WebPermission
+from .transaction import write_transaction
+from .utils import g_events, UserError
+
+logger = logging.getLogger(__name__)
+MAX_BATCH = 10000
+CHUNK = 500  # keeps IN (...) below the sqlite variable limit
+
+
+def _chunks(items, size=CHUNK):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _items():
+    items = request.data['items']
+    if len(items) > MAX_BATCH:
+        raise UserError(f"At most {MAX_BATCH} items per batch")
+    return items
+
+
+def _load_users(usernames, *fields) -> dict[str, WebUser]:
+    res = {}
+    for chunk in _chunks(list(set(usernames))):
+        for user in WebUser.select(WebUser.id, WebUser.username, *fields).where(WebUser.username.in_(chunk)):
+            res[user.username] = user
+    return res
+
+
+class BatchResult:
+    def __init__(self, items):
+        self.results = [{'username': item['username'], 'success': 1} for item in items]
+
+    def fail(self, i, message):
+        self.results[i]['success'] = 0
+        self.results[i]['error'] = message
+
+    def to_client(self):
+        succeeded = sum(r['success'] for r in self.results)
+        return {'succeeded': succeeded, 'failed': len(self.results) - succeeded, 'results': self.results}
+
+
+def _update_grouped(field, updates: dict[int, typing.Any], fields_of: typing.Callable[[typing.Any], dict] | None = None):
+    """
+    one UPDATE ... WHERE id IN (...) per distinct value, fields_of(value) gives the columns to set when more than field
+    """
+    groups = {}
+    for user_id, value in updates.items():
+        groups.setdefault(field.db_value(value), (value, []))[1].append(user_id)
+    for value, user_ids in groups.values():
+        for chunk in _chunks(user_ids):
+            WebUser.update(fields_of(value) if fields_of else {field: value}).where(WebUser.id.in_(chunk)).execute()
+
+
+@api.post('/admin/batch_set_user_permission')
+@load_user(required_permission=WebPermission.ADMIN)
+@param_schema({'items': list[{'username': str, 'permissions': list[int]}]})
+def batch_set_user_permission():
+    items = _items()
+    result = BatchResult(items)
+    updates = {}
+    with use_database.atomic():
+        users = _load_users((item['username'] for item in items), WebUser.permissions)
+        for i, item in enumerate(items):
+            if not (user := users.get(item['username'])):
+                result.fail(i, "User not found")
+            elif (WebPermission.ADMIN in item['permissions']) != (WebPermission.ADMIN in user.permissions):
+                result.fail(i, "Cannot change admin permission directly")
+            else:
+                updates[user.id] = item['permissions']
+        _update_grouped(WebUser.permissions, updates, WebUser.permission_fields)
+    for user_id, permissions in updates.items():
+        g_events.invoke('server/user_permission_change', user_id, permissions)
+    logger.info(f'Admin {request.session.user.display_name} changed permissions for {len(updates)} users in batch')
+    return result.to_client()
+
+
+@api.post('/admin/batch_set_allow_login')
+@load_user(required_permission=WebPermission.ADMIN)
+@param_schema({'items': list[{'username': str, 'allow_login': bool}]})
+def batch_set_allow_login():
+    items = _items()
+    act_user = request.session.user
+    result = BatchResult(items)
+    updates = {}
+    with use_database.atomic():
+        users = _load_users(item['username'] for item in items)
+        for i, item in enumerate(items):
+            if item['username'] == act_user.username:
+                result.fail(i, "Cannot change your own login permission")
+            elif not (user := users.get(item['username'])):
+                result.fail(i, "User not found")
+            else:
+                updates[user.id] = item['allow_login']
+        _update_grouped(WebUser.allow_login, updates)
+    logger.info(f'Admin {act_user.display_name} changed allow_login for {len(updates)} users in batch')
+    return result.to_client()
+
+
+@api.post('/admin/batch_change_user_password', transaction=False)
+@load_user(required_permission=WebPermission.ADMIN)
+@param_schema({'items': list[{'username': str, 'new_password': str}]})
+def batch_change_user_password():
+    items = _items()
+    result = BatchResult(items)
+    users = _load_users(item['username'] for item in items)
+    todo = []
+    for i, item in enumerate(items):
+        if not (user := users.get(item['username'])):
+            result.fail(i, "User not found")
+            continue
+        try:
+            new_password_check(item['new_password'])
+        except UserError as e:
+            result.fail(i, e.message)
+            continue
+        todo.append((user.id, item['new_password']))
+    hashes = make_passwords([password for _, password in todo])
+    user_ids = [user_id for user_id, _ in todo]
+    dropped = []
+    with write_transaction():
+        use_database.executemany_sql(
+            f'UPDATE "{WebUser._meta.table_name}" SET "password" = ? WHERE "id" = ?',
+            zip(hashes, user_ids),
+        )
+        for chunk in _chunks(user_ids):
+            dropped.extend(s.token for s in WebSession.select(WebSession.token).where(WebSession.user.in_(chunk)))
+            WebSession.delete().where(WebSession.user.in_(chunk)).execute()
+    for token in dropped:
+        g_events.invoke('server/session_drop', token)
+    logger.info(f"Admin {request.session.user.username} changed password for {len(todo)} users in batch")
+    return result.to_client()
+
+
+@api.post('/admin/import_users', transaction=False)
+@load_user(required_permission=WebPermission.ADMIN)
+@param_schema({'items': list[{
+    'username': str,
+    'password': str,
+    'permissions': typing.Optional[list[int]],
+    'data': typing.Optional[dict],
+}]})
+def import_users():
+    items = _items()
+    result = BatchResult(items)
+    existing = _load_users(item['username'] for item in items)
+    seen = set()
+    todo = []
+    for i, item in enumerate(items):
+        username = item['username']
+        permissions = item.get('permissions') or [WebPermission.USER]
+        if not username:
+            result.fail(i, "Username cannot be empty")
+        elif username in existing or username in seen:
+            result.fail(i, "Username already exists")
+        elif WebPermission.ADMIN in permissions:
+            result.fail(i, "Cannot import admin users")
+        else:
+            try:
+                new_password_check(item['password'])
+            except UserError as e:
+                result.fail(i, e.message)
+                continue
+            seen.add(username)
+            todo.append((username, item['password'], permissions, item.get('data') or {}))
+    hashes = make_passwords([password for _, password, _, _ in todo])
+    rows = [
+        {'username': username, 'password': password_hash, 'permissions': permissions,
+         'permission_mask': WebPermission.mask(permissions), 'data': data}
+        for (username, _, permissions, data), password_hash in zip(todo, hashes)
+    ]
+    with write_transaction():
+        for chunk in _chunks(rows, 100):
+            WebUser.insert_many(chunk).execute()
+    logger.info(f'Admin {request.session.user.username} imported {len(rows)} users from {request.environ.get("REMOTE_ADDR", "unknown")}')
+    return result.to_client()
@@ -0,0 +1,105 @@
+# streaming export of large tables as ndjson or csv
+import csv
+import datetime
+import io
+import json
+import logging
+
+from bottle import request, HTTPResponse
+from nyutils.database import unwrap
+
+from .api import api
+from .middleware import load_user
+from .models import WebUser, WebSession, WebPermission
+from .utils import UserError
+
+logger = logging.getLogger(__name__)
+PAGE_SIZE = 1000  # rows per keyset page, also the rows per response chunk
+
+
+def _plain(value):
+    if isinstance(value, datetime.datetime):
+        return value.timestamp()
+    return unwrap(value)
+
+
+class Exporter:
+    """
+    pages through a model by primary key (WHERE id > last ORDER BY id LIMIT n), so no read transaction is held
+    open between chunks and memory stays at one page whatever the table size; 'after' resumes from an id
+    """
+
+    def __init__(self, model, fields):
+        self.model = model
+        self.fields = fields
+        self.columns = [f.column_name if f.name != 'user' else 'user_id' for f in fields]
+
+    def rows(self, after: int, limit: int | None):
+        model = self.model
+        sent = 0
+        while limit is None or sent < limit:
+            page = PAGE_SIZE if limit is None else min(PAGE_SIZE, limit - sent)
+            query = model.select(*self.fields).where(model.id > after).order_by(model.id).limit(page)
+            rows = [tuple(_plain(v) for v in row) for row in query.tuples().iterator()]
+            if not rows:
+                return
+            yield rows
+            sent += len(rows)
+            after = rows[-1][0]
+            if len(rows) < page:
+                return
+
+    def ndjson(self, after, limit):
+        columns = self.columns
+        for rows in self.rows(after, limit):
+            yield ''.join(json.dumps(dict(zip(columns, row))) + '\n' for row in rows).encode('utf-8')
+
+    def csv(self, after, limit):
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(self.columns)
+        for rows in self.rows(after, limit):
+            writer.writerows([v if isinstance(v, (str, int, float)) or v is None else json.dumps(v) for v in row] for row in rows)
+            yield buf.getvalue().encode('utf-8')
+            buf.seek(0)
+            buf.truncate()
+        if buf.tell():
+            yield buf.getvalue().encode('utf-8')
+
+    def response(self, name):
+        fmt = request.query.get('format') or 'ndjson'
+        try:
+            after = int(request.query.get('after') or 0)
+            limit = int(limit) if (limit := request.query.get('limit')) else None
+        except ValueError:
+            raise UserError("after and limit must be integers")
+        if fmt == 'ndjson':
+            body, content_type = self.ndjson(after, limit), 'application/x-ndjson'
+        elif fmt == 'csv':
+            body, content_type = self.csv(after, limit), 'text/csv; charset=utf-8'
+        else:
+            raise UserError(f"Unsupported export format '{fmt}'")
+        logger.info(f'Admin {request.session.user.username} exporting {name} after id {after} as {fmt}')
+        # no Content-Length, the server sends it chunked
+        return HTTPResponse(body, headers={
+            'Content-Type': content_type,
+            'Content-Disposition': f'attachment; filename="{name}.{fmt}"',
+            'X-Export-Resume-Key': 'id',
+        })
+
+
+# password hashes and session tokens never leave the server
+user_exporter = Exporter(WebUser, [WebUser.id, WebUser.username, WebUser.last_login, WebUser.allow_login, WebUser.permissions, WebUser.data])
+session_exporter = Exporter(WebSession, [WebSession.id, WebSession.user, WebSession.unique_type, WebSession.created_at, WebSession.valid_until, WebSession.data])
+
+
+@api.get('/admin/export/users')
+@load_user(required_permission=WebPermission.ADMIN)
+def export_users():
+    return user_exporter.response('users')
+
+
+@api.get('/admin/export/sessions')
+@load_user(required_permission=WebPermission.ADMIN)
+def export_sessions():
+    return session_exporter.response('sessions')
@@ -0,0 +1,95 @@
+# admin control of on demand profiling: cpu profiles of selected routes or the whole process, tracemalloc diffs
+import logging
+import typing
+
+from bottle import request, static_file
+
+from .api import api
+from .middleware import param_schema, load_user
+from .models import WebPermission
+from .profiling import g_profiler, g_memory
+from .push import push_hub
+from .utils import UserError
+
+logger = logging.getLogger(__name__)
+g_memory.probes['push.subscribers'] = lambda: len(push_hub)
+
+
+@api.get('/admin/profile')
+@load_user(required_permission=WebPermission.ADMIN)
+def admin_profile_status():
+    return {'cpu': g_profiler.status(), 'memory': g_memory.status()}
+
+
+@api.post('/admin/profile/start', transaction=False)
+@load_user(required_permission=WebPermission.ADMIN)
+@param_schema({
+    'kind': typing.Optional[str],
+    'routes': typing.Optional[list[str]],
+    'seconds': typing.Union[float, int, None],
+    'calls': typing.Optional[int],
+    'interval': typing.Union[float, int, None],
+})
+def admin_profile_start():
+    """
+    kind 'deterministic' runs the routes matching one of routes ('/login', 'POST /admin/*', all when omitted) under
+    cProfile until seconds pass or calls of them finished, 'sampling' samples the stacks of every thread each
+    interval seconds for seconds
+    """
+    data = request.data
+    try:
+        session = g_profiler.start(data.get('kind') or 'deterministic', data.get('routes'),
+                                   seconds=data.get('seconds') or 30., calls=data.get('calls'),
+                                   interval=data.get('interval') or .005)
+    except (ValueError, RuntimeError) as e:
+        raise UserError(str(e))
+    logger.info(f"Admin {request.session.user.username} started {session['kind']} profiling")
+    return session
+
+
+@api.post('/admin/profile/stop', transaction=False)
+@load_user(required_permission=WebPermission.ADMIN)
+def admin_profile_stop():
+    try:
+        return g_profiler.stop()
+    except RuntimeError as e:
+        raise UserError(str(e))
+
+
+@api.get('/admin/profile/files/<name>')
+@load_user(required_permission=WebPermission.ADMIN)
+def admin_profile_file(name):
+    if not name.startswith('profile-'):
+        raise UserError("Not a profile file")
+    return static_file(name, root=g_profiler.output_dir, download=True)
+
+
+@api.post('/admin/profile/memory', transaction=False)
+@load_user(required_permission=WebPermission.ADMIN)
+@param_schema({
+    'action': str,
+    'frames': typing.Optional[int],
+    'limit': typing.Optional[int],
+    'group_by': typing.Optional[str],
+})
+def admin_profile_memory():
+    """
+    action 'start' begins tracing allocations (frames deep), 'snapshot' returns the allocation sites grown most
+    since the previous snapshot and the size changes of the probed structures, 'stop' ends tracing
+    """
+    data = request.data
+    action = data['action']
+    if action == 'start':
+        g_memory.start(data.get('frames') or 10)
+        return g_memory.status()
+    if action == 'snapshot':
+        if (group_by := data.get('group_by') or 'lineno') not in ('lineno', 'filename', 'traceback'):
+            raise UserError(f"Unknown group_by '{group_by}'")
+        try:
+            return g_memory.snapshot(data.get('limit') or 30, group_by)
+        except RuntimeError as e:
+            raise UserError(str(e))
+    if action == 'stop':
+        g_memory.stop()
+        return g_memory.status()
+    raise UserError(f"Unknown action '{action}'")
@@ -0,0 +1,154 @@
+# admission control: bounded in-flight requests per route class, overload is answered with 503 at once
+import json
+import logging
+import threading
+import time
+
+from bottle import request, HTTPResponse
+from nyutils.tracing import tracer
+
+from .metrics import g_metrics, METRIC_PREFIX
+from .servers import ACCEPTED_KEY
+
+logger = logging.getLogger(__name__)
+
+
+class Limiter:
+    """
+    at most limit requests in flight and queue more waiting for a slot (up to timeout), anything beyond is rejected.
+    so is a request that already waited max_delay in the server before reaching it: a gevent hub runs greenlets
+    one at a time, its backlog builds up in front of the handlers where in flight counts cannot see it
+    """
+
+    def __init__(self, name: str, limit: int, queue: int, timeout: float = 5., max_delay: float | None = None):
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.timeout = timeout
+        self.max_delay = max_delay
+        self.cond = threading.Condition()
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.late = 0
+        self.waited = 0
+        self.wait_time = 0.
+
+    def acquire(self, accepted: float | None = None) -> bool:
+        with self.cond:
+            if accepted is not None and self.max_delay is not None and time.perf_counter() - accepted > self.max_delay:
+                self.late += 1
+                return False
+            if self.in_flight < self.limit and not self.waiting:
+                self.in_flight += 1
+                self.admitted += 1
+                return True
+            if self.waiting >= self.queue:
+                self.rejected += 1
+                return False
+            self.waiting += 1
+            start = time.perf_counter()
+            admitted = self.cond.wait_for(lambda: self.in_flight < self.limit, self.timeout)
+            self.waiting -= 1
+            self.waited += 1
+            self.wait_time += time.perf_counter() - start
+            if not admitted:
+                self.timed_out += 1
+                return False
+            self.in_flight += 1
+            self.admitted += 1
+            return True
+
+    def release(self):
+        with self.cond:
+            self.in_flight -= 1
+            self.cond.notify()
+
+
+class AdmissionControl:
+    """
+    bottle plugin giving every route class its own Limiter, so saturated expensive routes (password hashing of
+    login) cannot hold up the rest. a route picks its class with the admission= option, otherwise /admin/ routes
+    are 'critical' and the others 'default'; admission_limit=(limit, queue) gives a route a limiter of its own.
+    classes without limits ('critical') are not wrapped at all, the others also shed requests the threaded or
+    gevent server accepted more than max_delay seconds ago.
+    installed outside JsonApiMiddleware and the request transaction, a waiting request holds neither
+    """
+    name = 'admission'
+    api = 2
+
+    def __init__(self, limits: dict[str, tuple[int, int] | None] = None, timeout=5., max_delay=.5, retry_after=1):
+        self.limits = {'critical': None, 'default': (64, 256), 'expensive': (8, 32)}
+        self.limits.update(limits or {})
+        self.timeout = timeout
+        self.max_delay = max_delay
+        self.retry_after = retry_after
+        self.limiters: dict[str, Limiter] = {}
+        self.lock = threading.Lock()
+        self._hooked = False
+
+    def setup(self, app):
+        if not self._hooked:
+            g_metrics.add_collector(self.collect)
+            self._hooked = True
+
+    def limiter(self, name: str, limits: tuple[int, int]) -> Limiter:
+        with self.lock:
+            if (limiter := self.limiters.get(name)) is None:
+                self.limiters[name] = limiter = Limiter(name, *limits, timeout=self.timeout, max_delay=self.max_delay)
+            return limiter
+
+    def route_class(self, route) -> str:
+        if (name := route.config.get('admission')) is not None:
+            return name
+        return 'critical' if route.rule.startswith('/admin/') else 'default'
+
+    def overloaded(self):
+        return HTTPResponse(json.dumps({'success': 0, 'error': 'Overloaded'}), status=503, headers={
+            'Content-Type': 'application/json',
+            'Retry-After': str(self.retry_after),
+        })
+
+    def apply(self, callback, route):
+        if (own := route.config.get('admission_limit')) is not None:
+            limiter = self.limiter(f'{route.method} {route.rule}', own)
+        else:
+            if (name := self.route_class(route)) not in self.limits:
+                raise ValueError(f"Unknown admission class '{name}' of route {route.rule}")
+            if (limits := self.limits[name]) is None:
+                return callback
+            limiter = self.limiter(name, limits)
+
+        def wrapper(*args, **kwargs):
+            with tracer.span('admission', limiter=limiter.name):
+                admitted = limiter.acquire(request.environ.get(ACCEPTED_KEY))
+            if not admitted:
+                logger.debug(f'Rejected {route.method} {route.rule}, {limiter.name} is saturated')
+                return self.overloaded()
+            try:
+                return callback(*args, **kwargs)
+            finally:
+                limiter.release()
+
+        return wrapper
+
+    def collect(self):
+        with self.lock:
+            limiters = list(self.limiters.values())
+        yield f'# TYPE {METRIC_PREFIX}admission_requests_total counter'
+        for lm in limiters:
+            for result, count in (('admitted', lm.admitted), ('rejected', lm.rejected), ('timeout', lm.timed_out), ('late', lm.late)):
+                yield f'{METRIC_PREFIX}admission_requests_total{{class="{lm.name}",result="{result}"}} {count}'
+        yield f'# TYPE {METRIC_PREFIX}admission_wait_seconds summary'
+        for lm in limiters:
+            yield f'{METRIC_PREFIX}admission_wait_seconds_sum{{class="{lm.name}"}} {lm.wait_time:.6f}'
+            yield f'{METRIC_PREFIX}admission_wait_seconds_count{{class="{lm.name}"}} {lm.waited}'
+        for gauge in ('in_flight', 'waiting'):
+            yield f'# TYPE {METRIC_PREFIX}admission_{gauge} gauge'
+            for lm in limiters:
+                yield f'{METRIC_PREFIX}admission_{gauge}{{class="{lm.name}"}} {getattr(lm, gauge)}'
+
+
+g_admission = AdmissionControl()
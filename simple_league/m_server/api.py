@@ -3,12 +3,16 @@ import logging
 import time
 import typing
 
-from bottle import Bottle, request
+from bottle import Bottle, request, HTTPResponse
 from nyutils.password import make_password, validate_password
+from nyutils.regex import regexp_filter, PatternError
 
 from .middleware import param_schema, load_user
-from .utils import g_events, UserError, page_view_req_schema, page_view_res
+from .utils import g_events, g_query_log, g_query_cache, UserError, page_view_req_schema, page_view_res
 from .models import WebUser, WebSession, WebPermission, SysCfg
+from .metrics import g_metrics, METRIC_PREFIX
+from .tokens import signed_tokens
+from .transaction import write_transaction
 
 api = Bottle()
 logger = logging.getLogger(__name__)
@@ -18,7 +22,7 @@ _public_cfg = None
 def get_public_cfg(force_update: bool = False):
     global _public_cfg
     if _public_cfg is None or force_update:
-        _public_cfg = {cfg.key: cfg.data for cfg in SysCfg.select().where(SysCfg.public)}
+        _public_cfg = SysCfg.public_values()
     return _public_cfg
 
 
@@ -34,12 +38,12 @@ def new_password_check(password: str):
     ...
 
 
-@api.get('/public_cfg')
+@api.get('/public_cfg', admission='critical')
 def public_cfg():
     return get_public_cfg()
 
 
-@api.post('/register')
+@api.post('/register', admission='expensive', transaction=False)
 @param_schema({'username': str, 'password': str, 'data': dict})
 def register():
     username = request.data['username']
@@ -48,23 +52,29 @@ def register():
     if WebUser.select().where(WebUser.username == username).exists():
         raise UserError("Username already exists")
     new_password_check(password)
-    user = WebUser(username=username)
-    user.password = make_password(password)
-    user.data = data
-    user.permissions = [WebPermission.USER]  # TODO: apply after email verification
-    user.save()
+    password_hash = make_password(password)  # before the transaction, writers do not queue behind it
+    with write_transaction():
+        if WebUser.select().where(WebUser.username == username).exists():
+            raise UserError("Username already exists")
+        user = WebUser(username=username)
+        user.password = password_hash
+        user.data = data
+        user.permissions = [WebPermission.USER]  # TODO: apply after email verification
+        user.save()
     logger.info(f'New user registered: {username} from {request.environ.get("REMOTE_ADDR", "unknown")}')
     return user.to_client()
 
 
-@api.post('/login')
+@api.post('/login', admission='expensive', transaction=False)
 @param_schema({'username': str, 'password': str})
 def login():
     remote = request.environ.get('REMOTE_ADDR', 'unknown')
     if not (user := WebUser.try_login(request.data.get('username'), request.data.get('password'))):
         logger.warning(f'Failed login attempt for user {request.data.get("username")} from {remote}')
         raise UserError("Invalid username or password")
-    session = WebSession.create_session(user, unique_type=10001)
+    with write_transaction():
+        user.record_login()
+        session = signed_tokens.create_session(user, unique_type=10001)
     logger.info(f'User {user.username} logged in from {remote}')
     request.cookies['session'] = token = session.token
     return token
@@ -77,18 +87,18 @@ def logout():
         request.session.destroy()
 
 
-@api.get('ping')
+@api.get('/ping', admission='critical')
 def ping():
     return {'timestamp': int(time.time())}
 
 
-@api.get('current_user')
+@api.get('/current_user')
 @load_user()
 def current_user():
     return request.session.user.to_client()
 
 
-@api.post('/change_password')
+@api.post('/change_password', admission='expensive', transaction=False)
 @load_user()
 @param_schema({'old_password': str, 'new_password': str})
 def change_password():
@@ -99,22 +109,37 @@ def change_password():
         raise UserError("Invalid old password")
     new_password_check(new_pw)
     user.password = make_password(new_pw)
-    user.save()
+    with write_transaction():
+        user.save(only=[WebUser.password])
     logger.info(f'User {user.username} changed password successfully')
 
 
-@api.post('admin/list_users')
+@api.post('/admin/list_users', transaction=False)
 @load_user(required_permission=WebPermission.ADMIN)
 @param_schema(page_view_req_schema())
 def list_users():
+    """
+    query: {'value': str, 'regex': bool, 'permissions': [int]}, with regex the value is a pattern searched in
+    username and data; permissions keeps users having any of them
+    """
     selector = WebUser.select()
-    if query := request.data['query'].get('value'):
-        selector = selector.where(WebUser.username.contains(query) | WebUser.data.contains(query))
-    result = page_view_res(selector, request.data)
+    query = request.data['query'] or {}
+    if (permissions := query.get('permissions')) is not None:
+        if not (isinstance(permissions, list) and all(type(p) is int and p in WebPermission._value2member_map_ for p in permissions)):
+            raise UserError("permissions must be a list of permission values", 'query')
+        selector = selector.where(WebUser.with_permission(permissions))
+    if (value := query.get('value')) and query.get('regex'):
+        try:
+            selector = selector.where(regexp_filter(WebUser.username, value) | regexp_filter(WebUser.data, value))
+        except PatternError as e:
+            raise UserError(str(e), 'query')
+    elif value:
+        selector = selector.where(WebUser.username.contains(value) | WebUser.data.contains(value))
+    result = page_view_res(selector, request.data, cached=True)
     return result
 
 
-@api.post('admin/set_user_permission')
+@api.post('/admin/set_user_permission')
 @load_user(required_permission=WebPermission.ADMIN)
 @param_schema({'username': str, 'permissions': list[int]})
 def set_user_permission():
@@ -126,10 +151,11 @@ def set_user_permission():
     old_permissions = user.permissions
     user.permissions = p
     user.save()
+    g_events.invoke('server/user_permission_change', user.id, p)
     logger.info(f'Admin {request.session.user.display_name} changed permissions for user {user.display_name} from {old_permissions} to {p}')
 
 
-@api.post('admin/set_allow_login')
+@api.post('/admin/set_allow_login')
 @load_user(required_permission=WebPermission.ADMIN)
 @param_schema({'username': str, 'allow_login': bool})
 def set_allow_login():
@@ -144,7 +170,7 @@ def set_allow_login():
     logger.info(f'Admin {act_user.display_name} changed allow_login for user {user.display_name} from {old_allow_login} to {user.allow_login}')
 
 
-@api.post('admin/change_user_password')
+@api.post('/admin/change_user_password', transaction=False)
 @load_user(required_permission=WebPermission.ADMIN)
 @param_schema({'username': str, 'new_password': str})
 def admin_change_user_password():
@@ -153,19 +179,20 @@ def admin_change_user_password():
     new_password = request.data['new_password']
     new_password_check(new_password)
     user.password = make_password(new_password)
-    user.save()
-    for session in WebSession.select().where(WebSession.user == user):
-        session.destroy()
+    with write_transaction():
+        user.save(only=[WebUser.password])
+        for session in WebSession.select().where(WebSession.user == user):
+            session.destroy()
     logger.info(f"Admin {request.session.user.username} changed password for user {user.username}")
 
 
-@api.get('admin/list_cfg')
+@api.get('/admin/list_cfg')
 @load_user(required_permission=WebPermission.ADMIN)
 def admin_list_cfg():
-    return {cfg.key: cfg.data for cfg in SysCfg.select()}
+    return dict(SysCfg.snapshot().values)
 
 
-@api.post('admin/set_cfg')
+@api.post('/admin/set_cfg')
 @load_user(required_permission=WebPermission.ADMIN)
 @param_schema({'key': str, 'value': typing.Any})
 def admin_set_cfg():
@@ -178,3 +205,51 @@ def admin_set_cfg():
         raise UserError(f"Configuration value type mismatch for key '{key}'")
     SysCfg.set_value(key, value)
     logger.info(f"Admin {request.session.user.username} set cfg {key} from {old_value} to {value}")
+
+
+@api.get('/admin/metrics')
+@load_user(required_permission=WebPermission.ADMIN)
+def admin_metrics():
+    return HTTPResponse(g_metrics.to_prometheus(), headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+
+@g_metrics.add_collector
+def query_cache_metrics():
+    stats = g_query_cache.stats()
+    yield f'# TYPE {METRIC_PREFIX}query_cache_lookups_total counter'
+    for result in ('hits', 'misses'):
+        yield f'{METRIC_PREFIX}query_cache_lookups_total{{result="{result}"}} {stats[result]}'
+    for name in ('stale', 'evictions'):
+        yield f'# TYPE {METRIC_PREFIX}query_cache_{name}_total counter'
+        yield f'{METRIC_PREFIX}query_cache_{name}_total {stats[name]}'
+    for name in ('entries', 'bytes', 'max_bytes'):
+        yield f'# TYPE {METRIC_PREFIX}query_cache_{name} gauge'
+        yield f'{METRIC_PREFIX}query_cache_{name} {stats[name]}'
+
+
+@api.get('/admin/query_cache')
+@load_user(required_permission=WebPermission.ADMIN)
+def admin_query_cache():
+    return g_query_cache.stats()
+
+
+@api.get('/admin/slow_queries')
+@load_user(required_permission=WebPermission.ADMIN)
+def admin_slow_queries():
+    return g_query_log.summary()
+
+
+@api.post('/admin/set_slow_query_log', transaction=False)
+@load_user(required_permission=WebPermission.ADMIN)
+@param_schema({'threshold_ms': typing.Union[float, int, None], 'reset': typing.Optional[bool]})
+def admin_set_slow_query_log():
+    """
+    threshold_ms: log statements slower than this, in milliseconds as --slow-query-ms; null disables the log
+    """
+    if (threshold_ms := request.data.get('threshold_ms')) is None:
+        g_query_log.disable()
+    else:
+        g_query_log.enable(threshold_ms / 1000)
+    if request.data.get('reset'):
+        g_query_log.reset()
+    logger.info(f"Admin {request.session.user.username} set slow query log threshold to {threshold_ms}ms")
@@ -0,0 +1,138 @@
+# gzip compression of json api responses
+import collections
+import gzip
+import hashlib
+import json
+import re
+import threading
+import time
+
+from bottle import request, response, HTTPResponse
+
+from .metrics import g_metrics, METRIC_PREFIX
+
+ETAG_RE = re.compile(r'(?:W/)?("[^"]*")')
+
+
+def accepts_gzip(accept_encoding: str) -> bool:
+    """
+    an explicit gzip entry decides over "*", either one with q=0 refuses it
+    """
+    q = {}
+    for item in accept_encoding.split(','):
+        coding, *params = item.split(';')
+        coding = coding.strip().lower()
+        if coding not in ('gzip', '*') or coding in q:
+            continue
+        q[coding] = 1.
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q[coding] = float(value)
+                except ValueError:
+                    q[coding] = 0.
+    return q.get('gzip', q.get('*', 0.)) > 0
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """
+    If-None-Match is "*" or a list of entity tags, compared whole and weakly (a W/ prefix is ignored)
+    """
+    if if_none_match.strip() == '*':
+        return True
+    return any(tag == etag.removeprefix('W/') for tag in ETAG_RE.findall(if_none_match))
+
+
+class CompressionPlugin:
+    """
+    bottle plugin installed between the metrics and JsonApiMiddleware, serializes the json payload itself
+    (bottle's JSONPlugin then passes the bytes through) and gzips it when the client accepts it and the body is
+    at least min_size bytes.
+    compressed bodies are kept in a small LRU keyed by the ETag of the uncompressed body, so repeated identical
+    responses are only hashed, not compressed again; a GET matching If-None-Match gets a 304.
+    """
+    name = 'compression'
+    api = 2
+
+    def __init__(self, min_size=1024, level=6, cache_size=64, cache_max_body=1024 * 1024):
+        self.min_size = min_size
+        self.level = level
+        self.cache_size = cache_size
+        self.cache_max_body = cache_max_body
+        self.cache = collections.OrderedDict()  # etag -> compressed body
+        self.lock = threading.Lock()
+        self.stats = {
+            'compressed': 0,
+            'skipped': 0,
+            'not_modified': 0,
+            'cache_hits': 0,
+            'bytes_in': 0,
+            'bytes_out': 0,
+            'cpu_seconds': 0.,
+        }
+
+    def setup(self, app):
+        g_metrics.add_collector(self.collect)
+
+    def _count(self, **kwargs):
+        with self.lock:
+            for k, v in kwargs.items():
+                self.stats[k] += v
+
+    def _compress(self, body: bytes, etag: str) -> bytes:
+        if self.cache_size:
+            with self.lock:
+                if (gz := self.cache.get(etag)) is not None:
+                    self.cache.move_to_end(etag)
+                    self.stats['cache_hits'] += 1
+                    return gz
+        start = time.thread_time()
+        gz = gzip.compress(body, self.level, mtime=0)
+        self._count(cpu_seconds=time.thread_time() - start)
+        if self.cache_size and len(body) <= self.cache_max_body:
+            with self.lock:
+                self.cache[etag] = gz
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        return gz
+
+    def apply(self, callback, route):
+        def wrapper(*args, **kwargs):
+            result = callback(*args, **kwargs)
+            if not isinstance(result, dict):
+                return result
+            body = json.dumps(result).encode('utf-8')
+            response.content_type = 'application/json'
+            if len(body) < self.min_size:
+                self._count(skipped=1)
+                return body
+            response.add_header('Vary', 'Accept-Encoding')
+            if not accepts_gzip(request.environ.get('HTTP_ACCEPT_ENCODING', '')):
+                self._count(skipped=1)
+                return body
+            etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}-gz"'
+            response.set_header('ETag', etag)
+            if request.method == 'GET' and response.status_code == 200 and etag_matches(request.environ.get('HTTP_IF_NONE_MATCH', ''), etag):
+                self._count(not_modified=1)
+                return HTTPResponse(status=304, headers=dict(response.headerlist))
+            gz = self._compress(body, etag)
+            self._count(compressed=1, bytes_in=len(body), bytes_out=len(gz))
+            response.set_header('Content-Encoding', 'gzip')
+            return gz
+
+        return wrapper
+
+    def collect(self):
+        with self.lock:
+            stats = dict(self.stats)
+        yield f'# TYPE {METRIC_PREFIX}compression_responses_total counter'
+        for k in ('compressed', 'skipped', 'not_modified', 'cache_hits'):
+            yield f'{METRIC_PREFIX}compression_responses_total{{result="{k}"}} {stats[k]}'
+        yield f'# TYPE {METRIC_PREFIX}compression_bytes_total counter'
+        yield f'{METRIC_PREFIX}compression_bytes_total{{direction="in"}} {stats["bytes_in"]}'
+        yield f'{METRIC_PREFIX}compression_bytes_total{{direction="out"}} {stats["bytes_out"]}'
+        yield f'# TYPE {METRIC_PREFIX}compression_bytes_saved_total counter'
+        yield f'{METRIC_PREFIX}compression_bytes_saved_total {stats["bytes_in"] - stats["bytes_out"]}'
+        yield f'# TYPE {METRIC_PREFIX}compression_cpu_seconds_total counter'
+        yield f'{METRIC_PREFIX}compression_cpu_seconds_total {stats["cpu_seconds"]:.6f}'
@@ -0,0 +1,171 @@
+# per-route request metrics, exported in prometheus text format
+import bisect
+import threading
+import time
+import typing
+
+from bottle import request, response, HTTPResponse
+from nyutils.database import use_database
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRIC_PREFIX = 'simple_league_'
+
+
+class RouteStats:
+    __slots__ = ('status', 'buckets', 'latency_sum', 'count', 'db_queries', 'db_time')
+
+    def __init__(self):
+        self.status = {}  # status class ('2xx', ...) -> count
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)  # last one is +Inf
+        self.latency_sum = 0.
+        self.count = 0
+        self.db_queries = 0
+        self.db_time = 0.
+
+    def merge(self, other: 'RouteStats'):
+        for k, v in list(other.status.items()):
+            self.status[k] = self.status.get(k, 0) + v
+        for i, v in enumerate(other.buckets):
+            self.buckets[i] += v
+        self.latency_sum += other.latency_sum
+        self.count += other.count
+        self.db_queries += other.db_queries
+        self.db_time += other.db_time
+
+
+class RequestMetrics:
+    """
+    bottle plugin, every thread records into its own accumulator so the hot path takes no lock,
+    the accumulators are only merged when scraped
+    """
+    name = 'request_metrics'
+    api = 2
+
+    def __init__(self):
+        self._local = threading.local()
+        self._accumulators = []  # (thread, {(method, route): RouteStats})
+        self._lock = threading.Lock()
+        self._retired = {}  # stats of threads that exited
+        self._hooked = False
+        self._collectors = []
+
+    def add_collector(self, collector: typing.Callable[[], typing.Iterable[str]]):
+        """
+        collector returns extra prometheus text lines, called on every scrape
+        """
+        if collector not in self._collectors:
+            self._collectors.append(collector)
+        return collector
+
+    def setup(self, app):
+        if not self._hooked:
+            use_database.add_statement_hook(self._on_query)
+            self._hooked = True
+
+    def _on_query(self, sql, params, elapsed):
+        if (current := getattr(self._local, 'current', None)) is not None:
+            current[0] += 1
+            current[1] += elapsed
+
+    def _stats(self):
+        try:
+            return self._local.stats
+        except AttributeError:
+            self._local.stats = stats = {}
+            with self._lock:
+                self._accumulators.append((threading.current_thread(), stats))
+            return stats
+
+    def record(self, key, status: int, elapsed: float, db_queries: int, db_time: float):
+        stats = self._stats()
+        if (rs := stats.get(key)) is None:
+            stats[key] = rs = RouteStats()
+        status_class = f'{status // 100}xx'
+        rs.status[status_class] = rs.status.get(status_class, 0) + 1
+        rs.buckets[bisect.bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+        rs.latency_sum += elapsed
+        rs.count += 1
+        rs.db_queries += db_queries
+        rs.db_time += db_time
+
+    def apply(self, callback, route):
+        rule = route.rule.lstrip('/')
+        method = route.method
+
+        def wrapper(*args, **kwargs):
+            self._local.current = current = [0, 0.]
+            start = time.perf_counter()
+            status = 500
+            try:
+                result = callback(*args, **kwargs)
+                status = result.status_code if isinstance(result, HTTPResponse) else response.status_code
+                return result
+            except HTTPResponse as e:
+                status = e.status_code
+                raise
+            finally:
+                elapsed = time.perf_counter() - start
+                self._local.current = None
+                self.record((method, request.script_name + rule), status, elapsed, current[0], current[1])
+
+        return wrapper
+
+    def snapshot(self) -> dict[tuple[str, str], RouteStats]:
+        with self._lock:
+            alive = []
+            for thread, stats in self._accumulators:
+                if thread.is_alive():
+                    alive.append((thread, stats))
+                else:
+                    self._merge_into(self._retired, stats)
+            self._accumulators = alive
+            res = {}
+            self._merge_into(res, self._retired)
+            for _, stats in alive:
+                self._merge_into(res, stats)
+        return res
+
+    @staticmethod
+    def _merge_into(target, stats):
+        for key, rs in list(stats.items()):
+            if (t := target.get(key)) is None:
+                target[key] = t = RouteStats()
+            t.merge(rs)
+
+    def to_prometheus(self) -> str:
+        snapshot = sorted(self.snapshot().items())
+        lines = []
+
+        def header(name, type_, help_):
+            lines.append(f'# HELP {METRIC_PREFIX}{name} {help_}')
+            lines.append(f'# TYPE {METRIC_PREFIX}{name} {type_}')
+
+        header('http_requests_total', 'counter', 'Requests handled, by route and status class.')
+        for (method, route), rs in snapshot:
+            for status_class, count in sorted(rs.status.items()):
+                lines.append(f'{METRIC_PREFIX}http_requests_total{{method="{method}",route="{route}",status="{status_class}"}} {count}')
+
+        header('http_request_duration_seconds', 'histogram', 'Request latency, by route.')
+        for (method, route), rs in snapshot:
+            labels = f'method="{method}",route="{route}"'
+            cumulative = 0
+            for le, count in zip(LATENCY_BUCKETS + ('+Inf',), rs.buckets):
+                cumulative += count
+                lines.append(f'{METRIC_PREFIX}http_request_duration_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f'{METRIC_PREFIX}http_request_duration_seconds_sum{{{labels}}} {rs.latency_sum:.6f}')
+            lines.append(f'{METRIC_PREFIX}http_request_duration_seconds_count{{{labels}}} {rs.count}')
+
+        header('db_queries_total', 'counter', 'Database statements executed while handling requests, by route.')
+        for (method, route), rs in snapshot:
+            lines.append(f'{METRIC_PREFIX}db_queries_total{{method="{method}",route="{route}"}} {rs.db_queries}')
+
+        header('db_query_seconds_total', 'counter', 'Time spent in database statements while handling requests, by route.')
+        for (method, route), rs in snapshot:
+            lines.append(f'{METRIC_PREFIX}db_query_seconds_total{{method="{method}",route="{route}"}} {rs.db_time:.6f}')
+
+        for collector in self._collectors:
+            lines.extend(collector())
+        return '\n'.join(lines) + '\n'
+
+
+g_metrics = RequestMetrics()
@@ -4,9 +4,16 @@ import functools
 import logging
 import typing
 
-from bottle import request, response, HTTPError
+from bottle import request, response, HTTPError, HTTPResponse
 from nyutils.simple_validate import create_validator, ValidationError
-from .models import WebSession
+from nyutils.tracing import tracer
+from .models import WebSession, WebPermission
+from .admission import g_admission
+from .metrics import g_metrics
+from .profiling import g_profiling
+from .tokens import signed_tokens
+from .tracing import g_request_tracing
+from .transaction import g_transactions
 from .utils import UserError
 
 logger = logging.getLogger(__name__)
@@ -25,8 +32,10 @@ class JsonApiMiddleware:
                 response.status = 500
                 logger.error(
                     f"Unhandled exception in route {route.rule}: {e}", exc_info=True)
-                return {'success': 0, 'error': "InternalServerError"}
+                return {'success': 0, 'error': "InternalServerError", 'trace_id': tracer.current_id()}
             else:
+                if isinstance(result, HTTPResponse):
+                    return result  # non json payloads, e.g. metrics text
                 return {'success': 1, 'result': result}
 
         return wrapper
@@ -38,21 +47,22 @@ def param_schema(schema):
     def decorator(func):
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
-            if request.method == 'POST':
+            with tracer.span('param_schema'):
+                if request.method == 'POST':
+                    try:
+                        data = request.json
+                    except HTTPError:
+                        raise UserError("Invalid JSON format")
+                    if data is None:
+                        raise UserError("Request body cannot be empty")
+                elif request.method == 'GET':
+                    data = request.query
+                else:
+                    raise Exception(f"Unsupported method {request.method} for validation")
                 try:
-                    data = request.json
-                except HTTPError:
-                    raise UserError("Invalid JSON format")
-                if data is None:
-                    raise UserError("Request body cannot be empty")
-            elif request.method == 'GET':
-                data = request.query
-            else:
-                raise Exception(f"Unsupported method {request.method} for validation")
-            try:
-                validator(data, '')
-            except ValidationError as e:
-                raise UserError(str(e))
+                    validator(data, '')
+                except ValidationError as e:
+                    raise UserError(str(e))
             request.data = data
             return func(*args, **kwargs)
 
@@ -64,19 +74,27 @@ def param_schema(schema):
 def load_user(required_permission: typing.Iterable[int] | int | None = None, require_login: bool = True):
     if isinstance(required_permission, int):
         required_permission = required_permission,
+    required_mask = None if required_permission is None else WebPermission.mask(required_permission)
 
     def decorator(func):
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
-            request.session = session = None
-            if _session := request.cookies.get('session'):
-                try:
-                    request.session = session = WebSession.get_session(_session)
-                except Exception:
-                    ...
+            session = None
+            with tracer.span('load_user'):
+                if _session := request.cookies.get('session'):
+                    if (session := signed_tokens.authenticate(_session)) is None:
+                        try:
+                            session = WebSession.get_session(_session)
+                        except Exception:
+                            ...
+                        else:
+                            if claims := signed_tokens.verify(_session):
+                                signed_tokens.confirm(claims, session)
+            # bottle request attributes can only be assigned once
+            request.session = session
             if require_login and session is None:
                 raise UserError("No session configured")
-            if required_permission is not None and not (session and any(p in session.user.permissions for p in required_permission)):
+            if required_mask is not None and not (session and session.permission_mask & required_mask):
                 raise UserError('Permission denied')
             return func(*args, **kwargs)
 
@@ -85,6 +103,13 @@ def load_user(required_permission: typing.Iterable[int] | int | None = None, req
     return decorator
 
 
-def apply_middlewares(app):
+def apply_middlewares(app, compression=None):
+    app.install(g_request_tracing)  # outermost, everything below runs in the request's trace
+    app.install(g_metrics)  # sees the final status set by JsonApiMiddleware
+    app.install(g_admission)  # rejects before anything else runs, its 503 is not a json api result
+    app.install(g_profiling)  # wraps nothing unless a profiling session selects the route
+    if compression:
+        app.install(compression)  # needs the result dict of JsonApiMiddleware
     app.install(JsonApiMiddleware())
+    app.install(g_transactions)  # innermost, rolls back before JsonApiMiddleware turns an error into a response
     return app
@@ -0,0 +1,39 @@
+# schema steps of the server tables, run by nyutils.migrate.migrate() at startup
+from nyutils.database import use_database
+from nyutils.migrate import Migrations, add_column, execute
+from .models import WebUser, WebPermission
+
+migrations = Migrations('server')
+
+# the tables as of version 1, also the schema of databases created before versioning
+SCHEMA_V1 = (
+    'CREATE TABLE IF NOT EXISTS "server_sys_cfg" ("id" INTEGER NOT NULL PRIMARY KEY, "key" VARCHAR(255) NOT NULL, '
+    '"public" INTEGER NOT NULL, "data" TEXT NOT NULL)',
+    'CREATE UNIQUE INDEX IF NOT EXISTS "syscfg_key" ON "server_sys_cfg" ("key")',
+    'CREATE TABLE IF NOT EXISTS "server_web_user" ("id" INTEGER NOT NULL PRIMARY KEY, "username" VARCHAR(255) NOT NULL, '
+    '"password" VARCHAR(255) NOT NULL, "last_login" DATETIME, "allow_login" INTEGER NOT NULL, '
+    '"permissions" TEXT NOT NULL, "data" TEXT NOT NULL)',
+    'CREATE UNIQUE INDEX IF NOT EXISTS "webuser_username" ON "server_web_user" ("username")',
+    'CREATE TABLE IF NOT EXISTS "server_web_session" ("id" INTEGER NOT NULL PRIMARY KEY, "user_id" INTEGER NOT NULL, '
+    '"token" VARCHAR(255) NOT NULL, "unique_type" INTEGER NOT NULL, "created_at" DATETIME NOT NULL, '
+    '"valid_until" DATETIME, "data" TEXT NOT NULL, '
+    'FOREIGN KEY ("user_id") REFERENCES "server_web_user" ("id") ON DELETE CASCADE)',
+    'CREATE INDEX IF NOT EXISTS "websession_user_id" ON "server_web_session" ("user_id")',
+    'CREATE UNIQUE INDEX IF NOT EXISTS "websession_token" ON "server_web_session" ("token")',
+)
+
+
+@migrations.step(1)
+def create_tables():
+    execute(SCHEMA_V1)
+
+
+@migrations.step(2)
+def add_permission_mask():
+    add_column('server_web_user', 'permission_mask', 'INTEGER NOT NULL DEFAULT 0')
+    rows = WebUser.select(WebUser.id, WebUser.permissions).tuples()
+    use_database.executemany_sql(
+        'UPDATE "server_web_user" SET "permission_mask" = ? WHERE "id" = ?',
+        [(WebPermission.mask(permissions), user_id) for user_id, permissions in rows],
+    )
+    execute(('CREATE INDEX "webuser_permission_mask" ON "server_web_user" ("permission_mask")',))
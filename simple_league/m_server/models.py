@@ -11,10 +11,21 @@ from nyutils.password import validate_password
 from .utils import g_events, g_loop
 
 tbl_prefix = 'server_'
+_missing = object()
 logger = logging.getLogger(__name__)
 
 
+class CfgSnapshot(typing.NamedTuple):
+    values: dict
+    public: frozenset
+
+
 class SysCfg(BaseModel):
+    """
+    reads are served from an in-memory snapshot of the whole table, swapped as a whole on every write,
+    values returned are shared with the snapshot and must not be mutated
+    """
+
     class Meta:
         table_name = tbl_prefix + 'sys_cfg'
 
@@ -23,32 +34,109 @@ class SysCfg(BaseModel):
     public = peewee.BooleanField(default=False)
     data = DataField()
 
+    _snapshot: typing.ClassVar[CfgSnapshot | None] = None
+    _defaults: typing.ClassVar[dict] = {}
+    _write_lock = threading.Lock()
+
+    @classmethod
+    def reload(cls) -> CfgSnapshot:
+        rows = list(cls.select(cls.key, cls.public, cls.data))
+        cls._snapshot = snapshot = CfgSnapshot({r.key: r.data for r in rows}, frozenset(r.key for r in rows if r.public))
+        return snapshot
+
+    @classmethod
+    def snapshot(cls) -> CfgSnapshot:
+        return cls._snapshot or cls.reload()
+
     @classmethod
     def has_key(cls, k: str):
-        return cls.select().where(cls.key == k).exists()
+        return k in cls.snapshot().values
+
+    @classmethod
+    def register_defaults(cls, defaults: dict):
+        """
+        keys created with these values by create_defaults() at startup, admin/set_cfg only changes existing keys
+        """
+        cls._defaults.update(defaults)
+
+    @classmethod
+    def create_defaults(cls) -> list[str]:
+        """
+        insert the registered keys missing from the table, no server/cfg_change: readers saw the defaults already
+        """
+        with cls._write_lock:
+            if not (missing := [k for k in cls._defaults if k not in cls.snapshot().values]):
+                return []
+            cls.insert_many([{'key': k, 'data': cls._defaults[k], 'public': False} for k in missing]).on_conflict_ignore().execute()
+            cls.reload()
+        logger.info(f'Created configuration keys {missing}')
+        return missing
 
     @classmethod
     def get_value(cls, k: str, default=None, create=False):
-        if res := cls.get_or_none(key=k):
-            return res.data
+        if (res := cls.snapshot().values.get(k, _missing)) is not _missing:
+            return res
         elif create:
-            res = cls(key=k)
-            res.data = default
-            res.save()
+            cls.set_value(k, default)
         return default
 
     @classmethod
-    def set_value(cls, k: str, value, public: bool = None):
-        if (res := cls.get_or_none(key=k)) is None:
-            res = cls(key=k)
-        if res.data != value:
-            res.data = value
-            if public is not None:
-                res.public = public
-            res.save()
-            g_events.invoke('server/cfg_change', k, value)
+    def get_typed(cls, k: str, type_: type, default=None):
+        """
+        the value if it is an instance of type_, default otherwise
+        """
+        res = cls.snapshot().values.get(k, default)
+        if not isinstance(res, type_) or (type_ is int and isinstance(res, bool)):
+            return default
         return res
 
+    @classmethod
+    def get_bool(cls, k: str, default: bool = False) -> bool:
+        return cls.get_typed(k, bool, default)
+
+    @classmethod
+    def get_int(cls, k: str, default: int = 0) -> int:
+        return cls.get_typed(k, int, default)
+
+    @classmethod
+    def get_float(cls, k: str, default: float | None = 0.) -> float | None:
+        res = cls.get_typed(k, (int, float), _missing)
+        return default if res is _missing or isinstance(res, bool) else float(res)
+
+    @classmethod
+    def get_str(cls, k: str, default: str = '') -> str:
+        return cls.get_typed(k, str, default)
+
+    @classmethod
+    def public_values(cls) -> dict:
+        snapshot = cls.snapshot()
+        return {k: snapshot.values[k] for k in snapshot.public}
+
+    @classmethod
+    def set_value(cls, k: str, value, public: bool = None):
+        """
+        the snapshot and server/cfg_change follow once the write commits, nothing changes if it rolls back
+        """
+        snapshot = cls.snapshot()
+        if k in snapshot.values and snapshot.values[k] == value and (public is None or public == (k in snapshot.public)):
+            return value
+        update = [cls.data] if public is None else [cls.data, cls.public]
+        cls.insert(key=k, data=value, public=bool(public)).on_conflict(conflict_target=[cls.key], preserve=update).execute()
+        cls._meta.database.on_commit(lambda: cls._publish(k, value, public))
+        return value
+
+    @classmethod
+    def _publish(cls, k: str, value, public: bool | None):
+        with cls._write_lock:
+            snapshot = cls.snapshot()  # the current one, other keys may have been committed meanwhile
+            values = dict(snapshot.values)
+            values[k] = value
+            public_keys = snapshot.public
+            if public is not None and public != (k in public_keys):
+                public_keys = public_keys | {k} if public else public_keys - {k}
+            cls._snapshot = CfgSnapshot(values, public_keys)
+        g_events.invoke('server/cfg_change', k, value)
+
 
 class WebPermission(enum.IntEnum):
     NULL = 0
@@ -56,6 +144,13 @@ class WebPermission(enum.IntEnum):
     MANAGER = 2
     ADMIN = 3
 
+    @staticmethod
+    def mask(permissions: typing.Iterable[int]) -> int:
+        res = 0
+        for p in permissions:
+            res |= 1 << p
+        return res
+
 
 class WebUser(BaseModel):
     class Meta:
@@ -66,15 +161,40 @@ class WebUser(BaseModel):
     last_login = peewee.DateTimeField(null=True)
     allow_login = peewee.BooleanField(default=True)
     permissions = JsonField(default=[])
+    # WebPermission.mask(permissions), written by save(); bulk writes set both (permission_fields)
+    permission_mask = peewee.IntegerField(default=0, index=True, constraints=[peewee.SQL('DEFAULT 0')])
 
-    data = JsonField(default={}) # user custom data, e.g. nickname, avatar, email, etc. (not sensitive info)
+    data = JsonField(default={}, lazy=True) # user custom data, e.g. nickname, avatar, email, etc. (not sensitive info)
+
+    client_fields = ('username', 'permissions', 'last_login', 'allow_login')
 
     @property
     def display_name(self):
         return self.data.get('nickname', self.username)
 
+    def save(self, *args, **kwargs):
+        self.permission_mask = WebPermission.mask(self.permissions)
+        return super().save(*args, **kwargs)
+
+    @classmethod
+    def permission_fields(cls, permissions: list[int]) -> dict:
+        return {cls.permissions: permissions, cls.permission_mask: WebPermission.mask(permissions)}
+
+    @classmethod
+    def with_permission(cls, permissions: typing.Iterable[int] | int) -> peewee.Expression:
+        """
+        users having any of permissions: the distinct masks are read from the index and matched with IN,
+        a bitwise AND in the query could not use it
+        """
+        required = WebPermission.mask([permissions] if isinstance(permissions, int) else permissions)
+        masks = [m for m, in cls.select(cls.permission_mask).distinct().tuples() if m & required]
+        return cls.permission_mask.in_(masks)
+
     @classmethod
     def try_login(cls, username: str, password: str) -> 'WebUser | None':
+        """
+        the user if the password matches, read outside any transaction; the caller writes record_login() in its own
+        """
         user = cls.get_or_none(cls.username == username)
         if not user:
             return None  # user not found
@@ -91,10 +211,12 @@ class WebUser(BaseModel):
             logger.error(
                 f"server error: invalid password hash format for user {username}: {user.password!r}", exc_info=True)
             return None
-        user.last_login = datetime.datetime.now()
-        user.save()
         return user
 
+    def record_login(self):
+        self.last_login = datetime.datetime.now()
+        self.save(only=[WebUser.last_login])
+
     def to_client(self):
         return {
             "username": self.username,
@@ -114,10 +236,15 @@ class WebSession(BaseModel):
     unique_type = peewee.IntegerField()
     created_at = peewee.DateTimeField()
     valid_until = peewee.DateTimeField(null=True)
-    data = DataField(default={})
+    data = DataField(default={}, lazy=True)
 
     @classmethod
-    def create_session(cls, user: WebUser, unique_type: int = 0, valid_duration: datetime.timedelta | None = datetime.timedelta(days=30), data=None) -> 'WebSession':
+    def create_session(cls, user: WebUser, unique_type: int = 0, valid_duration: datetime.timedelta | None = datetime.timedelta(days=30), data=None,
+                       token_factory: typing.Callable[['WebSession'], str | None] | None = None) -> 'WebSession':
+        """
+        token_factory is called with the inserted session and may return a token derived from it (e.g. a signed token),
+        returning None keeps the random token.
+        """
         if unique_type:
             for session in WebSession.select().where(WebSession.user == user, WebSession.unique_type == unique_type):
                 session.destroy()
@@ -128,7 +255,12 @@ class WebSession(BaseModel):
         t_pre = now.strftime('%Y%m%d-%H%M%S-')
         while True:
             try:
-                return WebSession.create(user=user, token=t_pre + str(uuid.uuid4()), unique_type=unique_type, created_at=now, valid_until=valid_until, data=data or {})
+                with use_database.atomic():
+                    session = WebSession.create(user=user, token=t_pre + str(uuid.uuid4()), unique_type=unique_type, created_at=now, valid_until=valid_until, data=data or {})
+                    if token_factory and (token := token_factory(session)):
+                        session.token = token
+                        session.save()
+                return session
             except peewee.IntegrityError:
                 # If the token already exists, generate a new one
                 ...
@@ -154,6 +286,10 @@ class WebSession(BaseModel):
         self.valid_until = datetime.datetime.now() + valid_duration
         self.save()
 
+    @property
+    def permission_mask(self):
+        return self.user.permission_mask
+
     def destroy(self):
         token = self.token
         self.delete_instance()
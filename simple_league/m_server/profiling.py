@@ -0,0 +1,72 @@
+# on demand cpu and memory profiling of the running server, see nyutils.profiling and admin_profile for the routes
+import logging
+
+from nyutils.profiling import Profiler, MemoryTracker
+
+from .metrics import g_metrics, METRIC_PREFIX
+from .tokens import signed_tokens
+from .utils import g_loop, g_events, g_query_cache
+
+logger = logging.getLogger(__name__)
+
+
+class ProfilerPlugin:
+    """
+    bottle plugin running the routes a deterministic session of g_profiler selects under cProfile. routes are
+    wrapped only while such a session runs (the apps are reset when it starts and ends), otherwise apply returns
+    the callback as is and profiling costs nothing. installed inside admission control, so time spent queued is
+    not profiled
+    """
+    name = 'profiler'
+    api = 2
+
+    def __init__(self, profiler: Profiler):
+        self.profiler = profiler
+        self.apps = []
+        self._hooked = False
+        profiler.on_change = self.reset
+
+    def setup(self, app):
+        self.apps.append(app)
+        if not self._hooked:
+            g_metrics.add_collector(self.collect)
+            self._hooked = True
+
+    def reset(self):
+        for app in self.apps:
+            app.reset()  # plugins are applied again on the next request of every route
+
+    def apply(self, callback, route):
+        if not (self.profiler.matches(route.rule) or self.profiler.matches(f'{route.method} {route.rule}')):
+            return callback
+        profiler = self.profiler
+
+        def wrapper(*args, **kwargs):
+            return profiler.call(callback, *args, **kwargs)
+
+        return wrapper
+
+    def collect(self):
+        session = self.profiler.session
+        yield f'# TYPE {METRIC_PREFIX}profiling_active gauge'
+        yield f'{METRIC_PREFIX}profiling_active {int(session is not None)}'
+        yield f'# TYPE {METRIC_PREFIX}tracemalloc_traced_bytes gauge'
+        yield f'{METRIC_PREFIX}tracemalloc_traced_bytes {g_memory.status()["traced_bytes"]}'
+
+
+def _listeners():
+    return sum(len(handlers) for handlers in g_events.listeners.values())
+
+
+g_profiler = Profiler('profiles')
+g_memory = MemoryTracker({
+    'events.listeners': _listeners,
+    'events.handles': lambda: len(g_events.handle2key),
+    'loop.events': lambda: len(g_loop._events_by_id),
+    'tokens.revoked': lambda: len(signed_tokens.revoked),
+    'tokens.confirmed': lambda: len(signed_tokens.confirmed),
+    'tokens.permission_changes': lambda: len(signed_tokens.permission_changes),
+    'query_cache.entries': lambda: g_query_cache.stats()['entries'],
+    'query_cache.bytes': lambda: g_query_cache.bytes,
+})  # admin_profile adds the push hub's, push imports the middlewares
+g_profiling = ProfilerPlugin(g_profiler)
@@ -0,0 +1,243 @@
+# server-sent events fed by g_events, clients subscribe instead of polling ping/current_user/public_cfg
+import collections
+import itertools
+import json
+import logging
+import threading
+
+from bottle import request, HTTPResponse
+
+from .api import api
+from .middleware import load_user
+from .models import WebPermission, SysCfg
+from .utils import g_events, g_loop, UserError
+
+logger = logging.getLogger(__name__)
+ADMIN_MASK = WebPermission.mask([WebPermission.ADMIN])
+DEFAULT_TOPICS = ('cfg',)
+MAX_TOPICS = 32
+MAX_PER_USER = 8
+# open streams per server mode (Server.serve sets it): every stream holds its connection's handler until the client
+# leaves, a whole thread under 'threaded' and the only one under 'wsgiref', only a greenlet under 'gevent'
+MAX_STREAMS = {'wsgiref': 0, 'threaded': 64, 'gevent': None}
+# league events forwarded to the topic 'league/<league_id>', with the name of their second argument
+LEAGUE_EVENTS = {
+    'league/result': 'match',
+    'league/standings_change': 'teams',
+    'league/fixture_start': 'fixtures',
+    'league/fixture_close': 'fixtures',
+}
+
+
+class Subscriber:
+    """
+    one connected client: its topics and a bounded queue of encoded events, no thread of its own
+    """
+    __slots__ = ('user_id', 'token', 'is_admin', 'topics', 'queue', 'wakeup', 'overflow', 'active', 'closed')
+
+    def __init__(self, user_id, token, is_admin, topics, buffer):
+        self.user_id = user_id
+        self.token = token
+        self.is_admin = is_admin
+        self.topics = topics
+        self.queue = collections.deque(maxlen=buffer)
+        self.wakeup = threading.Event()
+        self.overflow = False  # events were dropped, the client should refetch its state
+        self.active = False  # sent something since the last heartbeat tick
+        self.closed = False
+
+    def push(self, chunk: bytes):
+        if len(self.queue) == self.queue.maxlen:
+            self.overflow = True
+        self.queue.append(chunk)
+        self.wakeup.set()
+
+    def close(self):
+        self.closed = True
+        self.wakeup.set()
+
+
+class StreamsFull(Exception):
+    pass
+
+
+class PushHub:
+    """
+    fans events out to subscribers by topic, every event is encoded once whatever the number of receivers.
+    a single g_loop timer sends the heartbeats, only to subscribers that were idle since the previous tick.
+    at most max_streams subscribers (None for no limit), 0 until the server sets its mode's
+    """
+
+    def __init__(self, buffer=32, heartbeat=15., max_streams: int | None = 0):
+        self.buffer = buffer
+        self.heartbeat = heartbeat
+        self.max_streams = max_streams
+        self.streams = 0
+        self.lock = threading.Lock()
+        self.topics: dict[str, set[Subscriber]] = {}
+        self.by_user: dict[int, set[Subscriber]] = {}
+        self.by_token: dict[str, set[Subscriber]] = {}
+        self.event_ids = itertools.count(1)
+        self._heartbeat_handle = None
+
+    def __len__(self):
+        return sum(len(subs) for subs in self.by_user.values())
+
+    def subscribe(self, session, topics) -> Subscriber:
+        sub = Subscriber(session.user_id, session.token, bool(session.permission_mask & ADMIN_MASK), frozenset(topics), self.buffer)
+        with self.lock:
+            if self.max_streams is not None and self.streams >= self.max_streams:
+                raise StreamsFull()
+            if len(user_subs := self.by_user.setdefault(sub.user_id, set())) >= MAX_PER_USER:
+                raise UserError(f"At most {MAX_PER_USER} event streams per user")
+            user_subs.add(sub)
+            self.streams += 1
+            self.by_token.setdefault(sub.token, set()).add(sub)
+            for topic in sub.topics:
+                self.topics.setdefault(topic, set()).add(sub)
+            if self._heartbeat_handle is None:
+                self._heartbeat_handle = g_loop.create_event(self.tick, delay=self.heartbeat, repeat=True)
+        return sub
+
+    def unsubscribe(self, sub: Subscriber):
+        sub.closed = True
+        with self.lock:
+            if sub not in self.by_user.get(sub.user_id, ()):
+                return
+            self.streams -= 1
+            for topic in sub.topics:
+                if (subs := self.topics.get(topic)) is not None:
+                    subs.discard(sub)
+                    if not subs:
+                        del self.topics[topic]
+            if (subs := self.by_user.get(sub.user_id)) is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self.by_user[sub.user_id]
+            if (subs := self.by_token.get(sub.token)) is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self.by_token[sub.token]
+
+    def encode(self, event: str, data) -> bytes:
+        return f'id: {next(self.event_ids)}\nevent: {event}\ndata: {json.dumps(data)}\n\n'.encode('utf-8')
+
+    def publish(self, topic: str, event: str, data, accept=None):
+        with self.lock:
+            subs = list(self.topics.get(topic, ()))
+        if not subs:
+            return
+        chunk = self.encode(event, data)
+        for sub in subs:
+            if accept is None or accept(sub):
+                sub.push(chunk)
+
+    def publish_user(self, user_id: int, event: str, data, accept=None):
+        with self.lock:
+            subs = list(self.by_user.get(user_id, ()))
+        if not subs:
+            return
+        chunk = self.encode(event, data)
+        for sub in subs:
+            if accept is None or accept(sub):
+                sub.push(chunk)
+
+    def tick(self):
+        with self.lock:
+            subs = [sub for user_subs in self.by_user.values() for sub in user_subs]
+        for sub in subs:
+            if not sub.active:
+                sub.push(b': heartbeat\n\n')
+            sub.active = False
+
+    def stream(self, sub: Subscriber):
+        try:
+            yield b'retry: 3000\n\n'
+            while True:
+                sub.wakeup.wait(self.heartbeat * 2)
+                sub.wakeup.clear()
+                if sub.overflow:
+                    sub.overflow = False
+                    yield self.encode('overflow', {})
+                chunks = []
+                while sub.queue:
+                    chunks.append(sub.queue.popleft())
+                if chunks:
+                    sub.active = True
+                    yield b''.join(chunks)
+                if sub.closed:
+                    return
+        finally:
+            self.unsubscribe(sub)
+
+
+push_hub = PushHub()
+
+
+@g_events.set('server/cfg_change')
+def on_cfg_change(key, value, *_):
+    # values of private keys only go to admins, and only as a notice
+    if key in SysCfg.snapshot().public:
+        push_hub.publish('cfg', 'cfg_change', {'key': key, 'value': value})
+    else:
+        push_hub.publish('cfg', 'cfg_change', {'key': key}, accept=lambda sub: sub.is_admin)
+
+
+@g_events.set('server/session_drop')
+def on_session_drop(token, *_):
+    with push_hub.lock:
+        subs = list(push_hub.by_token.get(token, ()))
+    if subs:
+        chunk = push_hub.encode('session_drop', {})
+        for sub in subs:
+            sub.push(chunk)
+            sub.close()
+
+
+@g_events.set('server/user_permission_change')
+def on_user_permission_change(user_id, permissions, *_):
+    push_hub.publish_user(user_id, 'permission_change', {'permissions': permissions})
+
+
+def _forward_league_event(event, arg_name):
+    @g_events.set(event)
+    def forward(league_id, value=None, *_):
+        push_hub.publish(f'league/{league_id}', event.split('/', 1)[1], {'league': league_id, arg_name: value})
+
+
+for _event, _arg_name in LEAGUE_EVENTS.items():
+    _forward_league_event(_event, _arg_name)
+
+
+def _parse_topics(value: str | None) -> set[str]:
+    topics = set(DEFAULT_TOPICS) if value is None else {t.strip() for t in value.split(',') if t.strip()}
+    if len(topics) > MAX_TOPICS:
+        raise UserError(f"At most {MAX_TOPICS} topics")
+    for topic in topics:
+        kind, _, arg = topic.partition('/')
+        if not (topic == 'cfg' or (kind == 'league' and arg.isdigit())):
+            raise UserError(f"Unknown topic '{topic}'", 'topics')
+    return topics
+
+
+@api.get('/events')
+@load_user()
+def events():
+    """
+    text/event-stream of the topics in ?topics= (comma separated: cfg, league/<id>), session_drop and
+    permission_change of the own user are always sent. an overflow event means events were dropped.
+    a stream occupies its handler for its lifetime: the gevent server takes any number, the threaded one
+    MAX_STREAMS['threaded'] and wsgiref none; beyond that it is answered 503, clients fall back to polling
+    """
+    try:
+        sub = push_hub.subscribe(request.session, _parse_topics(request.query.get('topics')))
+    except StreamsFull:
+        return HTTPResponse(json.dumps({'success': 0, 'error': 'StreamsUnavailable'}), status=503, headers={
+            'Content-Type': 'application/json',
+            **({'Retry-After': '30'} if push_hub.max_streams else {}),
+        })
+    return HTTPResponse(push_hub.stream(sub), headers={
+        'Content-Type': 'text/event-stream; charset=utf-8',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
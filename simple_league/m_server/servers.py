@@ -0,0 +1,167 @@
+# wsgi servers for Server.serve besides bottle's default single threaded wsgiref
+import logging
+import socketserver
+import time
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, make_server
+
+from bottle import ServerAdapter
+from nyutils.database import use_database
+from nyutils.green import is_patched
+from .metrics import g_metrics, METRIC_PREFIX
+
+logger = logging.getLogger(__name__)
+ACCEPTED_KEY = 'simple_league.accepted'  # environ, time.perf_counter() the server accepted the connection
+
+
+class StartupTimer:
+    """
+    time from process start to the first accepted request, in phases; logged once and exported with the metrics
+    """
+
+    def __init__(self, started: float | None = None):
+        self.started = self._last = started or time.perf_counter()
+        self.phases: dict[str, float] = {}
+        g_metrics.add_collector(self.collect)
+
+    def mark(self, phase: str):
+        now = time.perf_counter()
+        self.phases[phase] = now - self._last
+        self._last = now
+
+    @property
+    def total(self):
+        return self._last - self.started
+
+    def wrap(self, app):
+        pending = True
+
+        def first_request(environ, start_response):
+            nonlocal pending
+            if pending:
+                pending = False
+                self.mark('first_request')
+                logger.info(f'First request accepted {self.total * 1000:.0f}ms after start ('
+                            + ', '.join(f'{k} {v * 1000:.0f}ms' for k, v in self.phases.items()) + ')')
+            return app(environ, start_response)
+
+        return first_request
+
+    def collect(self):
+        yield f'# TYPE {METRIC_PREFIX}startup_seconds gauge'
+        for phase, elapsed in list(self.phases.items()):
+            yield f'{METRIC_PREFIX}startup_seconds{{phase="{phase}"}} {elapsed:.6f}'
+
+
+class ReleaseConnection:
+    """
+    wsgi middleware handing the request's database connection back to the pool as soon as the handler returns,
+    so an event stream does not hold one for its lifetime; a streamed body that queries again (exports) takes
+    a connection on demand and gives it back when the body is closed
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def release(self):
+        if not use_database.is_closed():
+            use_database.close()
+
+    def __call__(self, environ, start_response):
+        try:
+            body = self.app(environ, start_response)
+        finally:
+            self.release()
+        return _ClosingBody(body, self.release)
+
+
+class _ClosingBody:
+    def __init__(self, body, on_close):
+        self.body = body
+        self.on_close = on_close
+
+    def __iter__(self):
+        return iter(self.body)
+
+    def close(self):
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+        finally:
+            self.on_close()
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        logger.debug(f'{self.client_address[0]} {format % args}')
+
+    def get_environ(self):
+        environ = super().get_environ()
+        environ[ACCEPTED_KEY] = self.server.accepted.pop(self.request, None) or time.perf_counter()
+        return environ
+
+
+class ThreadingServer(ServerAdapter):
+    """
+    wsgiref with a thread per connection
+    """
+
+    def run(self, app):
+        class Server(socketserver.ThreadingMixIn, WSGIServer):
+            daemon_threads = True
+            request_queue_size = 1024
+            accepted = {}  # socket -> accept time, the handler thread may only start much later
+
+            def process_request(self, request, client_address):
+                self.accepted[request] = time.perf_counter()
+                super().process_request(request, client_address)
+
+            def shutdown_request(self, request):
+                self.accepted.pop(request, None)
+                super().shutdown_request(request)
+
+        srv = make_server(self.host, self.port, app, Server, _QuietHandler)
+        logger.info(f'Threaded server listening on {self.host}:{self.port}')
+        srv.serve_forever()
+
+
+class GeventServer(ServerAdapter):
+    """
+    gevent's pywsgi, a greenlet per connection; the process must call nyutils.green.patch() before importing anything else
+    """
+
+    def run(self, app):
+        if not is_patched():
+            raise RuntimeError('gevent server needs nyutils.green.patch() before any other import')
+        from gevent.pywsgi import WSGIServer as GeventWSGIServer, WSGIHandler
+
+        class Handler(WSGIHandler):
+            accepted = None
+
+            def get_environ(self):
+                environ = super().get_environ()
+                # later requests of a kept alive connection count from when they are read
+                environ[ACCEPTED_KEY] = self.accepted or time.perf_counter()
+                self.accepted = None
+                return environ
+
+        class Server(GeventWSGIServer):
+            handler_class = Handler
+
+            def do_handle(self, *args):
+                # stamped in the accept loop, the connection's greenlet may wait long to be run
+                super().do_handle(*args, time.perf_counter())
+
+            def handle(self, sock, address, accepted=None):
+                handler = self.handler_class(sock, address, self)
+                handler.accepted = accepted
+                handler.handle()
+
+        logger.info(f'Gevent server listening on {self.host}:{self.port}')
+        Server((self.host, self.port), app, backlog=1024, log=None, error_log=logger).serve_forever()
+
+
+SERVERS = {
+    'wsgiref': 'wsgiref',
+    'threaded': ThreadingServer,
+    'gevent': GeventServer,
+}
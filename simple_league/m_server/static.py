@@ -0,0 +1,157 @@
+# in-memory index of a static directory, serves small files from memory with validators and gzip variants
+import dataclasses
+import email.utils
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import pathlib
+import shutil
+import threading
+
+from bottle import HTTPResponse, request, static_file, parse_date
+
+from .compression import accepts_gzip, etag_matches
+
+logger = logging.getLogger(__name__)
+
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'application/xml', 'image/svg+xml', 'application/wasm')
+
+
+@dataclasses.dataclass
+class StaticEntry:
+    rel_path: str
+    path: pathlib.Path
+    size: int
+    mtime_ns: int
+    mimetype: str
+    etag: str
+    last_modified: str
+    body: bytes | None = None  # None for files streamed from disk
+    gz_body: bytes | None = None
+    gz_path: pathlib.Path | None = None  # precompressed sibling of a large file
+
+    @property
+    def gz_etag(self):
+        return self.etag[:-1] + '-gz"'
+
+
+class StaticIndex:
+    def __init__(self, root, memory_limit=512 * 1024, gzip_min_size=1024, gzip_level=9):
+        self.root = pathlib.Path(root).resolve()
+        self.memory_limit = memory_limit
+        self.gzip_min_size = gzip_min_size
+        self.gzip_level = gzip_level
+        self.entries: dict[str, StaticEntry] = {}
+        self.lock = threading.Lock()
+
+    def _load(self, path: pathlib.Path, st: os.stat_result) -> StaticEntry:
+        rel = path.relative_to(self.root).as_posix()
+        mimetype, encoding = mimetypes.guess_type(path.name)
+        mimetype = mimetype or 'application/octet-stream'
+        if mimetype.startswith('text/') or mimetype == 'application/javascript':
+            mimetype += '; charset=UTF-8'
+        entry = StaticEntry(
+            rel, path, st.st_size, st.st_mtime_ns, mimetype,
+            etag=f'"{st.st_size:x}-{st.st_mtime_ns:x}"',
+            last_modified=email.utils.formatdate(st.st_mtime, usegmt=True),
+        )
+        compressible = encoding is None and mimetype.startswith(COMPRESSIBLE_TYPES)
+        if st.st_size <= self.memory_limit:
+            entry.body = body = path.read_bytes()
+            entry.etag = f'"{hashlib.sha1(body).hexdigest()}"'
+            if compressible and len(body) >= self.gzip_min_size:
+                gz = gzip.compress(body, self.gzip_level, mtime=0)
+                if len(gz) < len(body):
+                    entry.gz_body = gz
+        elif compressible and st.st_size >= self.gzip_min_size:
+            entry.gz_path = self._gz_sibling(path, st)
+        return entry
+
+    def _gz_sibling(self, path: pathlib.Path, st: os.stat_result) -> pathlib.Path | None:
+        """
+        the .gz next to a large file, written (again) when it is missing or older than the file.
+        None if it does not save anything or the directory is not writable
+        """
+        gz_path = path.with_name(path.name + '.gz')
+        try:
+            if gz_path.is_file() and gz_path.stat().st_mtime_ns >= st.st_mtime_ns:
+                return gz_path
+            tmp_path = path.with_name(f'.{path.name}.gz.tmp')
+            try:
+                with open(path, 'rb') as f_in, open(tmp_path, 'wb') as f_raw:
+                    with gzip.GzipFile(fileobj=f_raw, mode='wb', compresslevel=self.gzip_level, mtime=0) as f_out:
+                        shutil.copyfileobj(f_in, f_out, 1024 * 1024)
+                if tmp_path.stat().st_size >= st.st_size:
+                    return None
+                os.replace(tmp_path, gz_path)
+            finally:
+                tmp_path.unlink(missing_ok=True)
+            logger.debug(f'Compressed static file {path} to {gz_path}')
+            return gz_path
+        except OSError as e:
+            logger.warning(f'Failed to write {gz_path}, {path} is served uncompressed: {e}')
+            return None
+
+    def refresh(self):
+        """
+        rescan the directory, only files whose size or mtime changed are read again.
+        compressible files over memory_limit get a .gz sibling, written here when it is missing or stale
+        """
+        with self.lock:
+            old = self.entries
+            entries = {}
+            loaded = 0
+            for dir_path, _, file_names in os.walk(self.root):
+                for name in file_names:
+                    path = pathlib.Path(dir_path) / name
+                    try:
+                        st = path.stat()
+                        rel = path.relative_to(self.root).as_posix()
+                        if (entry := old.get(rel)) is None or entry.size != st.st_size or entry.mtime_ns != st.st_mtime_ns:
+                            entry = self._load(path, st)
+                            loaded += 1
+                        entries[rel] = entry
+                    except OSError as e:
+                        logger.warning(f'Failed to index static file {path}: {e}')
+            self.entries = entries
+        if loaded or len(entries) != len(old):
+            logger.debug(f'Indexed {len(entries)} static files at {self.root}, {sum(len(e.body) for e in entries.values() if e.body)} bytes in memory')
+        return self
+
+    def get(self, rel_path: str) -> StaticEntry | None:
+        return self.entries.get(rel_path.lstrip('/'))
+
+    @staticmethod
+    def _not_modified(entry: StaticEntry, etag: str):
+        if (inm := request.environ.get('HTTP_IF_NONE_MATCH')) is not None:
+            return etag_matches(inm, etag)
+        if (ims := request.environ.get('HTTP_IF_MODIFIED_SINCE')) is not None:
+            ims = parse_date(ims.split(';')[0].strip())
+            return ims is not None and ims >= entry.mtime_ns // 1_000_000_000
+        return False
+
+    def serve(self, entry: StaticEntry, cache_control: str | None = None):
+        gzip_ok = accepts_gzip(request.environ.get('HTTP_ACCEPT_ENCODING', ''))
+        if entry.body is None and not (gzip_ok and entry.gz_path):
+            # large file, bottle streams it from disk (and handles ranges)
+            res = static_file(entry.rel_path, root=self.root)
+            if cache_control:
+                res.set_header('Cache-Control', cache_control)
+            return res
+        use_gz = gzip_ok and (entry.gz_body is not None or entry.body is None)
+        headers = {'ETag': entry.gz_etag if use_gz else entry.etag, 'Last-Modified': entry.last_modified, 'Vary': 'Accept-Encoding'}
+        if cache_control:
+            headers['Cache-Control'] = cache_control
+        if self._not_modified(entry, headers['ETag']):
+            return HTTPResponse(status=304, headers=headers)
+        headers['Content-Type'] = entry.mimetype
+        if use_gz:
+            headers['Content-Encoding'] = 'gzip'
+        if entry.body is None:
+            headers['Content-Length'] = str(entry.gz_path.stat().st_size)
+            return HTTPResponse(open(entry.gz_path, 'rb') if request.method != 'HEAD' else b'', headers=headers)
+        body = entry.gz_body if use_gz else entry.body
+        headers['Content-Length'] = str(len(body))
+        return HTTPResponse(body if request.method != 'HEAD' else b'', headers=headers)
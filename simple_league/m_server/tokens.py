@@ -0,0 +1,216 @@
+# stateless signed session tokens
+#
+# token format: s1.<session id>.<user id>.<permission mask>.<expire>.<nonce>.<signature>
+# the WebSession table stays the source of truth, a signed token only lets load_user skip the lookup while
+# it is known to be valid: revocations and permission changes are tracked in memory and tokens issued
+# before the process started are confirmed against the database once before being trusted.
+import base64
+import datetime
+import hashlib
+import heapq
+import hmac
+import itertools
+import logging
+import os
+import threading
+import time
+import typing
+
+from .models import SysCfg, WebSession, WebUser, WebPermission
+from .utils import g_events
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PREFIX = 's1.'
+CFG_ENABLED = 'session/signed_token'
+CFG_KEY = 'session/signing_key'
+# signed tokens never outlive this, a longer session falls back to the database lookup after it
+SIGNED_TOKEN_MAX_AGE = datetime.timedelta(days=30)
+
+
+class TokenClaims(typing.NamedTuple):
+    session_id: int
+    user_id: int
+    permission_mask: int
+    expire: int
+    nonce: str
+    signature: str
+
+
+class ExpiringMap:
+    """
+    dict whose entries are dropped once their expiration time passed, reads are lock free
+    """
+
+    def __init__(self):
+        self._data = {}
+        self._heap = []
+        self.lock = threading.Lock()
+
+    def set(self, key, value, expire_at: float):
+        with self.lock:
+            self._purge(time.time())
+            self._data[key] = value
+            heapq.heappush(self._heap, (expire_at, key))
+
+    def get(self, key, default=None):
+        return self._data.get(key, default)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def _purge(self, now):
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            _, key = heapq.heappop(heap)
+            self._data.pop(key, None)
+
+    def purge(self):
+        with self.lock:
+            self._purge(time.time())
+
+
+def _b64(data: bytes):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+class SignedSession:
+    """
+    request.session stand-in built from a trusted token, the user is only loaded when a handler asks for it
+    """
+
+    def __init__(self, token: str, claims: TokenClaims):
+        self.token = token
+        self.claims = claims
+        self._user = None
+
+    @property
+    def id(self):
+        return self.claims.session_id
+
+    @property
+    def permission_mask(self):
+        return self.claims.permission_mask
+
+    @property
+    def user_id(self):
+        return self.claims.user_id
+
+    @property
+    def user(self) -> WebUser:
+        if self._user is None:
+            self._user = WebUser.get_by_id(self.claims.user_id)
+        return self._user
+
+    def destroy(self):
+        WebSession.destroy_session(self.token)
+
+
+class SignedTokens:
+    def __init__(self):
+        self._key = None
+        self._boot_id = os.urandom(3).hex()
+        self._serial = itertools.count()
+        self.revoked = ExpiringMap()  # signature -> True
+        self.confirmed = ExpiringMap()  # signature -> True, tokens from a previous process checked against the database
+        self.permission_changes = ExpiringMap()  # user id -> current permission mask
+
+    def _load_key(self):
+        if (key := SysCfg.get_str(CFG_KEY, None)) is None:
+            key = os.urandom(32).hex()
+            SysCfg.set_value(CFG_KEY, key, public=False)
+        self._key = bytes.fromhex(key)
+
+    def reset(self):
+        self._key = None
+
+    @property
+    def enabled(self) -> bool:
+        return SysCfg.get_bool(CFG_ENABLED)
+
+    @property
+    def key(self) -> bytes:
+        if self._key is None:
+            self._load_key()
+        return self._key
+
+    def _sign(self, payload: str):
+        return _b64(hmac.new(self.key, payload.encode('ascii'), hashlib.sha256).digest()[:16])
+
+    def make_token(self, session: WebSession) -> str | None:
+        expire = datetime.datetime.now() + SIGNED_TOKEN_MAX_AGE
+        if session.valid_until and session.valid_until < expire:
+            expire = session.valid_until
+        nonce = f'{self._boot_id}{next(self._serial):x}'
+        payload = f'{session.id}.{session.user_id}.{session.user.permission_mask}.{int(expire.timestamp())}.{nonce}'
+        return f'{TOKEN_PREFIX}{payload}.{self._sign(payload)}'
+
+    def create_session(self, user: WebUser, **kwargs) -> WebSession:
+        if self.enabled:
+            kwargs['token_factory'] = self.make_token
+        return WebSession.create_session(user, **kwargs)
+
+    @staticmethod
+    def parse(token: str) -> TokenClaims | None:
+        if not token.startswith(TOKEN_PREFIX):
+            return None
+        try:
+            sid, uid, mask, expire, nonce, signature = token[len(TOKEN_PREFIX):].split('.')
+            return TokenClaims(int(sid), int(uid), int(mask), int(expire), nonce, signature)
+        except ValueError:
+            return None
+
+    def verify(self, token: str) -> TokenClaims | None:
+        """
+        check the signature and expiration, does not mean the session was not revoked
+        """
+        if (claims := self.parse(token)) is None or claims.expire <= time.time():
+            return None
+        payload = token[len(TOKEN_PREFIX):token.rindex('.')]
+        if not hmac.compare_digest(self._sign(payload), claims.signature):
+            return None
+        return claims
+
+    def is_trusted(self, claims: TokenClaims) -> bool:
+        if claims.signature in self.revoked:
+            return False
+        if self.permission_changes.get(claims.user_id, claims.permission_mask) != claims.permission_mask:
+            return False
+        return claims.nonce.startswith(self._boot_id) or claims.signature in self.confirmed
+
+    def confirm(self, claims: TokenClaims, session: WebSession):
+        if session.permission_mask == claims.permission_mask:
+            self.confirmed.set(claims.signature, True, claims.expire)
+
+    def authenticate(self, token: str) -> SignedSession | None:
+        if self.enabled and (claims := self.verify(token)) and self.is_trusted(claims):
+            return SignedSession(token, claims)
+        return None
+
+    def revoke(self, token: str):
+        if claims := self.parse(token):
+            self.revoked.set(claims.signature, True, claims.expire)
+
+
+signed_tokens = SignedTokens()
+SysCfg.register_defaults({CFG_ENABLED: False})
+
+
+@g_events.set('server/cfg_change')
+def on_cfg_change(key, *_):
+    if key == CFG_KEY:
+        signed_tokens.reset()
+
+
+@g_events.set('server/session_drop')
+def on_session_drop(token, *_):
+    signed_tokens.revoke(token)
+
+
+@g_events.set('server/user_permission_change')
+def on_user_permission_change(user_id, permissions, *_):
+    expire_at = time.time() + SIGNED_TOKEN_MAX_AGE.total_seconds()
+    signed_tokens.permission_changes.set(user_id, WebPermission.mask(permissions), expire_at)
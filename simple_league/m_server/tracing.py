@@ -0,0 +1,50 @@
+# a trace per request, see nyutils.tracing; tracer.enable() turns on recording its spans
+from bottle import request, response, HTTPResponse
+from nyutils.tracing import tracer
+
+from .metrics import g_metrics, METRIC_PREFIX
+
+
+class RequestTracing:
+    """
+    bottle plugin, outermost: the request runs in a trace named after its route, so its log records carry the
+    trace id, and the trace is written with the status when sampled or slow
+    """
+    name = 'request_tracing'
+    api = 2
+
+    def __init__(self):
+        self._hooked = False
+
+    def setup(self, app):
+        if not self._hooked:
+            g_metrics.add_collector(self.collect)
+            self._hooked = True
+
+    def apply(self, callback, route):
+        rule = route.rule.lstrip('/')
+        method = route.method
+
+        def wrapper(*args, **kwargs):
+            trace = tracer.start(f'{method} {request.script_name}{rule}')
+            status = 500
+            try:
+                result = callback(*args, **kwargs)
+                status = result.status_code if isinstance(result, HTTPResponse) else response.status_code
+                return result
+            except HTTPResponse as e:
+                status = e.status_code
+                raise
+            finally:
+                tracer.finish(trace, status=status)
+
+        return wrapper
+
+    def collect(self):
+        stats = tracer.stats()
+        yield f'# TYPE {METRIC_PREFIX}traces_total counter'
+        for result in ('written', 'dropped'):
+            yield f'{METRIC_PREFIX}traces_total{{result="{result}"}} {stats[result]}'
+
+
+g_request_tracing = RequestTracing()
@@ -0,0 +1,105 @@
+# request scoped transactions: a mutating route commits once, after its handler, or not at all
+import contextlib
+import itertools
+import logging
+import threading
+import time
+
+import peewee
+from bottle import request
+from nyutils.database import use_database, write_lock
+
+from .metrics import g_metrics, METRIC_PREFIX
+
+logger = logging.getLogger(__name__)
+MUTATING = frozenset(('POST', 'PUT', 'PATCH', 'DELETE'))
+MODES = ('immediate',)
+
+
+def is_busy(e: Exception) -> bool:
+    return isinstance(e, peewee.OperationalError) and ('locked' in str(e) or 'busy' in str(e))
+
+
+def _reset_request():
+    # bottle request attributes can only be assigned once, the handler assigns them again when it is run again
+    for key in [k for k in request.environ if k.startswith('bottle.request.ext.')]:
+        del request.environ[key]
+
+
+@contextlib.contextmanager
+def write_transaction():
+    """
+    BEGIN IMMEDIATE under write_lock, as the default mode runs a handler; for transaction=False routes that do slow
+    work (password hashing) first and only then write. a DEFERRED transaction reading before it writes gets
+    SQLITE_BUSY at once when another connection writes meanwhile, sqlite's busy handler is not even tried
+    """
+    with write_lock, use_database.atomic('IMMEDIATE'):
+        yield
+
+
+class TransactionPlugin:
+    """
+    bottle plugin running each mutating route in one use_database.atomic(); installed innermost, so any error
+    of the handler (UserError included) rolls back all it wrote. the route option transaction= picks the mode:
+      'immediate', default of POST/PUT/PATCH/DELETE: BEGIN IMMEDIATE under write_lock, writers of this process
+        queue on the lock instead of running into SQLITE_BUSY
+      False: no transaction, the handler manages its own; for POST routes that only read (listings, admin
+        toggles of in-memory state), which would otherwise queue every writer behind them, and for handlers doing
+        slow work before their writes, which they run in write_transaction()
+    a busy database (another process writing) rolls the transaction back and runs the handler again
+    the connection itself comes from the thread, or from the pool when enabled (released by servers.ReleaseConnection)
+    """
+    name = 'transaction'
+    api = 2
+
+    def __init__(self, retries=3, backoff=.01):
+        self.retries = retries
+        self.backoff = backoff
+        self.lock = threading.Lock()
+        self.stats = {'commit': 0, 'rollback': 0, 'retry': 0}
+        self._hooked = False
+
+    def setup(self, app):
+        if not self._hooked:
+            g_metrics.add_collector(self.collect)
+            self._hooked = True
+
+    def _count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    def apply(self, callback, route):
+        mode = route.config.get('transaction', 'immediate' if route.method in MUTATING else False)
+        if not mode:
+            return callback
+        if mode not in MODES:
+            raise ValueError(f"Unknown transaction mode '{mode}' of route {route.rule}")
+
+        def wrapper(*args, **kwargs):
+            for attempt in itertools.count():
+                try:
+                    with write_transaction():
+                        result = callback(*args, **kwargs)
+                except Exception as e:
+                    self._count('rollback')
+                    if not is_busy(e) or attempt >= self.retries:
+                        raise
+                    self._count('retry')
+                    logger.debug(f'Database busy in {route.method} {route.rule}, retrying ({attempt + 1}/{self.retries})')
+                    _reset_request()
+                    time.sleep(self.backoff * 2 ** attempt)
+                else:
+                    self._count('commit')
+                    return result
+
+        return wrapper
+
+    def collect(self):
+        with self.lock:
+            stats = dict(self.stats)
+        yield f'# TYPE {METRIC_PREFIX}request_transactions_total counter'
+        for k, v in stats.items():
+            yield f'{METRIC_PREFIX}request_transactions_total{{result="{k}"}} {v}'
+
+
+g_transactions = TransactionPlugin()
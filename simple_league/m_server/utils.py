@@ -1,11 +1,17 @@
 import pathlib
 import typing
 
+from nyutils.database import use_database
 from nyutils.eventloop import EventLoop
 from nyutils.listener import Listener
-
-g_loop = EventLoop()
-g_events = Listener()
+from nyutils.query_cache import QueryCache
+from nyutils.query_log import QueryLog
+
+# callbacks and async listeners run outside requests, nothing else would give their pooled connection back
+g_loop = EventLoop(context=use_database.released)
+g_events = Listener(context=use_database.released)
+g_query_log = QueryLog(use_database)
+g_query_cache = QueryCache(use_database)
 STATIC_DIR = pathlib.Path.cwd() / "static"
 
 
@@ -17,11 +23,22 @@ def page_view_req_schema(query_type=typing.Optional[dict[str, typing.Any]]):
     }
 
 
-def page_view_res(selector, args):
-    return {
-        'total': selector.count(),
-        'data': [item.to_client() for item in selector.paginate(args['page'], args['page_size'])]
-    }
+def page_view_res(selector, args, cached=False):
+    """
+    cached: serve repeated listings from g_query_cache until a table the selector reads changes
+    """
+    # only the columns to_client needs
+    selector = selector.model.select_client_fields(selector)
+
+    def compute():
+        return {
+            'total': selector.count(),
+            'data': [item.to_client() for item in selector.paginate(args['page'], args['page_size'])]
+        }
+
+    if cached:
+        return g_query_cache.get(selector, compute, args['page'], args['page_size'])
+    return compute()
 
 
 class UserError(Exception):
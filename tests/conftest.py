@@ -0,0 +1,97 @@
+import io
+import json
+import sys
+
+import pytest
+
+from nyutils.database import init_database, use_database
+from nyutils.migrate import migrate
+from nyutils.password import make_password
+from simple_league.m_server import Server
+from simple_league.m_server.models import SysCfg, WebUser, WebPermission
+
+PASSWORD = 'test-password'
+
+
+class Client:
+    """
+    calls a wsgi app in process, json bodies in and out. headers are those of the last response
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.headers = {}
+
+    def request(self, method, path, body=None, token=None, headers=None):
+        path, _, query = path.partition('?')
+        data = json.dumps(body).encode() if body is not None else b''
+        environ = {
+            'REQUEST_METHOD': method,
+            'PATH_INFO': path,
+            'QUERY_STRING': query,
+            'SERVER_NAME': 'test',
+            'SERVER_PORT': '80',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'REMOTE_ADDR': '127.0.0.1',
+            'CONTENT_TYPE': 'application/json',
+            'CONTENT_LENGTH': str(len(data)),
+            'wsgi.input': io.BytesIO(data),
+            'wsgi.errors': sys.stderr,
+            'wsgi.url_scheme': 'http',
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+            'wsgi.version': (1, 0),
+        }
+        if token:
+            environ['HTTP_COOKIE'] = f'session={token}'
+        for k, v in (headers or {}).items():
+            environ['HTTP_' + k.upper().replace('-', '_')] = v
+        status = []
+        res = b''.join(self.app(environ, lambda s, h, exc_info=None: status.append((s, dict(h)))))
+        self.headers = status[0][1]
+        return int(status[0][0].split(' ', 1)[0]), res
+
+    def post(self, path, body=None, token=None):
+        status, res = self.request('POST', '/api/server' + path, {} if body is None else body, token)
+        return status, json.loads(res)
+
+    def get(self, path, token=None):
+        status, res = self.request('GET', '/api/server' + path, token=token)
+        return status, json.loads(res)
+
+    def login(self, username, password=PASSWORD) -> str:
+        status, res = self.post('/login', {'username': username, 'password': password})
+        assert status == 200, res
+        return res['result']
+
+
+@pytest.fixture(scope='session')
+def client():
+    return Client(Server().app)  # once, the routes of simple_league.m_server.api are module globals
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    init_database(str(tmp_path / 'main.db'))
+    migrate()
+    SysCfg.reload()
+    SysCfg.create_defaults()
+    yield use_database
+    use_database.close()
+
+
+def add_users(n, prefix='user', permissions=(WebPermission.USER,)):
+    password = make_password(PASSWORD)
+    WebUser.insert_many([
+        {'username': f'{prefix}{i}', 'password': password, 'permissions': list(permissions),
+         'permission_mask': WebPermission.mask(permissions), 'data': {}}
+        for i in range(n)
+    ]).execute()
+
+
+@pytest.fixture
+def admin_token(db, client):
+    add_users(1, 'admin', (WebPermission.USER, WebPermission.MANAGER, WebPermission.ADMIN))
+    return client.login('admin0')
@@ -0,0 +1,72 @@
+import concurrent.futures
+import threading
+import time
+
+import pytest
+from bottle import Bottle
+
+from simple_league.m_server.admission import AdmissionControl, Limiter
+
+from conftest import Client
+
+
+def test_limiter():
+    limiter = Limiter('test', limit=2, queue=1, timeout=.05, max_delay=.1)
+    assert limiter.acquire() and limiter.acquire()
+    assert not limiter.acquire()  # waits in the queue, no slot frees up
+    assert limiter.timed_out == 1
+
+    waiter = concurrent.futures.ThreadPoolExecutor(1).submit(Limiter.acquire, limiter)
+    while not limiter.waiting:
+        time.sleep(.001)
+    assert not limiter.acquire()  # the queue is full
+    limiter.release()
+    assert waiter.result() is True
+    assert (limiter.in_flight, limiter.admitted, limiter.rejected) == (2, 3, 1)
+
+    limiter.release()
+    assert not limiter.acquire(time.perf_counter() - 1)  # accepted too long ago
+    assert limiter.acquire(time.perf_counter())
+    assert limiter.late == 1
+
+
+def test_plugin_sheds_with_503():
+    app = Bottle()
+    admission = AdmissionControl({'expensive': (2, 1)}, timeout=5)
+    app.install(admission)
+    gate, entered = threading.Event(), threading.Semaphore(0)
+
+    @app.post('/slow', admission='expensive')
+    def slow():
+        entered.release()
+        gate.wait(5)
+        return 'ok'
+
+    @app.get('/admin/status')
+    def status():
+        return 'ok'
+
+    client = Client(app)
+    with concurrent.futures.ThreadPoolExecutor(4) as pool:
+        running = [pool.submit(client.request, 'POST', '/slow') for _ in range(2)]
+        for _ in running:
+            assert entered.acquire(timeout=5)
+        running.append(pool.submit(client.request, 'POST', '/slow'))
+        while not admission.limiters['expensive'].waiting:
+            time.sleep(.001)
+        assert client.request('POST', '/slow') == (503, b'{"success": 0, "error": "Overloaded"}')
+        assert client.headers['Retry-After'] == '1'
+        assert client.request('GET', '/admin/status') == (200, b'ok')  # critical routes are not limited
+        gate.set()
+        assert [f.result() for f in running] == [(200, b'ok')] * 3
+    limiter = admission.limiters['expensive']
+    assert (limiter.in_flight, limiter.admitted, limiter.rejected) == (0, 3, 1)
+    assert 'critical' not in admission.limiters
+
+
+def test_unknown_class():
+    app = Bottle()
+    app.install(AdmissionControl())
+    app.get('/x', admission='nope')(lambda: 'x')
+    with pytest.raises(ValueError):
+        app.routes[0].call  # the plugins are applied on first use
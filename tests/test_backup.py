@@ -0,0 +1,25 @@
+import gzip
+import sqlite3
+
+from peewee import SqliteDatabase
+
+from nyutils import backup
+from nyutils.backup import OnlineBackup
+
+
+def test_backup_pauses_between_steps(tmp_path, monkeypatch):
+    path = tmp_path / 'main.db'
+    with sqlite3.connect(path) as conn:
+        conn.execute('CREATE TABLE t (x TEXT)')
+        conn.executemany('INSERT INTO t VALUES (?)', [('x' * 1000,) for _ in range(200)])
+    conn.close()
+    sleeps = []
+    monkeypatch.setattr(backup.time, 'sleep', sleeps.append)
+
+    b = OnlineBackup(SqliteDatabase(str(path)), tmp_path / 'backup', pages_per_step=10, step_sleep=.05, keep=1)
+    gz_path = b.run()
+    assert gz_path is not None, b.last_error
+    pages = sqlite3.connect(path).execute('PRAGMA page_count').fetchone()[0]
+    assert sleeps == [.05] * (-(-pages // 10) - 1)  # between the steps, none after the last
+    (tmp_path / 'restored.db').write_bytes(gzip.decompress(gz_path.read_bytes()))
+    assert sqlite3.connect(tmp_path / 'restored.db').execute('SELECT count(*) FROM t').fetchone() == (200,)
@@ -0,0 +1,58 @@
+import gzip
+
+import pytest
+from bottle import Bottle
+
+from simple_league.m_server.compression import CompressionPlugin, accepts_gzip, etag_matches
+
+from conftest import Client
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('gzip', True),
+    ('deflate, gzip;q=0.5', True),
+    ('GZIP ; q=1.0', True),
+    ('*', True),
+    ('', False),
+    ('deflate, br', False),
+    ('gzip;q=0', False),
+    ('gzip;q=x', False),
+    ('*;q=1, gzip;q=0', False),
+    ('gzip;q=0.1, *;q=0', True),
+    ('*;q=0, br', False),
+    ('gzip;level=1;q=0', False),
+])
+def test_accepts_gzip(header, expected):
+    assert accepts_gzip(header) is expected
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('"abc"', True),
+    ('W/"abc"', True),
+    ('"x", "abc"', True),
+    ('*', True),
+    ('"abcd"', False),
+    ('W/"abcd", "ab"', False),
+    ('"a,bc"', False),
+    ('', False),
+])
+def test_etag_matches(header, expected):
+    assert etag_matches(header, '"abc"') is expected
+
+
+def test_plugin():
+    app = Bottle()
+    app.install(CompressionPlugin(min_size=10))
+
+    @app.get('/data')
+    def data():
+        return {'items': list(range(100))}
+
+    client = Client(app)
+    status, plain = client.request('GET', '/data', headers={'Accept-Encoding': '*;q=1, gzip;q=0'})
+    assert status == 200 and plain.startswith(b'{')
+    status, gz = client.request('GET', '/data', headers={'Accept-Encoding': 'gzip'})
+    assert status == 200 and gzip.decompress(gz) == plain
+    etag = client.headers['Etag']
+    assert client.request('GET', '/data', headers={'Accept-Encoding': 'gzip', 'If-None-Match': f'"x", {etag}'})[0] == 304
+    assert client.request('GET', '/data', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag[:-1] + 'f"'})[0] == 200
@@ -0,0 +1,88 @@
+import itertools
+import random
+
+import pytest
+
+from simple_league.m_league.fixtures import round_robin, swiss_pairings, _pair_key
+
+
+def rematches(pairs, played):
+    return sum(_pair_key(a, b) in played for a, b in pairs)
+
+
+def can_avoid_rematches(teams, played):
+    if not teams:
+        return True
+    a, rest = teams[0], teams[1:]
+    return any(can_avoid_rematches([t for t in rest if t != b], played) for b in rest if _pair_key(a, b) not in played)
+
+
+@pytest.mark.parametrize('n', [2, 5, 8, 11])
+def test_round_robin(n):
+    rounds = round_robin(list(range(n)), double=True)
+    assert len(rounds) == 2 * (n - 1 + n % 2)
+    for pairs in rounds:
+        teams = [t for pair in pairs for t in pair if t is not None]
+        assert sorted(teams) == list(range(n))
+    legs = [pair for pairs in rounds for pair in pairs if None not in pair]
+    assert sorted(legs) == sorted(itertools.permutations(range(n), 2))  # every team hosts every other once
+
+
+def test_swiss_first_round():
+    assert swiss_pairings([list(range(8))], set()) == ([(0, 4), (5, 1), (2, 6), (7, 3)], None)
+    # the bottom of an odd group floats to the top of the next, the last team without a bye gets it
+    assert swiss_pairings([[0, 1, 2], [3, 4, 5, 6]], set(), had_bye={6}) == ([(0, 1), (3, 2), (4, 6)], 5)
+
+
+def test_swiss_avoids_rematch_across_groups():
+    # splitting each score group in halves leaves 1 and 2 (played) or rematches across the groups,
+    # 3-5, 2-4 and 0-1 (or 1-3, 4-5 and 0-2) is a full pairing without any
+    groups = [[3, 4, 5], [0, 1, 2]]
+    played = {(0, 3), (0, 4), (0, 5), (1, 2), (1, 4), (1, 5), (2, 3), (2, 5), (3, 4)}
+    pairs, bye = swiss_pairings(groups, played)
+    assert bye is None
+    assert sorted(t for pair in pairs for t in pair) == list(range(6))
+    assert rematches(pairs, played) == 0
+
+
+def test_swiss_unavoidable_rematch():
+    played = set(itertools.combinations(range(4), 2)) - {(0, 1)}
+    pairs, _ = swiss_pairings([[0, 1, 2, 3]], played)
+    assert sorted(t for pair in pairs for t in pair) == list(range(4))
+    assert rematches(pairs, played) == 1
+
+
+@pytest.mark.parametrize('n', [6, 8, 10])
+def test_swiss_seasons(n):
+    """
+    random results over a full season: no rematch whenever some pairing of the round avoids them
+    """
+    rnd = random.Random(n)
+    for _ in range(30):
+        points, played, byes = dict.fromkeys(range(n), 0), set(), set()
+        for _ in range(n - 1):
+            ranked = sorted(points, key=lambda t: (-points[t], t))
+            groups = [list(g) for _, g in itertools.groupby(ranked, key=points.get)]
+            pairs, _ = swiss_pairings(groups, played, byes)
+            assert sorted(t for pair in pairs for t in pair) == list(range(n))
+            if can_avoid_rematches(ranked, played):
+                assert rematches(pairs, played) == 0, (groups, played)
+            for a, b in pairs:
+                played.add(_pair_key(a, b))
+                r = rnd.random()
+                points[a] += 3 if r < .45 else 1 if r < .55 else 0
+                points[b] += 3 if r > .55 else 1 if r > .45 else 0
+
+
+def test_swiss_large_round():
+    """
+    above DENSE_LIMIT the pairs start from windows around the ideal opponents
+    """
+    n = 600
+    rnd = random.Random(0)
+    played = {_pair_key(i, j) for i in range(n) for j in rnd.sample(range(n), 6) if i != j}
+    groups = [list(range(i, min(i + 37, n))) for i in range(0, n, 37)]
+    pairs, bye = swiss_pairings(groups, played)
+    assert bye is None
+    assert sorted(t for pair in pairs for t in pair) == list(range(n))
+    assert rematches(pairs, played) == 0
@@ -0,0 +1,62 @@
+import itertools
+import random
+
+import pytest
+
+from nyutils.matching import max_weight_matching
+
+
+def best(n, edges, max_cardinality):
+    """
+    (pairs, weight) of the best matching, by trying them all
+    """
+    weight = {}
+    for i, j, w in edges:
+        weight[i, j] = weight[j, i] = w
+
+    def rec(free):
+        if not free:
+            return 0, 0
+        v, rest = free[0], free[1:]
+        res = [rec(rest)]
+        for u in rest:
+            if (v, u) in weight:
+                pairs, w = rec([x for x in rest if x != u])
+                res.append((pairs + 1, w + weight[v, u]))
+        return max(res, key=lambda r: r if max_cardinality else (r[1], r[0]))
+
+    return rec(list(range(n)))
+
+
+def score(edges, mate):
+    weight = {(i, j): w for i, j, w in edges}
+    weight.update({(j, i): w for i, j, w in edges})
+    assert all(mate[j] == i for i, j in enumerate(mate) if j >= 0)
+    pairs = [(i, j) for i, j in enumerate(mate) if i < j]
+    return len(pairs), sum(weight[p] for p in pairs)
+
+
+@pytest.mark.parametrize('max_cardinality', [False, True])
+def test_against_brute_force(max_cardinality):
+    rnd = random.Random(0)
+    for _ in range(500):
+        n = rnd.randint(2, 8)
+        edges = [(i, j, rnd.choice([rnd.randint(-5, 20), 10])) for i, j in itertools.combinations(range(n), 2) if rnd.random() < .6]
+        if not edges:
+            continue
+        rnd.shuffle(edges)
+        mate = max_weight_matching(edges, max_cardinality)
+        n = len(mate)
+        expected = best(n, edges, max_cardinality)
+        got = score(edges, mate)
+        if max_cardinality:
+            assert got == expected, edges
+        else:
+            assert got[1] == expected[1], edges
+
+
+def test_blossom():
+    # an odd cycle 0-1-2 with a tail on each side, only a matching through the blossom pairs everyone
+    edges = [(0, 1, 5), (1, 2, 5), (2, 0, 5), (0, 3, 1), (2, 4, 1), (4, 5, 1)]
+    assert score(edges, max_weight_matching(edges, max_cardinality=True)) == (3, 7)
+
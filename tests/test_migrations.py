@@ -0,0 +1,65 @@
+import sqlite3
+
+import pytest
+
+from nyutils.database import init_database, use_database
+from nyutils.migrate import migrate, versions
+import simple_league.m_server  # noqa: F401, registers the server and league steps
+from simple_league.m_server.migrations import SCHEMA_V1
+from simple_league.m_server.models import WebUser, WebPermission
+
+
+def schema(path) -> dict:
+    """
+    {table or index: its columns} of a database file
+    """
+    with sqlite3.connect(path) as c:
+        res = {}
+        for kind, name, table in c.execute("SELECT type, name, tbl_name FROM sqlite_master WHERE sql IS NOT NULL"):
+            pragma = 'table_info' if kind == 'table' else 'index_info'
+            res[name] = (kind, table, [r[-1] if kind == 'index' else r[1:4] for r in c.execute(f'PRAGMA {pragma}("{name}")')])
+        return res
+
+
+def baseline(path, permissions=((1,), (1, 2, 3))):
+    """
+    a database created by the code before versioning: the v1 server tables and a few users
+    """
+    with sqlite3.connect(path) as c:
+        for sql in SCHEMA_V1:
+            c.execute(sql)
+        c.executemany('INSERT INTO "server_web_user" ("username", "password", "allow_login", "permissions", "data") '
+                      'VALUES (?, \'x\', 1, ?, \'{}\')', [(f'u{i}', str(list(p))) for i, p in enumerate(permissions)])
+    return path
+
+
+@pytest.fixture
+def database(tmp_path):
+    def open_(path):
+        init_database(str(path))
+        return use_database
+
+    yield open_
+    use_database.close()
+
+
+def test_fresh_database(tmp_path, database):
+    database(tmp_path / 'fresh.db')
+    migrate()
+    assert versions()['server'] == 2
+    assert schema(tmp_path / 'fresh.db')['webuser_permission_mask'] == ('index', 'server_web_user', ['permission_mask'])
+
+
+def test_baseline_database(tmp_path, database):
+    database(tmp_path / 'fresh.db')
+    migrate()
+    use_database.close()
+    path = baseline(tmp_path / 'baseline.db')
+    database(path)
+    assert migrate()['server'] == (0, 2)
+    assert use_database.execute_sql('PRAGMA integrity_check').fetchall() == [('ok',)]
+    masks = {u.username: u.permission_mask for u in WebUser.select()}
+    assert masks == {'u0': WebPermission.mask([1]), 'u1': WebPermission.mask([1, 2, 3])}
+    assert schema(path) == schema(tmp_path / 'fresh.db')
+    assert WebUser.select().where(WebUser.with_permission(2)).count() == 1
+
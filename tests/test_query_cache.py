@@ -0,0 +1,84 @@
+import threading
+
+from nyutils.query_cache import QueryCache
+from simple_league.m_server.models import WebUser, WebSession
+
+from conftest import add_users
+
+
+def cached(cache, query):
+    """
+    (the first column of the rows, whether they were computed)
+    """
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return [row[0] for row in query.clone().tuples()]  # a peewee query keeps its first result
+
+    return cache.get(query, compute), bool(calls)
+
+
+def test_invalidation(db):
+    cache = QueryCache(db)
+    add_users(3)
+    query = WebUser.select(WebUser.username).order_by(WebUser.id)
+    assert cached(cache, query) == (['user0', 'user1', 'user2'], True)
+    assert cached(cache, query) == (['user0', 'user1', 'user2'], False)
+
+    WebUser.create(username='new', password='x', permissions=[], data={})
+    assert cached(cache, query) == (['user0', 'user1', 'user2', 'new'], True)
+    WebUser.update(username='renamed').where(WebUser.username == 'new').execute()
+    assert cached(cache, query)[0][-1] == 'renamed'
+    db.execute_sql('DELETE FROM "server_web_user" WHERE "username" = ?', ('renamed',))
+    assert cached(cache, query) == (['user0', 'user1', 'user2'], True)
+    assert cache.stats()['stale'] == 3
+
+    # other tables leave the entry alone, those cascading from the user table do not
+    sessions = WebSession.select(WebSession.user)
+    assert cached(cache, sessions) == ([], True)
+    user = WebUser.get(WebUser.username == 'user0')
+    WebSession.create_session(user)
+    assert cached(cache, query)[1] is False
+    assert cached(cache, sessions) == ([user.id], True)
+    user.delete_instance()
+    assert cached(cache, sessions) == ([], True)
+
+
+def test_transactions(db):
+    cache = QueryCache(db)
+    add_users(2)
+    query = WebUser.select(WebUser.username).order_by(WebUser.id)
+    with db.atomic():
+        WebUser.create(username='pending', password='x', permissions=[], data={})
+        assert cached(cache, query) == (['user0', 'user1', 'pending'], True)
+        assert cached(cache, query)[1] is True  # uncommitted writes are not stored
+        # another connection does not see the insert yet and stores its result, stale once this one commits
+        other = []
+        thread = threading.Thread(target=lambda: (other.append(cached(cache, query)), db.close()))
+        thread.start()
+        thread.join()
+        assert other == [(['user0', 'user1'], True)]
+    assert cached(cache, query) == (['user0', 'user1', 'pending'], True)
+    assert cached(cache, query)[1] is False
+
+
+def test_list_users_sees_new_users(client, admin_token):
+    def usernames():
+        status, res = client.post('/admin/list_users', {'page': 1, 'page_size': 50, 'query': None}, admin_token)
+        assert status == 200, res
+        return [u['username'] for u in res['result']['data']]
+
+    assert usernames() == ['admin0']
+    assert client.post('/register', {'username': 'new', 'password': 'pw', 'data': {}})[0] == 200
+    assert usernames() == ['admin0', 'new']
+
+
+def test_memory_limit(db):
+    add_users(20)
+    cache = QueryCache(db, max_bytes=8000, max_entry_bytes=4000)
+    for i in range(20):
+        cached(cache, WebUser.select(WebUser.username).where(WebUser.id > i))
+    stats = cache.stats()
+    assert stats['bytes'] <= 8000 and stats['evictions'] > 0
+    assert cached(cache, WebUser.select(WebUser.username).where(WebUser.id > 19))[1] is False  # the most recent stays
@@ -0,0 +1,53 @@
+import re
+
+import pytest
+
+from nyutils.regex import PatternError, analyze, patterns, regexp_filter
+from simple_league.m_server.models import WebUser
+
+STRINGS = [
+    'alice', 'Alice', 'ALICE_smith', 'bob', 'bobby', 'bo', 'carol.jones', 'carol-jones', 'dave99', 'dave', '',
+    'Kelvin', 'kelvin', '\u212aelvin', 'straße', 'STRASSE', 'ſam', 'sam', 'İstanbul', 'istanbul', 'a\nb', 'x' * 40,
+    'abcabc', 'aXbXc', 'user_1', 'user_12', 'émile', 'Émile',
+]
+PATTERNS = [
+    'alice', '^alice', '^Al', 'ice$', 'bob+y?', '^bo(b|bby)$', 'carol[.-]jones', r'\d+', r'^dave\d*$', '(?i)alice',
+    '(?i)kelvin', '(?i)^k', '(?i)SAM', '(?i)istanbul', 'straße|strasse', '(?i)STRASSE', '^a$', '(?m)^b', 'a.b',
+    '(?s)a.b', 'x{40}', '(abc){2}', 'a(X|Y)b', '(?:user)_1', 'user_1$', '(?i)émile', '^$', '', 'a*', '(?i:ALICE)_smith',
+    '[^a-z]', 'z?alice', '(al|bo)b?',
+]
+
+
+def test_analyze():
+    info = analyze('^user_(a|b)+-tail')
+    assert info.prefix == 'user_' and info.literals == ['-tail']
+    assert sorted(analyze('foo(bar)?baz').literals) == ['baz', 'foo']
+    assert analyze('(?i)Kelvin').literals == ['elv', 'n'] and analyze('(?i)Kelvin').prefix == ''
+    assert analyze('(?m)^abc').prefix == ''
+    for pattern in ('(a+)+', r'(\w*x)*', 'a{1001}', '(', 'x' * 600):
+        with pytest.raises(PatternError):
+            analyze(pattern)
+    assert analyze('(ab){3}').literals == ['ab']
+
+
+def test_cache_keeps_errors():
+    patterns.clear()
+    misses, hits = patterns.misses, patterns.hits
+    for _ in range(2):
+        with pytest.raises(PatternError):
+            patterns.get('(a+)+')
+    assert (patterns.misses - misses, patterns.hits - hits) == (1, 0)  # the second get is the last pattern, it skips the lru
+    assert patterns.get('abc') is patterns.get('abc')
+
+
+def test_prefilter_matches_python(db):
+    WebUser.insert_many([{'username': s or 'empty', 'password': 'x', 'permissions': [], 'data': {'name': s}} for s in STRINGS]).execute()
+    names = [u.username for u in WebUser.select()]
+    for pattern in PATTERNS:
+        expected = sorted(n for n in names if re.search(pattern, n))
+        got = sorted(u.username for u in WebUser.select().where(regexp_filter(WebUser.username, pattern)))
+        assert got == expected, pattern
+        # json field, the literals are checked against its encoded text
+        got = sorted(u.username for u in WebUser.select().where(regexp_filter(WebUser.data, pattern)))
+        expected = sorted(u.username for u in WebUser.select() if re.search(pattern, WebUser.data.db_value(u.data)))
+        assert got == expected, pattern
@@ -0,0 +1,45 @@
+import peewee
+import pytest
+
+from simple_league.m_league import League, Standing, record_result, delete_result
+from simple_league.m_server.utils import g_events
+
+
+@pytest.fixture
+def events():
+    seen = []
+    handles = [g_events.set(event, lambda *args, event=event: seen.append((event, args)))
+               for event in ('league/result', 'league/standings_change')]
+    yield seen
+    for handle in handles:
+        g_events.remove(handle)
+
+
+@pytest.fixture
+def league(db):
+    league = League.create(name='test')
+    return league, league.add_team('a'), league.add_team('b')
+
+
+def test_events_follow_the_commit(db, events, league):
+    league, a, b = league
+    assert events == [('league/standings_change', (league.id, [a.id])), ('league/standings_change', (league.id, [b.id]))]
+    events.clear()
+    with db.atomic():
+        match = record_result(league, a, b, 2, 1)
+        assert events == []  # the outer transaction is still open
+    assert events == [('league/result', (league.id, match.id)), ('league/standings_change', (league.id, [a.id, b.id]))]
+    events.clear()
+    delete_result(match)
+    assert events == [('league/standings_change', (league.id, None))]
+
+
+def test_no_events_on_rollback(db, league, events):
+    league, a, b = league
+    events.clear()
+    with pytest.raises(peewee.IntegrityError):
+        with db.atomic():
+            record_result(league, a, b, 2, 1)
+            league.add_team('a')  # duplicate name
+    assert events == []
+    assert Standing.get(Standing.team == a).played == 0
@@ -0,0 +1,35 @@
+import gzip
+import os
+
+from bottle import Bottle
+
+from simple_league.m_server.static import StaticIndex
+
+from conftest import Client
+
+
+def test_large_files_get_a_gz_sibling(tmp_path):
+    big = ''.join(f'console.log({i});\n' for i in range(20000)).encode()
+    (tmp_path / 'app.js').write_bytes(big)
+    (tmp_path / 'small.js').write_bytes(big[:4096])
+    (tmp_path / 'blob.bin').write_bytes(os.urandom(len(big)))
+    index = StaticIndex(tmp_path, memory_limit=64 * 1024).refresh()
+    assert index.get('app.js').body is None
+    assert gzip.decompress((tmp_path / 'app.js.gz').read_bytes()) == big
+    assert not (tmp_path / 'small.js.gz').exists() and not (tmp_path / 'blob.bin.gz').exists()
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['app.js', 'app.js.gz', 'blob.bin', 'small.js']
+
+    app = Bottle()
+    app.get('/<path:path>')(lambda path: index.serve(index.get(path)))
+    client = Client(app)
+    status, body = client.request('GET', '/app.js', headers={'Accept-Encoding': 'gzip'})
+    assert status == 200 and client.headers['Content-Encoding'] == 'gzip' and gzip.decompress(body) == big
+    status, body = client.request('GET', '/app.js')
+    assert status == 200 and body == big
+
+    # a changed file gets its sibling written again
+    (tmp_path / 'app.js').write_bytes(big * 2)
+    st = (tmp_path / 'app.js').stat()
+    os.utime(tmp_path / 'app.js.gz', ns=(st.st_atime_ns, st.st_mtime_ns - 1))
+    index.refresh()
+    assert gzip.decompress((tmp_path / 'app.js.gz').read_bytes()) == big * 2
@@ -0,0 +1,61 @@
+import pytest
+
+from simple_league.m_server import tokens
+from simple_league.m_server.models import SysCfg, WebUser, WebPermission
+from simple_league.m_server.tokens import signed_tokens, CFG_ENABLED, CFG_KEY
+
+from conftest import add_users
+
+
+@pytest.fixture
+def signed(db):
+    signed_tokens.reset()  # the key of the previous test's database
+    SysCfg.set_value(CFG_ENABLED, True)
+    yield signed_tokens
+    signed_tokens.reset()
+
+
+def test_sign_and_verify(signed, client):
+    add_users(1)
+    token = client.login('user0')
+    assert token.startswith(tokens.TOKEN_PREFIX)
+    claims = signed.verify(token)
+    assert claims.user_id == WebUser.get(WebUser.username == 'user0').id
+    assert claims.permission_mask == WebPermission.mask([WebPermission.USER])
+    assert signed.authenticate(token).user.username == 'user0'
+
+    head, signature = token.rsplit('.', 1)
+    assert signed.verify(head + '.' + signature[::-1]) is None
+    sid, uid, mask, *rest = head[len(tokens.TOKEN_PREFIX):].split('.')
+    assert signed.verify('.'.join([tokens.TOKEN_PREFIX + sid, uid, str(int(mask) | 0xff), *rest, signature])) is None
+    assert signed.verify('s1.garbage') is None and signed.verify('not-signed') is None
+
+    SysCfg.set_value(CFG_KEY, 'ab' * 32, public=False)  # a new key invalidates every token
+    assert signed.verify(token) is None
+
+
+def test_expiry(signed, client, monkeypatch):
+    add_users(1)
+    token = client.login('user0')
+    expire = signed.verify(token).expire
+    monkeypatch.setattr(tokens.time, 'time', lambda: expire)
+    assert signed.verify(token) is None
+
+
+def test_logout_revokes(signed, client):
+    add_users(1)
+    token = client.login('user0')
+    assert client.get('/current_user', token)[0] == 200
+    assert client.post('/logout', token=token)[0] == 200
+    assert signed.authenticate(token) is None
+    assert client.get('/current_user', token)[0] == 400
+
+
+def test_permission_change_distrusts_token(signed, client, admin_token):
+    add_users(1)
+    token = client.login('user0')
+    assert signed.authenticate(token) is not None
+    status, _ = client.post('/admin/set_user_permission', {'username': 'user0', 'permissions': [WebPermission.USER, WebPermission.MANAGER]}, admin_token)
+    assert status == 200
+    assert signed.authenticate(token) is None  # the request falls back to the session row, with the new permissions
+    assert client.get('/current_user', token)[0] == 200
@@ -0,0 +1,50 @@
+import concurrent.futures
+import json
+
+import peewee
+from bottle import Bottle
+
+from simple_league.m_server.models import WebUser, WebSession
+from simple_league.m_server.transaction import TransactionPlugin
+
+from conftest import Client, add_users, PASSWORD
+
+
+def test_concurrent_logins(db, client):
+    add_users(50)
+
+    def login(i):
+        return client.post('/login', {'username': f'user{i % 50}', 'password': PASSWORD})[0]
+
+    with concurrent.futures.ThreadPoolExecutor(8) as pool:
+        statuses = list(pool.map(login, range(400)))
+    assert statuses.count(200) == len(statuses)
+    assert WebSession.select().count() == 50  # one login session per user, the earlier ones are replaced
+    assert WebUser.select().where(WebUser.last_login.is_null()).count() == 0
+
+
+def test_register_and_change_password(db, client):
+    assert client.post('/register', {'username': 'new', 'password': 'pw1', 'data': {}})[0] == 200
+    assert client.post('/register', {'username': 'new', 'password': 'pw2', 'data': {}})[1]['details'] == 'Username already exists'
+    token = client.login('new', 'pw1')
+    assert client.post('/change_password', {'old_password': 'pw1', 'new_password': 'pw2'}, token)[0] == 200
+    assert client.post('/login', {'username': 'new', 'password': 'pw1'})[0] == 400
+    client.login('new', 'pw2')
+
+
+def test_busy_retry(db):
+    calls = []
+    app = Bottle()
+    app.install(TransactionPlugin(retries=2, backoff=0))
+
+    @app.post('/write')
+    def write():
+        calls.append(1)
+        WebUser.create(username=f'u{len(calls)}')
+        if len(calls) < 3:
+            raise peewee.OperationalError('database is locked')
+        return json.dumps(len(calls))
+
+    status, res = Client(app).request('POST', '/write')
+    assert (status, res) == (200, b'3')
+    assert [u.username for u in WebUser.select()] == ['u3']  # the tries before were rolled back